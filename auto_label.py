@@ -0,0 +1,232 @@
+import argparse
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from batch_analyze import IMAGE_EXTENSIONS, expand_inputs, plan_segments
+from bim_cache import load_compiled_bim
+from bim_index import ELEMENT_CLASSES
+from calibration import CALIBRATION_FILE, CalibrationFile, ProjectionTable
+from evidence_store import dhash, hamming
+
+DATASET_DIR = "dataset"
+
+
+def bim_source(ifc_file="metro_sp.ifc", json_file="metrosp.json"):
+    """Arquivo BIM usado (mesma prioridade do bim.load_bim_data: IFC, depois JSON)"""
+    for path in (ifc_file, json_file):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def projected_labels(compiled, calibration, frame_shape, min_visible=0.5, min_size=8):
+    """
+    Caixas candidatas (classe, x1, y1, x2, y2) dos elementos BIM projetados
+    no frame: recortadas à imagem, mantidas só se ao menos min_visible da
+    caixa projetada cai dentro do frame e o recorte tem min_size pixels.
+    """
+    height, width = frame_shape[:2]
+    table = ProjectionTable(compiled, calibration)
+    boxes = table.boxes
+    classes = np.asarray(compiled.classes, dtype=np.int64)
+
+    clipped = np.clip(boxes, 0, (width, height, width, height))
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    clipped_width = clipped[:, 2] - clipped[:, 0]
+    clipped_height = clipped[:, 3] - clipped[:, 1]
+    keep = ((classes >= 0) & table.in_front
+            & (clipped_width >= min_size) & (clipped_height >= min_size)
+            & (clipped_width * clipped_height >= min_visible * np.maximum(area, 1e-9)))
+    return np.column_stack((classes[keep], clipped[keep]))
+
+
+def yolo_label_text(labels, frame_shape):
+    """Linhas do formato YOLO: classe cx cy largura altura (normalizados)"""
+    height, width = frame_shape[:2]
+    lines = []
+    for element_class, x1, y1, x2, y2 in labels.tolist():
+        lines.append(f"{int(element_class)} {(x1 + x2) / 2 / width:.6f} {(y1 + y2) / 2 / height:.6f} "
+                     f"{(x2 - x1) / width:.6f} {(y2 - y1) / height:.6f}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def dataset_split(name, val_fraction):
+    """train/val determinístico pelo nome do arquivo (reprocessar não troca imagens de lado)"""
+    return "val" if zlib.crc32(name.encode()) % 1000 < val_fraction * 1000 else "train"
+
+
+_worker = {}
+
+
+def init_worker(bim_path, calibration_path, camera_id, options):
+    """Carrega o BIM compilado (mmap) e a calibração uma única vez por processo"""
+    cv2.setNumThreads(1)
+    _worker["compiled"] = load_compiled_bim(bim_path)
+    _worker["calibration"] = CalibrationFile(calibration_path).get(camera_id)
+    _worker["camera_id"] = camera_id
+    _worker["options"] = options
+    _worker["labels"] = {}
+
+
+def frame_labels(frame_shape):
+    """Rótulos do frame, calculados uma vez por tamanho de frame (câmera fixa)"""
+    key = frame_shape[:2]
+    if key not in _worker["labels"]:
+        options = _worker["options"]
+        labels = projected_labels(_worker["compiled"], _worker["calibration"], frame_shape,
+                                  options["min_visible"], options["min_size"])
+        _worker["labels"][key] = (labels, yolo_label_text(labels, frame_shape))
+    return _worker["labels"][key]
+
+
+def segment_frames(path, start_frame, end_frame, every):
+    """(frame_index, frame) de 1 a cada every frames do trecho; os demais só avançam o vídeo (grab)"""
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield 0, frame
+        return
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_index = start_frame
+    while end_frame is None or frame_index < end_frame:
+        if (frame_index - start_frame) % every:
+            if not cap.grab():
+                break
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame_index, frame
+        frame_index += 1
+    cap.release()
+
+
+def label_segment(segment, output):
+    """
+    Gera os pares imagem/rótulo de um trecho no processo de trabalho.
+    Frames quase idênticos (dHash a até dedup_threshold bits dos últimos
+    guardados) são descartados. Retorna as contagens do trecho.
+    """
+    path, start_frame, end_frame = segment
+    options = _worker["options"]
+    recent = deque(maxlen=options["dedup_window"])
+    stem = os.path.splitext(os.path.basename(path))[0]
+    counts = {"frames": 0, "duplicates": 0, "empty": 0, "images": 0, "boxes": 0}
+    for frame_index, frame in segment_frames(path, start_frame, end_frame, options["every"]):
+        counts["frames"] += 1
+        frame_hash = dhash(frame)
+        if any(hamming(frame_hash, previous) <= options["dedup_threshold"] for previous in recent):
+            counts["duplicates"] += 1
+            continue
+        recent.append(frame_hash)
+
+        labels, label_text = frame_labels(frame.shape)
+        if not len(labels) and not options["keep_empty"]:
+            counts["empty"] += 1
+            continue
+
+        name = f"cam{_worker['camera_id']}_{stem}_{frame_index:07d}"
+        split = dataset_split(name, options["val_fraction"])
+        cv2.imwrite(os.path.join(output, "images", split, f"{name}.jpg"), frame,
+                    [cv2.IMWRITE_JPEG_QUALITY, options["jpeg_quality"]])
+        with open(os.path.join(output, "labels", split, f"{name}.txt"), 'w', encoding='utf-8') as f:
+            f.write(label_text)
+        counts["images"] += 1
+        counts["boxes"] += len(labels)
+    return counts
+
+
+def write_dataset_yaml(output):
+    """data.yaml no formato do Ultralytics (classes na ordem de ELEMENT_CLASSES)"""
+    path = os.path.join(output, "data.yaml")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"path: {os.path.abspath(output)}\ntrain: images/train\nval: images/val\n")
+        f.write(f"nc: {len(ELEMENT_CLASSES)}\nnames: [{', '.join(ELEMENT_CLASSES)}]\n")
+    return path
+
+
+def auto_label(paths, output=DATASET_DIR, bim_path=None, calibration_path=CALIBRATION_FILE, camera_id=0,
+               workers=None, segment_seconds=60.0, **options):
+    """
+    Rotula automaticamente gravações de uma câmera calibrada projetando os
+    elementos BIM em cada frame e grava um dataset YOLO (imagens, rótulos e
+    data.yaml). Os trechos dos vídeos são distribuídos entre processos.
+    """
+    options = {"every": 5, "dedup_threshold": 6, "dedup_window": 32, "val_fraction": 0.1, "min_visible": 0.5,
+               "min_size": 8, "keep_empty": False, "jpeg_quality": 90, **options}
+    bim_path = bim_path or bim_source()
+    if bim_path is None:
+        raise FileNotFoundError("Nenhum arquivo BIM (metro_sp.ifc ou metrosp.json) encontrado")
+    calibration = CalibrationFile(calibration_path).get(camera_id)
+    if calibration is None:
+        raise ValueError(f"Câmera {camera_id} sem calibração em {calibration_path}")
+    if not calibration.has_intrinsics:
+        print("Aviso: calibração só com homografia do piso; as caixas são a planta dos elementos (sem altura) "
+              "e elementos finos podem ser descartados")
+    # Compila (ou valida) o cache BIM antes de abrir os processos
+    load_compiled_bim(bim_path)
+
+    for kind in ("images", "labels"):
+        for split in ("train", "val"):
+            os.makedirs(os.path.join(output, kind, split), exist_ok=True)
+
+    segments = plan_segments(paths, segment_seconds)
+    workers = workers or os.cpu_count() or 1
+    totals = {"frames": 0, "duplicates": 0, "empty": 0, "images": 0, "boxes": 0}
+    print(f"{len(segments)} trechos em {workers} processos")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(bim_path, calibration_path, camera_id, options)) as executor:
+        futures = [executor.submit(label_segment, segment, output) for segment in segments]
+        for future in as_completed(futures):
+            for key, value in future.result().items():
+                totals[key] += value
+    write_dataset_yaml(output)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera dataset YOLO rotulado a partir do BIM projetado nas gravações")
+    parser.add_argument("inputs", nargs="+", help="Vídeos, imagens ou diretórios gravados por uma câmera calibrada")
+    parser.add_argument("--output", default=DATASET_DIR, help="Diretório do dataset (padrão: dataset)")
+    parser.add_argument("--camera-id", default="0", help="Câmera no camera_calibration.json")
+    parser.add_argument("--bim", help="Arquivo BIM (padrão: metro_sp.ifc ou metrosp.json)")
+    parser.add_argument("--calibration", default=CALIBRATION_FILE, help="Arquivo de calibração")
+    parser.add_argument("--workers", type=int, help="Processos (padrão: número de CPUs)")
+    parser.add_argument("--every", type=int, default=5, help="Usa 1 a cada N frames dos vídeos")
+    parser.add_argument("--dedup-threshold", type=int, default=6,
+                        help="Bits de diferença do dHash abaixo dos quais o frame é considerado repetido")
+    parser.add_argument("--val", type=float, default=0.1, help="Fração das imagens na validação")
+    parser.add_argument("--min-visible", type=float, default=0.5,
+                        help="Fração mínima da caixa projetada dentro do frame")
+    parser.add_argument("--keep-empty", action="store_true", help="Mantém frames sem elementos (negativos)")
+    parser.add_argument("--segment-seconds", type=float, default=60.0, help="Duração dos trechos por processo")
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("Nenhum vídeo ou imagem encontrado")
+        return
+
+    start = time.perf_counter()
+    totals = auto_label(paths, args.output, args.bim, args.calibration, args.camera_id, args.workers,
+                        args.segment_seconds, every=max(1, args.every), dedup_threshold=args.dedup_threshold,
+                        val_fraction=args.val, min_visible=args.min_visible, keep_empty=args.keep_empty)
+    elapsed = time.perf_counter() - start
+    print(f"{totals['frames']} frames lidos, {totals['duplicates']} repetidos, {totals['empty']} sem elementos")
+    print(f"{totals['images']} imagens rotuladas ({totals['boxes']} caixas) em {elapsed:.1f}s "
+          f"({totals['images'] / elapsed * 3600 if elapsed else 0:.0f} imagens/hora)")
+    print(f"Dataset: {os.path.join(args.output, 'data.yaml')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+import argparse
+import csv
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v", ".mpg", ".mpeg")
+
+# Colunas gravadas em CSV/Parquet (uma linha por detecção)
+OUTPUT_COLUMNS = ("source", "frame_index", "ts", "class_name", "confidence",
+                  "position_x", "position_y", "deviation", "alert", "compliance")
+
+
+def expand_inputs(inputs):
+    """Expande diretórios em listas ordenadas de vídeos/imagens"""
+    expanded = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                    expanded.append(os.path.join(path, name))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def source_start_ms(path, start_time=None):
+    """Instante do primeiro frame: --start-time ou data de modificação do arquivo"""
+    from persistence import epoch_ms
+    return epoch_ms(start_time) if start_time else int(os.path.getmtime(path) * 1000)
+
+
+def iter_video(path, base_ms, start_frame=0, end_frame=None):
+    """Gera (source, frame_index, ts, frame) dos frames [start_frame, end_frame) de um vídeo"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"Erro: Não foi possível abrir o vídeo {path}")
+        return
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_index = start_frame
+    while end_frame is None or frame_index < end_frame:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield path, frame_index, base_ms + int(cap.get(cv2.CAP_PROP_POS_MSEC)), frame
+        frame_index += 1
+    cap.release()
+
+
+def iter_frames(paths, start_time=None):
+    """Gera (source, frame_index, ts, frame) de todos os vídeos e imagens, em ordem"""
+    for path in paths:
+        base_ms = source_start_ms(path, start_time)
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is None:
+                print(f"Erro ao ler imagem: {path}")
+                continue
+            yield path, 0, base_ms, frame
+            continue
+        yield from iter_video(path, base_ms)
+
+
+class FrameDecoder:
+    """Decodifica os frames em uma thread separada, sem descartar nenhum"""
+
+    def __init__(self, frames, queue_size=64):
+        self.frames = frames
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        try:
+            for item in self.frames:
+                self.queue.put(item)
+        finally:
+            self.queue.put(None)
+
+    def batches(self, batch_size):
+        """
+        Gera listas de até batch_size frames na ordem de decodificação. Um
+        lote nunca mistura tamanhos de frame: lotes mistos usariam a entrada
+        quadrada em vez da retangular, e a geometria de cada frame (logo as
+        detecções) dependeria de onde o lote começa, que muda com --workers.
+        """
+        batch = []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if batch and item[3].shape != batch[0][3].shape:
+                yield batch
+                batch = []
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def detection_rows(source, frame_index, ts, analysis):
+    """Linhas de saída (OUTPUT_COLUMNS) de um frame analisado"""
+    return [(source, frame_index, ts, info["class"], info["confidence"],
+             info["position"][0], info["position"][1], info.get("deviation"),
+             1 if info["alert"] else 0, analysis["compliance"])
+            for info in analysis["detections"]]
+
+
+class MemorySink:
+    """Guarda as linhas de saída em memória (usado pelo --verify)"""
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, source, frame_index, ts, analysis):
+        self.rows.extend(detection_rows(source, frame_index, ts, analysis))
+
+    def close(self):
+        pass
+
+
+def compare_rows(expected, actual, digits=4):
+    """Diferenças entre duas saídas (floats arredondados em digits casas): lista de linhas"""
+    def normalize(row):
+        return tuple(round(value, digits) if isinstance(value, float) else value for value in row)
+
+    differences = []
+    if len(expected) != len(actual):
+        differences.append(f"Número de linhas diferente: {len(expected)} x {len(actual)}")
+    for i, (left, right) in enumerate(zip(expected, actual)):
+        if normalize(left) != normalize(right):
+            differences.append(f"Linha {i}: {left} x {right}")
+    return differences
+
+
+class DatabaseSink:
+    """Grava no construction_monitor.db pelo gravador assíncrono"""
+
+    def __init__(self, db_path, camera_id=0):
+        from persistence import DetectionWriter
+        self.writer = DetectionWriter(db_path)
+        self.camera_id = camera_id
+
+    def write(self, source, frame_index, ts, analysis):
+        self.writer.log_frame(analysis["detections"], analysis["compliance"], analysis["alerts"],
+                              timestamp=ts, camera_id=self.camera_id)
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(OUTPUT_COLUMNS)
+
+    def write(self, source, frame_index, ts, analysis):
+        self.writer.writerows(detection_rows(source, frame_index, ts, analysis))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Acumula linhas e grava em lotes (row groups) com pyarrow"""
+
+    def __init__(self, path, row_group_size=100000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("source", pa.string()), ("frame_index", pa.int64()), ("ts", pa.int64()),
+            ("class_name", pa.string()), ("confidence", pa.float32()),
+            ("position_x", pa.float32()), ("position_y", pa.float32()), ("deviation", pa.float32()),
+            ("alert", pa.int8()), ("compliance", pa.float32()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def write(self, source, frame_index, ts, analysis):
+        self.rows.extend(detection_rows(source, frame_index, ts, analysis))
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            columns = list(zip(*self.rows))
+            self.writer.write_table(self.pa.Table.from_arrays(
+                [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+                schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def create_sink(output, camera_id=0):
+    """Escolhe o destino pela extensão: .csv, .parquet ou banco SQLite"""
+    if output.endswith(".csv"):
+        return CsvSink(output)
+    if output.endswith(".parquet"):
+        return ParquetSink(output)
+    return DatabaseSink(output, camera_id)
+
+
+class BatchStats:
+    """Estatísticas do processamento (conformidade média/mínima/máxima)"""
+
+    def __init__(self):
+        self.frames = 0
+        self.detections = 0
+        self.alerts = 0
+        self.compliance_sum = 0.0
+        self.compliance_min = float("inf")
+        self.compliance_max = float("-inf")
+
+    def add(self, analysis):
+        self.frames += 1
+        self.detections += len(analysis["detections"])
+        self.alerts += analysis["alerts"]
+        compliance = analysis["compliance"]
+        self.compliance_sum += compliance
+        self.compliance_min = min(self.compliance_min, compliance)
+        self.compliance_max = max(self.compliance_max, compliance)
+
+    def summary(self, elapsed):
+        lines = [f"Frames processados: {self.frames} em {elapsed:.1f}s "
+                 f"({self.frames / elapsed if elapsed else 0:.1f} frames/s)",
+                 f"Detecções: {self.detections} | Alertas: {self.alerts}"]
+        if self.frames:
+            lines.extend([f"Conformidade média: {self.compliance_sum / self.frames:.1f}%",
+                          f"Conformidade mínima: {self.compliance_min:.1f}%",
+                          f"Conformidade máxima: {self.compliance_max:.1f}%"])
+        return lines
+
+
+def analyze_frames(model, bim_data, frames, batch_size=16, conf=0.5, camera_id=0):
+    """
+    Decodifica em thread separada, infere em lotes e gera (source, frame_index,
+    ts, analysis). model pode ser um DetectionAdapter já criado (buffers reutilizados).
+    """
+    from bim import analyze_detections
+    from detector import DetectionAdapter
+
+    detector = model if isinstance(model, DetectionAdapter) else DetectionAdapter(model, conf=conf)
+    decoder = FrameDecoder(frames, queue_size=batch_size * 4)
+    for batch in decoder.batches(batch_size):
+        detections = detector.predict([item[3] for item in batch])
+        for (source, frame_index, ts, frame), frame_detections in zip(batch, detections):
+            yield source, frame_index, ts, analyze_detections(frame_detections, detector.names, bim_data,
+                                                              frame.shape, camera_id)
+
+
+def process_frames(model, bim_data, frames, sink, batch_size=16, conf=0.5, camera_id=0, stats=None):
+    """Analisa os frames e grava cada um no destino"""
+    stats = stats or BatchStats()
+    for source, frame_index, ts, analysis in analyze_frames(model, bim_data, frames, batch_size, conf, camera_id):
+        sink.write(source, frame_index, ts, analysis)
+        stats.add(analysis)
+    return stats
+
+
+# --- PROCESSAMENTO EM VÁRIOS PROCESSOS ---
+
+def keyframe_times(path):
+    """Instantes (s) dos quadros-chave do vídeo via ffprobe (lista vazia se indisponível)"""
+    if shutil.which("ffprobe") is None:
+        return []
+    try:
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+             "-show_entries", "frame=pts_time", "-of", "csv=p=0", path],
+            capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    times = []
+    for line in output.split():
+        try:
+            times.append(float(line.strip(",")))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def plan_segments(paths, segment_seconds=60.0):
+    """
+    Divide vídeos em trechos (path, primeiro frame, frame final) alinhados
+    a quadros-chave, para que cada processo comece a decodificar sem
+    depender dos frames anteriores. Imagens viram trechos de um frame.
+    Sem ffprobe os cortes caem a cada segment_seconds exatos.
+    """
+    segments = []
+    for path in paths:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            segments.append((path, 0, 1))
+            continue
+        cap = cv2.VideoCapture(path)
+        fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+        cap.release()
+        segment_frames = int(segment_seconds * fps)
+        if fps <= 0 or frame_count <= 0 or segment_frames <= 0 or frame_count <= segment_frames:
+            segments.append((path, 0, None))
+            continue
+
+        keyframes = sorted({round(t * fps) for t in keyframe_times(path)})
+        if keyframes:
+            cuts, next_cut = [], segment_frames
+            for frame in keyframes:
+                if frame >= next_cut and frame < frame_count:
+                    cuts.append(frame)
+                    next_cut = frame + segment_frames
+        else:
+            cuts = list(range(segment_frames, frame_count, segment_frames))
+
+        # O último trecho vai até o fim (a contagem de frames do contêiner pode ser imprecisa)
+        bounds = [0] + cuts
+        for start, end in zip(bounds, bounds[1:] + [None]):
+            segments.append((path, start, end))
+    return segments
+
+
+def compact_analysis(analysis):
+    """Somente o que os destinos e as estatísticas usam (menos dados entre processos)"""
+    return {
+        "detections": [{key: info.get(key) for key in ("class", "confidence", "position", "deviation", "alert")}
+                       for info in analysis["detections"]],
+        "compliance": analysis["compliance"],
+        "alerts": analysis["alerts"],
+        "status": analysis["status"],
+    }
+
+
+_worker = {}
+
+
+def init_worker(model_path, threads):
+    """Carrega o modelo YOLO e o BIM compilado uma única vez por processo"""
+    from bim import load_bim_data, load_model
+
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker["model"] = load_model(model_path)
+    _worker["bim_data"] = load_bim_data()
+
+
+def analyze_segment(segment, batch_size, conf, camera_id, start_time):
+    """Analisa um trecho no processo de trabalho e devolve os frames em ordem"""
+    path, start_frame, end_frame = segment
+    base_ms = source_start_ms(path, start_time)
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        frame = cv2.imread(path)
+        if frame is None:
+            print(f"Erro ao ler imagem: {path}")
+            return []
+        frames = iter([(path, 0, base_ms, frame)])
+    else:
+        frames = iter_video(path, base_ms, start_frame, end_frame)
+    if "detector" not in _worker:
+        from detector import DetectionAdapter
+        _worker["detector"] = DetectionAdapter(_worker["model"], conf=conf)
+    return [(source, frame_index, ts, compact_analysis(analysis))
+            for source, frame_index, ts, analysis in analyze_frames(
+                _worker["detector"], _worker["bim_data"], frames, batch_size, conf, camera_id)]
+
+
+def process_sharded(model_path, paths, sink, workers, batch_size=16, conf=0.5, camera_id=0,
+                    start_time=None, segment_seconds=60.0, stats=None):
+    """
+    Distribui os trechos entre processos e grava os resultados na ordem
+    original: a saída e as estatísticas são as mesmas de um único processo.
+    """
+    stats = stats or BatchStats()
+    segments = plan_segments(paths, segment_seconds)
+    print(f"{len(segments)} trechos em {workers} processos")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(model_path, threads)) as executor:
+        # Poucos trechos em andamento por vez limitam a memória dos resultados pendentes
+        pending = deque()
+        remaining = iter(segments)
+        for segment in remaining:
+            pending.append(executor.submit(analyze_segment, segment, batch_size, conf, camera_id, start_time))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            for source, frame_index, ts, analysis in pending.popleft().result():
+                sink.write(source, frame_index, ts, analysis)
+                stats.add(analysis)
+            segment = next(remaining, None)
+            if segment is not None:
+                pending.append(executor.submit(analyze_segment, segment, batch_size, conf, camera_id, start_time))
+    return stats
+
+
+def verify_sharding(args, paths):
+    """Roda as entradas em um processo e em --workers processos e compara as linhas de saída"""
+    from bim import load_bim_data, load_model
+
+    workers = max(2, args.workers)
+    single, sharded = MemorySink(), MemorySink()
+    process_frames(load_model(args.model), load_bim_data(), iter_frames(paths, args.start_time), single,
+                   args.batch, args.conf, args.camera_id)
+    process_sharded(args.model, paths, sharded, workers, args.batch, args.conf, args.camera_id,
+                    args.start_time, args.segment_seconds)
+    differences = compare_rows(single.rows, sharded.rows)
+    if differences:
+        print(f"Saídas diferentes entre 1 e {workers} processos ({len(differences)} diferenças):")
+        for line in differences[:20]:
+            print(f"  - {line}")
+        raise SystemExit(1)
+    print(f"Saídas idênticas entre 1 e {workers} processos ({len(single.rows)} linhas)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análise BIM + YOLO sem interface (vídeos e pastas de imagens)")
+    parser.add_argument("inputs", nargs="+", help="Arquivos de vídeo, imagens ou diretórios")
+    parser.add_argument("--output", default="construction_monitor.db",
+                        help="Destino: banco SQLite (padrão), arquivo .csv ou .parquet")
+    parser.add_argument("--model", help="Pesos YOLO ou nome registrado, ex.: construcao@2 (padrão: detector.json)")
+    parser.add_argument("--batch", type=int, default=16, help="Frames por chamada de inferência")
+    parser.add_argument("--conf", type=float, default=0.5, help="Confiança mínima")
+    parser.add_argument("--camera-id", type=int, default=0, help="Câmera de origem (calibração e banco)")
+    parser.add_argument("--start-time", help="Início da gravação (ISO); padrão: data do arquivo")
+    parser.add_argument("--workers", type=int, default=1, help="Processos em paralelo (cada um com seu modelo)")
+    parser.add_argument("--segment-seconds", type=float, default=60.0,
+                        help="Duração aproximada de cada trecho de vídeo com --workers")
+    parser.add_argument("--verify", action="store_true",
+                        help="Confere se --workers N gera a mesma saída que um processo (não grava o destino)")
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("Nenhum vídeo ou imagem encontrado")
+        return
+
+    if args.verify:
+        verify_sharding(args, paths)
+        return
+
+    if args.workers > 1:
+        run = lambda sink: process_sharded(args.model, paths, sink, args.workers, args.batch, args.conf,
+                                           args.camera_id, args.start_time, args.segment_seconds)
+    else:
+        from bim import load_bim_data, load_model
+
+        model = load_model(args.model)
+        bim_data = load_bim_data()
+        run = lambda sink: process_frames(model, bim_data, iter_frames(paths, args.start_time), sink,
+                                          args.batch, args.conf, args.camera_id)
+
+    sink = create_sink(args.output, args.camera_id)
+    start = time.perf_counter()
+    try:
+        stats = run(sink)
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"\nResultados gravados em: {args.output}")
+    for line in stats.summary(elapsed):
+        print(f"  - {line}")
+
+
+if __name__ == "__main__":
+    main()
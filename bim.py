@@ -1,394 +1,680 @@
 import cv2
-from ultralytics import YOLO
-import ifcopenshell
 import numpy as np
 import os
+import time
+from functools import partial
+
+from bim_cache import load_compiled_bim
+from bim_index import BIMElementIndex, ELEMENT_CLASSES
+from calibration import CALIBRATION_FILE, CalibrationFile, ProjectionCache
+from compliance import ComplianceEngine
+from detector import DetectionAdapter, load_config, load_detector, result_to_detections
+from event_log import EventLog, log_frame
+from evidence_store import EvidenceStore
+from motion_gate import MotionGate, offset_detections
+from ontology import default_ontology
+from overlay import Overlay, draw_bar_background, fill_bar, window_visible
+from persistence import DetectionWriter, epoch_ms
+from pipeline import FramePipeline
+from profiling import ProfileSession, Profiler
+from scheduler import LatencyScheduler, detector_levels
+from stream_stats import ComplianceStats
+from tracker import Tracker, update_track_compliance
 
 # 1. Carrega o modelo YOLO
-try:
-    model = YOLO("yolov8n.pt")  # Usando o arquivo YOLO disponível
-    print("Modelo YOLO carregado com sucesso!")
-except Exception as e:
-    print(f"Erro ao carregar modelo YOLO: {e}")
-    exit(1)
+def load_model(model_path=None):
+    """Carrega o detector (modelo e backend do detector.json) ou encerra o programa em caso de erro"""
+    try:
+        model = load_detector(model=model_path)
+        print("Modelo YOLO carregado com sucesso!")
+        return model
+    except Exception as e:
+        print(f"Erro ao carregar modelo YOLO: {e}")
+        exit(1)
 
 # 2. Carrega o arquivo BIM (IFC) ou cria dados simulados
-bim_data = None
-ifc_file = "metro_sp.ifc"
-json_file = "metrosp.json"
+def load_bim_data(ifc_file="metro_sp.ifc", json_file="metrosp.json", calibration_file=CALIBRATION_FILE):
+    """Carrega dados BIM do arquivo IFC, JSON ou dados simulados"""
+    bim_data = None
 
-# Tenta carregar arquivo IFC primeiro
-if os.path.exists(ifc_file):
-    try:
-        bim_model = ifcopenshell.open(ifc_file)
-        walls = bim_model.by_type("IfcWall")
-        beams = bim_model.by_type("IfcBeam")
-        print(f"Arquivo IFC carregado: {len(walls)} paredes, {len(beams)} vigas")
-        bim_data = {"walls": walls, "beams": beams, "type": "ifc"}
-    except Exception as e:
-        print(f"Erro ao carregar arquivo IFC: {e}")
-        bim_data = None
+    # Tenta carregar arquivo IFC primeiro, depois JSON (ambos via cache compilado)
+    for bim_file, bim_type, label in ((ifc_file, "ifc", "IFC"), (json_file, "json", "JSON")):
+        if not os.path.exists(bim_file):
+            continue
+        try:
+            compiled = load_compiled_bim(bim_file)
+            print(f"Arquivo {label} carregado: {compiled.count(0)} paredes, {compiled.count(1)} vigas, "
+                  f"{compiled.count(2)} pilares")
+            bim_data = {"type": bim_type, "compiled": compiled, "index": compiled.build_index()}
+        except Exception as e:
+            print(f"Erro ao carregar arquivo {label}: {e}")
+            bim_data = None
+        break
 
-# Se não conseguiu carregar IFC, tenta JSON
-elif os.path.exists(json_file):
-    try:
-        import json
-        with open(json_file, 'r', encoding='utf-8') as f:
-            json_bim = json.load(f)
-        
-        # Converte dados JSON para formato compatível
-        walls = []
-        beams = []
-        
-        for wall in json_bim['elements']['walls']:
-            # Cria objeto simulado de parede
-            wall_obj = type('Wall', (), {
-                'Geometry': [(wall['geometry']['start'][0], wall['geometry']['start'][1]),
-                           (wall['geometry']['end'][0], wall['geometry']['end'][1])],
-                'Name': wall['name'],
-                'properties': wall['properties']
-            })()
-            walls.append(wall_obj)
-        
-        for beam in json_bim['elements']['beams']:
-            # Cria objeto simulado de viga
-            beam_obj = type('Beam', (), {
-                'Geometry': [(beam['geometry']['start'][0], beam['geometry']['start'][1]),
-                           (beam['geometry']['end'][0], beam['geometry']['end'][1])],
-                'Name': beam['name'],
-                'properties': beam['properties']
-            })()
-            beams.append(beam_obj)
-        
-        print(f"Arquivo JSON carregado: {len(walls)} paredes, {len(beams)} vigas")
-        bim_data = {"walls": walls, "beams": beams, "type": "json", "raw_data": json_bim}
+    # Se nenhum arquivo encontrado, usa dados simulados
+    else:
+        print(f"Arquivos IFC '{ifc_file}' e JSON '{json_file}' não encontrados. Usando dados simulados.")
+        print("Dica: Execute 'python simple_bim_generator.py' para criar dados BIM")
         
-    except Exception as e:
-        print(f"Erro ao carregar arquivo JSON: {e}")
-        bim_data = None
-
-# Se nenhum arquivo encontrado, usa dados simulados
-else:
-    print(f"Arquivos IFC '{ifc_file}' e JSON '{json_file}' não encontrados. Usando dados simulados.")
-    print("Dica: Execute 'python simple_bim_generator.py' para criar dados BIM")
-    
-    # Dados simulados para teste
-    bim_data = {
-        "walls": [
-            {"Geometry": [(100, 100), (300, 100), (300, 200), (100, 200)]},
-            {"Geometry": [(400, 150), (600, 150), (600, 250), (400, 250)]}
-        ],
-        "beams": [
-            {"Geometry": [(200, 150), (500, 150)]},
-            {"Geometry": [(150, 300), (450, 300)]}
-        ],
-        "type": "simulated"
-    }
+        # Dados simulados para teste
+        bim_data = {
+            "walls": [
+                {"Geometry": [(100, 100), (300, 100), (300, 200), (100, 200)]},
+                {"Geometry": [(400, 150), (600, 150), (600, 250), (400, 250)]}
+            ],
+            "beams": [
+                {"Geometry": [(200, 150), (500, 150)]},
+                {"Geometry": [(150, 300), (450, 300)]}
+            ],
+            "type": "simulated"
+        }
+        bim_data["index"] = BIMElementIndex.from_simulated(bim_data)
+
+    if bim_data:
+        ontology = default_ontology()
+        bim_data["engine"] = ComplianceEngine(bim_data["index"], max_deviation=ontology.max_deviation_px,
+                                              class_weights=ontology.weights)
+
+    # Com calibração, a comparação é feita em metros no piso do BIM
+    if bim_data and "compiled" in bim_data and os.path.exists(calibration_file):
+        try:
+            bim_data["calibrations"] = CalibrationFile(calibration_file)
+            bim_data["projections"] = ProjectionCache(bim_data["compiled"])
+            bim_data["views"] = {}  # camera_id -> (calibração, visão da câmera)
+            bim_data["world_index"] = bim_data["compiled"].build_world_index()
+            print(f"Calibração carregada: {len(bim_data['calibrations'].cameras)} câmeras")
+        except Exception as e:
+            print(f"Erro ao carregar calibração: {e}")
+
+    return bim_data
+
+def camera_view(bim_data, camera_id=0):
+    """
+    Dados BIM vistos por uma câmera. Sem calibração a comparação é em
+    pixels (expected_position); com calibração, em metros no piso. A visão
+    (tabela de projeção e motor de conformidade) é montada uma vez por
+    calibração e reaproveitada em todos os frames; quando o
+    CalibrationFile recarrega, o objeto da calibração muda e ela é refeita.
+    """
+    calibrations = bim_data.get("calibrations") if bim_data else None
+    calibration = calibrations.get(camera_id) if calibrations else None
+    if calibration is None:
+        return bim_data
+
+    cached = bim_data["views"].get(camera_id)
+    if cached is not None and cached[0] is calibration:
+        return cached[1]
+    view = dict(bim_data)
+    view.update({
+        "calibration": calibration,
+        "projection": bim_data["projections"].get(calibration),
+        "index": bim_data["world_index"],
+        "engine": ComplianceEngine(bim_data["world_index"], gate=calibration.gate,
+                                   max_deviation=calibration.max_deviation,
+                                   class_weights=default_ontology().weights),
+    })
+    bim_data["views"][camera_id] = (calibration, view)
+    return view
 
 # 3. Função para calcular distância entre objetos detectados e BIM
-def calculate_deviation(detected_pos, bim_pos, tolerance=50):
+def calculate_deviation(detected_pos, bim_pos, tolerance=50, unit="px"):
     """
     Calcula desvio entre posição detectada e posição no BIM
-    tolerance: tolerância em pixels
+    tolerance: tolerância em pixels (ou metros, com calibração)
     """
     deviation = np.linalg.norm(np.array(detected_pos) - np.array(bim_pos))
+    return deviation_alert(deviation, tolerance, unit)
+
+def deviation_alert(deviation, tolerance=50, unit="px"):
+    """Mensagem de alerta quando o desvio passa da tolerância (ou None)"""
     if deviation > tolerance:
-        return f"ALERTA: Desvio de {deviation:.1f}px!"
+        precision = 2 if unit == "m" else 1
+        return f"ALERTA: Desvio de {deviation:.{precision}f}{unit}!"
     return None
 
-# 4. Função para calcular porcentagem de conformidade
-def calculate_compliance_percentage(detections, bim_data):
+# 4. Função para associar detecções aos elementos BIM
+def match_detections(detections, bim_data, frame_shape=None, boxes=None, classes=None):
+    """
+    Associa as detecções aos elementos BIM (um-para-um, por classe) com
+    o motor de conformidade vetorizado. Retorna a avaliação do frame;
+    element_idx = -1 indica detecção sem correspondência. boxes (N x 4)
+    e classes (classe BIM de cada detecção, da ontologia) evitam
+    remontá-las a partir dos dicionários.
+    """
+    if classes is None:
+        classes = default_ontology().classify_names([det['class'] for det in detections])
+    if not bim_data or "engine" not in bim_data:
+        return {"score": 0.0, "element_idx": np.full(len(detections), -1, dtype=np.int64),
+                "distances": np.full(len(detections), np.inf)}
+
+    visible = None
+    if "calibration" in bim_data:
+        if boxes is None:
+            boxes = np.array([det['box'] for det in detections], dtype=np.float64).reshape(-1, 4)
+        positions = detection_points(boxes, bim_data)
+        for det, world_position in zip(detections, positions):
+            det["world_position"] = tuple(world_position)
+        if frame_shape is not None:
+            visible = bim_data["projection"].visible(frame_shape)
+    elif boxes is not None:
+        positions = detection_points(boxes, bim_data)
+    else:
+        positions = np.array([det['position'] for det in detections], dtype=np.float64).reshape(-1, 2)
+    return bim_data["engine"].evaluate(positions, classes, visible)
+
+def detection_points(boxes, bim_data):
+    """Posição comparada com o BIM: centro da caixa (pixels) ou base da caixa no piso (metros)"""
+    if bim_data and "calibration" in bim_data:
+        # Base da caixa (ponto de contato com o piso) levada para metros
+        foot_points = np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]))
+        return bim_data["calibration"].image_to_world(foot_points)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+# 5. Função para calcular porcentagem de conformidade
+def calculate_compliance_percentage(detections, bim_data, evaluation=None):
     """Calcula porcentagem de conformidade entre BIM e detecções"""
     if not detections or not bim_data:
         return 0.0
-    
-    total_deviation = 0
-    total_elements = 0
-    matched_elements = 0
-    
-    for det in detections:
-        class_name = det['class'].lower()
-        detected_pos = det['position']
-        confidence = det['confidence']
-        
-        # Procura elemento correspondente no BIM
-        element_found = False
-        
-        # Verifica paredes
-        if "walls" in bim_data:
-            for wall in bim_data["walls"]:
-                if 'wall' in class_name or 'parede' in class_name or 'person' in class_name:
-                    if bim_data['type'] == 'json' and 'raw_data' in bim_data:
-                        # Para dados JSON
-                        for json_wall in bim_data['raw_data']['elements']['walls']:
-                            if 'expected_position' in json_wall:
-                                expected_pos = json_wall['expected_position']
-                                deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                                total_deviation += deviation
-                                total_elements += 1
-                                matched_elements += 1
-                                element_found = True
-                                break
-                    else:
-                        # Para dados simulados
-                        geom = wall["Geometry"]
-                        expected_pos = ((geom[0][0] + geom[2][0]) / 2, (geom[0][1] + geom[2][1]) / 2)
-                        deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                        total_deviation += deviation
-                        total_elements += 1
-                        matched_elements += 1
-                        element_found = True
-                        break
-        
-        # Verifica vigas
-        if not element_found and "beams" in bim_data:
-            for beam in bim_data["beams"]:
-                if 'beam' in class_name or 'viga' in class_name or 'chair' in class_name:
-                    if bim_data['type'] == 'json' and 'raw_data' in bim_data:
-                        # Para dados JSON
-                        for json_beam in bim_data['raw_data']['elements']['beams']:
-                            if 'expected_position' in json_beam:
-                                expected_pos = json_beam['expected_position']
-                                deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                                total_deviation += deviation
-                                total_elements += 1
-                                matched_elements += 1
-                                element_found = True
-                                break
-                    else:
-                        # Para dados simulados
-                        geom = beam["Geometry"]
-                        expected_pos = ((geom[0][0] + geom[1][0]) / 2, (geom[0][1] + geom[1][1]) / 2)
-                        deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                        total_deviation += deviation
-                        total_elements += 1
-                        matched_elements += 1
-                        element_found = True
-                        break
-        
-        # Se não encontrou correspondência, conta como elemento extra
-        if not element_found:
-            total_elements += 1
-    
-    if total_elements == 0:
-        return 0.0
-    
-    # Calcula porcentagem de conformidade
-    avg_deviation = total_deviation / total_elements if total_deviation > 0 else 0
-    max_acceptable_deviation = 150  # pixels
-    
-    # Fatores de conformidade
-    position_compliance = max(0, 100 - (avg_deviation / max_acceptable_deviation) * 100)
-    detection_compliance = (matched_elements / total_elements) * 100
-    
-    # Conformidade final (média ponderada)
-    final_compliance = (position_compliance * 0.7) + (detection_compliance * 0.3)
-    
-    return max(0, min(100, final_compliance))
-
-# 5. Função para obter posição do BIM (simulada ou real)
-def get_bim_position(element_type, index=0):
-    """Obtém posição de um elemento do BIM"""
-    if bim_data is None:
-        return None
-    
-    if element_type == "beam" and "beams" in bim_data:
-        if index < len(bim_data["beams"]):
-            beam = bim_data["beams"][index]
-            if bim_data["type"] == "ifc":
-                # Para arquivo IFC real
-                return (beam.Geometry[0][0], beam.Geometry[0][1])
-            else:
-                # Para dados simulados
-                geom = beam["Geometry"]
-                return ((geom[0][0] + geom[1][0]) / 2, (geom[0][1] + geom[1][1]) / 2)
-    
-    elif element_type == "wall" and "walls" in bim_data:
-        if index < len(bim_data["walls"]):
-            wall = bim_data["walls"][index]
-            if bim_data["type"] == "ifc":
-                # Para arquivo IFC real
-                return (wall.Geometry[0][0], wall.Geometry[0][1])
-            else:
-                # Para dados simulados
-                geom = wall["Geometry"]
-                return ((geom[0][0] + geom[2][0]) / 2, (geom[0][1] + geom[2][1]) / 2)
-    
-    return None
-
-# 5. Captura de vídeo
-cap = cv2.VideoCapture(0)
+    if evaluation is None:
+        evaluation = match_detections(detections, bim_data)
+    return evaluation["score"]
 
-if not cap.isOpened():
-    print("Erro: Não foi possível abrir a câmera!")
-    exit(1)
+# 6. Funções de análise e exibição de cada frame
+def get_compliance_status(compliance_percentage):
+    """Determina cor e status baseado na conformidade"""
+    if compliance_percentage >= 80:
+        return (0, 255, 0), "EXCELENTE"  # Verde
+    elif compliance_percentage >= 60:
+        return (0, 255, 255), "BOM"  # Amarelo
+    elif compliance_percentage >= 40:
+        return (0, 165, 255), "REGULAR"  # Laranja
+    return (0, 0, 255), "CRÍTICO"  # Vermelho
 
-print("Pressione 'q' para sair, 's' para salvar screenshot")
+def analyze_frame(frame, detector, bim_data, camera_id=0):
+    """Detecta objetos com YOLO (DetectionAdapter) e compara com o BIM (sem desenhar no frame)"""
+    detections = detector.predict([frame])[0]
+    return analyze_detections(detections, detector.names, bim_data, frame.shape, camera_id)
 
-# Contadores para estatísticas
-detection_count = 0
-alert_count = 0
+def detect(frame, detector, gate=None):
+    """Roda o detector no frame inteiro ou só no recorte da ROI do gate"""
+    crop, offset = gate.crop(frame) if gate is not None else (frame, (0, 0))
+    return offset_detections(detector.predict([crop])[0], offset)
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Erro ao ler frame da câmera")
-        break
+def analyze_tracked(detections, names, bim_data, tracker, frame_shape=None, camera_id=0):
+    """
+    Análise por elemento rastreado: o rastreador avança a cada frame e, quando
+    o detector rodou (detections não é None), associa as novas detecções.
+    Só tracks novos são associados ao BIM; os demais carregam elemento e desvio.
+    """
+    bim_data = camera_view(bim_data, camera_id)
+    calibration = bim_data.get("calibration") if bim_data else None
+    tracker.predict()
+    if detections is not None:
+        tracker.update(detections)
 
-    # Detecta objetos com YOLO
-    try:
-        results = model.predict(frame, conf=0.5, verbose=False)
-    except Exception as e:
-        print(f"Erro na detecção YOLO: {e}")
-        continue
+    boxes = tracker.boxes
+    ontology = default_ontology()
+    classes = ontology.classify(tracker.cls, names)
+    visible = None
+    if calibration is not None and frame_shape is not None:
+        visible = bim_data["projection"].visible(frame_shape)
+    if bim_data and "engine" in bim_data:
+        evaluation = update_track_compliance(bim_data["engine"], tracker, detection_points(boxes, bim_data),
+                                             classes, visible)
+    else:
+        rows = np.flatnonzero(tracker.confirmed)
+        evaluation = {"score": 0.0, "rows": rows, "element_idx": np.full(len(rows), -1, dtype=np.int64),
+                      "distances": np.full(len(rows), np.nan), "missing": []}
 
-    # Lista para armazenar informações de detecção
+    index = bim_data["index"] if bim_data else None
+    unit = "m" if calibration is not None else "px"
+    rows = evaluation["rows"]
     detection_info = []
-    current_detections = 0
-
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            cls = int(box.cls[0])
-            class_name = model.names[cls]
-            confidence = float(box.conf[0])
-            current_detections += 1
-
-            # Desenha a caixa no frame
-            color = (0, 255, 0)  # Verde
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(frame, f"{class_name} {confidence:.2f}", (x1, y1 - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-            # --- COMPARAÇÃO COM O BIM ---
-            detected_pos = ((x1 + x2) / 2, (y1 + y2) / 2)
-            
-            # Verifica diferentes tipos de objetos
-            analysis_result = "Sem correspondência BIM"
-            alert_message = None
-            
-            for obj_type in ["beam", "wall", "person", "chair"]:
-                if class_name.lower() in obj_type or obj_type in class_name.lower():
-                    bim_pos = get_bim_position(obj_type, 0)
-                    if bim_pos:
-                        alert = calculate_deviation(detected_pos, bim_pos)
-                        if alert:
-                            alert_count += 1
-                            alert_message = alert
-                            analysis_result = f"DESVIO: {alert}"
-                            cv2.putText(frame, alert, (50, 50), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                        else:
-                            analysis_result = f"OK - {obj_type} conforme BIM"
-                    else:
-                        analysis_result = f"Detectado: {class_name} (sem dados BIM)"
-                    break
-            
-            # Adiciona informação de análise à lista
-            detection_info.append({
-                "class": class_name,
-                "confidence": confidence,
-                "position": detected_pos,
-                "analysis": analysis_result,
-                "alert": alert_message
-            })
+    for (x1, y1, x2, y2), track_id, cls, conf, element, deviation, element_class, tolerance in zip(
+            boxes[rows].astype(int).tolist(), tracker.ids[rows].tolist(), tracker.cls[rows].tolist(),
+            tracker.conf[rows].tolist(), evaluation["element_idx"].tolist(), evaluation["distances"].tolist(),
+            classes[rows].tolist(), ontology.tolerances(classes[rows], calibration).tolist()):
+        info = {
+            "class": names[cls],
+            "confidence": conf,
+            "position": ((x1 + x2) / 2, (y1 + y2) / 2),
+            "box": (x1, y1, x2, y2),
+            "track_id": track_id,
+            "analysis": "Sem correspondência BIM",
+            "alert": None
+        }
+        if element >= 0:
+            info["deviation"] = deviation
+            alert = deviation_alert(deviation, tolerance, unit)
+            if alert:
+                info["alert"] = alert
+                info["analysis"] = f"DESVIO: {alert}"
+            else:
+                info["analysis"] = f"OK - {ELEMENT_CLASSES[element_class]} {index.ids[element]} conforme BIM"
+        elif element_class >= 0:
+            info["analysis"] = f"Detectado: {info['class']} (sem dados BIM)"
+        detection_info.append(info)
+
+    compliance_percentage = evaluation["score"] if detection_info else 0.0
+    compliance_color, compliance_status = get_compliance_status(compliance_percentage)
+    return {
+        "detections": detection_info,
+        "compliance": compliance_percentage,
+        "color": compliance_color,
+        "status": compliance_status,
+        "alerts": sum(1 for info in detection_info if info["alert"]),
+        "missing": [index.ids[i] for i in evaluation["missing"]],
+        "projection": bim_data.get("projection") if bim_data else None,
+        "boxes": detections,
+    }
+
+def analyze_results(results, names, bim_data, camera_id=0):
+    """Compara resultados do ultralytics já calculados com o BIM"""
+    result = results[0]
+    return analyze_detections(result_to_detections(result), names, bim_data, result.orig_shape, camera_id)
+
+def analyze_detections(detections, names, bim_data, frame_shape=None, camera_id=0):
+    """Compara as detecções (array DETECTION_DTYPE de um frame) com o BIM"""
+    bim_data = camera_view(bim_data, camera_id)
+    calibration = bim_data.get("calibration") if bim_data else None
+    boxes = detections["box"].astype(np.int32)
+
+    # Uma conversão para Python por coluna, não por caixa
+    detection_info = [{
+        "class": names[cls],
+        "confidence": conf,
+        "position": ((x1 + x2) / 2, (y1 + y2) / 2),
+        "box": (x1, y1, x2, y2),
+        "analysis": "Sem correspondência BIM",
+        "alert": None
+    } for (x1, y1, x2, y2), conf, cls in zip(boxes.tolist(), detections["conf"].tolist(),
+                                             detections["cls"].tolist())]
+
+    # --- COMPARAÇÃO COM O BIM ---
+    # Classes BIM do frame inteiro num gather da ontologia; uma única associação resolve todas as detecções
+    ontology = default_ontology()
+    classes = ontology.classify(detections["cls"], names)
+    evaluation = match_detections(detection_info, bim_data, frame_shape, boxes.astype(np.float64), classes)
+    index = bim_data["index"] if bim_data else None
+    unit = "m" if calibration is not None else "px"
+    for info, element, distance, element_class, tolerance in zip(
+            detection_info, evaluation["element_idx"].tolist(), evaluation["distances"].tolist(),
+            classes.tolist(), ontology.tolerances(classes, calibration).tolist()):
+        if element >= 0:
+            # Desvio da associação: mesma distância (pixels ou metros no piso) que o motor usou
+            info["deviation"] = distance
+            alert = deviation_alert(distance, tolerance, unit)
+            if alert:
+                info["alert"] = alert
+                info["analysis"] = f"DESVIO: {alert}"
+            else:
+                info["analysis"] = f"OK - {ELEMENT_CLASSES[element_class]} {index.ids[element]} conforme BIM"
+        elif element_class >= 0:
+            info["analysis"] = f"Detectado: {info['class']} (sem dados BIM)"
 
     # Calcula porcentagem de conformidade
-    compliance_percentage = calculate_compliance_percentage(detection_info, bim_data)
-    
-    # Determina cor e status baseado na conformidade
-    if compliance_percentage >= 80:
-        compliance_color = (0, 255, 0)  # Verde
-        compliance_status = "EXCELENTE"
-    elif compliance_percentage >= 60:
-        compliance_color = (0, 255, 255)  # Amarelo
-        compliance_status = "BOM"
-    elif compliance_percentage >= 40:
-        compliance_color = (0, 165, 255)  # Laranja
-        compliance_status = "REGULAR"
-    else:
-        compliance_color = (0, 0, 255)  # Vermelho
-        compliance_status = "CRÍTICO"
+    compliance_percentage = calculate_compliance_percentage(detection_info, bim_data, evaluation)
+    compliance_color, compliance_status = get_compliance_status(compliance_percentage)
+
+    return {
+        "detections": detection_info,
+        "compliance": compliance_percentage,
+        "color": compliance_color,
+        "status": compliance_status,
+        "alerts": sum(1 for info in detection_info if info["alert"]),
+        "missing": [index.ids[i] for i in evaluation.get("missing", [])],
+        "projection": bim_data.get("projection") if bim_data else None,
+        "boxes": detections,
+    }
+
+# Cache do HUD compartilhado pelas janelas (camadas fixas e textos pré-renderizados)
+HUD = Overlay()
 
-    # Exibe informações na tela
-    y_offset = 30
-    cv2.putText(frame, "BIM + YOLO Integration", (10, y_offset), 
+def draw_static_hud(canvas, bim_label, bar_x, bar_y, bar_width, bar_height):
+    """Elementos fixos do HUD: título, tipo do BIM, fundo e borda da barra de conformidade"""
+    cv2.putText(canvas, "BIM + YOLO Integration", (10, 30), 
                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-    y_offset += 30
-    
-    cv2.putText(frame, f"BIM: {bim_data['type'] if bim_data else 'N/A'}", (10, y_offset), 
+    cv2.putText(canvas, bim_label, (10, 60), 
                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-    y_offset += 25
-    
-    # Informações de conformidade
-    cv2.putText(frame, f"Conformidade: {compliance_percentage:.1f}%", (10, y_offset), 
-               cv2.FONT_HERSHEY_SIMPLEX, 0.6, compliance_color, 2)
-    y_offset += 25
-    
-    cv2.putText(frame, f"Status: {compliance_status}", (10, y_offset), 
-               cv2.FONT_HERSHEY_SIMPLEX, 0.5, compliance_color, 1)
-    y_offset += 25
-    
-    cv2.putText(frame, f"Detecções: {current_detections} | Total: {detection_count} | Alertas: {alert_count}", 
-               (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-    y_offset += 25
+    draw_bar_background(canvas, bar_x, bar_y, bar_width, bar_height)
+
+def draw_analysis(frame, analysis, bim_data, detection_count, alert_count, overlay=HUD):
+    """
+    Desenha caixas, alertas e informações de conformidade no frame. As partes
+    fixas do HUD vêm de uma camada pré-renderizada e os textos de sprites em
+    cache (overlay.Overlay): nada é rasterizado de novo se o valor não mudou.
+    """
+    detection_info = analysis["detections"]
+    compliance_percentage = analysis["compliance"]
+    compliance_color = analysis["color"]
+
+    # Posições esperadas dos elementos BIM projetadas na imagem (tabela pré-calculada)
+    projection = analysis.get("projection")
+    if projection is not None:
+        for x, y in projection.centers[projection.in_front].astype(int):
+            cv2.circle(frame, (x, y), 4, (255, 255, 0), -1)
+
+    for info in detection_info:
+        # Desenha a caixa no frame
+        x1, y1, x2, y2 = info["box"]
+        color = (0, 255, 0)  # Verde
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        overlay.text(frame, f"{info['class']} {info['confidence']:.2f}", (x1, y1 - 10), 0.5, color, 2)
+        if info["alert"]:
+            overlay.text(frame, info["alert"], (50, 50), 0.7, (0, 0, 255), 2)
 
     # Barra de progresso visual da conformidade
     bar_width = 300
     bar_height = 15
-    bar_x, bar_y = 10, y_offset
-    
-    # Fundo da barra
-    cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), 
-                 (100, 100, 100), -1)
-    
+    bar_x, bar_y = 10, 160
+
+    # Título, tipo do BIM e fundo/borda da barra: camada estática
+    bim_label = f"BIM: {bim_data['type'] if bim_data else 'N/A'}"
+    overlay.layer(frame, ("hud", bim_label),
+                  lambda canvas: draw_static_hud(canvas, bim_label, bar_x, bar_y, bar_width, bar_height))
+
+    # Informações de conformidade
+    overlay.text(frame, f"Conformidade: {compliance_percentage:.1f}%", (10, 85), 0.6, compliance_color, 2)
+    overlay.text(frame, f"Status: {analysis['status']}", (10, 110), 0.5, compliance_color, 1)
+    overlay.text(frame, f"Detecções: {len(detection_info)} | Total: {detection_count} | Alertas: {alert_count}",
+                 (10, 135), 0.5, (255, 255, 255), 1)
+
     # Preenchimento da barra
-    fill_width = int((compliance_percentage / 100) * bar_width)
-    cv2.rectangle(frame, (bar_x, bar_y), (bar_x + fill_width, bar_y + bar_height), 
-                 compliance_color, -1)
-    
-    # Borda da barra
-    cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), 
-                 (255, 255, 255), 1)
-    
-    y_offset += 30
+    fill_bar(frame, bar_x, bar_y, bar_width, bar_height, compliance_percentage / 100, compliance_color)
+
+    y_offset = bar_y + 30
 
     # Exibe informações de cada detecção
     for i, info in enumerate(detection_info):
         if y_offset < frame.shape[0] - 50:  # Evita sair da tela
             color = (0, 0, 255) if info["alert"] else (0, 255, 0)
             text = f"{i+1}. {info['class']} ({info['confidence']:.2f}) - {info['analysis']}"
-            cv2.putText(frame, text, (10, y_offset), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+            overlay.text(frame, text, (10, y_offset), 0.4, color, 1)
             y_offset += 20
 
-    # Imprime informações no console também
-    if detection_info:
-        print(f"\n--- Frame {detection_count} ---")
-        print(f"Conformidade BIM: {compliance_percentage:.1f}% - Status: {compliance_status}")
-        for i, info in enumerate(detection_info):
-            status = "⚠️ ALERTA" if info["alert"] else "✅ OK"
-            print(f"{status} {info['class']} (conf: {info['confidence']:.2f}) - {info['analysis']}")
-    else:
-        print(f"\n--- Frame {detection_count} ---")
-        print(f"Conformidade BIM: {compliance_percentage:.1f}% - Status: {compliance_status}")
-        print("Nenhuma detecção neste frame")
-    
-    detection_count += 1
-
-    cv2.imshow("BIM + YOLO Integration", frame)
-    
+def draw_profile(frame, profiler, camera_id=None, overlay=HUD):
+    """Tempos p50/p95 de cada etapa no canto superior direito do frame"""
+    x = frame.shape[1] - 230
+    for i, line in enumerate(profiler.hud_lines(camera_id)):
+        overlay.text(frame, line, (x, 30 + 18 * i), 0.45, (255, 255, 0), 1)
+
+# 7. Captura de vídeo em pipeline (captura -> inferência -> renderização)
+def handle_key(frame, evidence):
+    """Processa teclas: retorna False para sair"""
     key = cv2.waitKey(1) & 0xFF
     if key == ord('q'):
-        break
+        return False
     elif key == ord('s'):
-        cv2.imwrite("bim_yolo_screenshot.jpg", frame)
-        print("Screenshot salvo como 'bim_yolo_screenshot.jpg'")
+        path = evidence.save_now(frame)
+        print(f"Screenshot salvo como '{path}'")
+    return True
+
+def record_frame(writer, evidence, frame, analysis, camera_id=0):
+    """Grava o frame no banco e, se houver alerta, salva a evidência (ambos assíncronos)"""
+    timestamp = epoch_ms()
+    writer.log_frame(analysis["detections"], analysis["compliance"], analysis["alerts"],
+                     timestamp=timestamp, camera_id=camera_id)
+    if analysis["alerts"]:
+        boxes = [info["box"] for info in analysis["detections"] if info["alert"]]
+        evidence.submit(frame, boxes, camera_id, timestamp)
+
+def run_single_source(source, model, bim_data, camera_id=0, motion_gate=True, tracking=True,
+                      profiler=None, session=None, profile_hud=False, scheduler=None):
+    """
+    Executa a análise de uma fonte com o pipeline em threads. profiler
+    (profiling.Profiler) mede cada etapa do frame; session
+    (profiling.ProfileSession) roda o cProfile/amostragem por N frames;
+    scheduler (scheduler.LatencyScheduler) ajusta entrada, confiança e
+    stride do detector pelo tempo de detecção.
+    """
+    # Contadores para estatísticas
+    counters = {"detection_count": 0, "alert_count": 0}
+    stats = ComplianceStats()
+    writer = DetectionWriter()
+    evidence = EvidenceStore()
+    profiler = profiler or Profiler(enabled=False)
+
+    def render(frame, analysis):
+        with profiler.stage("gravação"):
+            record_frame(writer, evidence, frame, analysis, camera_id)
+            stats.update(analysis, camera_id)
+        counters["alert_count"] += analysis["alerts"]
+        with profiler.stage("desenho"):
+            draw_analysis(frame, analysis, bim_data, counters["detection_count"], counters["alert_count"])
+            if profile_hud:
+                draw_profile(frame, profiler)
+        log_frame(analysis, camera_id, counters["detection_count"])
+        counters["detection_count"] += 1
+
+        with profiler.stage("imshow"):
+            cv2.imshow("BIM + YOLO Integration", frame)
+            keep_running = handle_key(frame, evidence)
+        profiler.maybe_dump()
+        return keep_running
+
+    detector = DetectionAdapter(model)
+    gate = MotionGate() if motion_gate else None
+    tracker = Tracker() if tracking else None
+    state = {}
+
+    def infer(frame):
+        level = scheduler.level if scheduler is not None else None
+        with profiler.stage("gate"):
+            strided = False
+            if level is not None and "analysis" in state:
+                # Sob carga o escalonador só manda 1 a cada stride frames ao detector; os frames
+                # pulados nem passam pelo gate, que assim não perde o movimento nem a atualização periódica
+                state["frame"] = state.get("frame", 0) + 1
+                strided = state["frame"] % level.stride != 0
+            # Sem rastreador, o primeiro frame sempre passa pelo detector
+            run = not strided and (gate is None or gate.should_infer(frame)
+                                   or (tracker is None and "analysis" not in state))
+        if not run and tracker is None:
+            # Cena parada: reaproveita a análise anterior
+            return state["analysis"]
+        detections = None
+        if run:
+            if level is not None:
+                detector.set_imgsz(level.imgsz)
+                detector.conf = level.conf
+            with profiler.stage("detecção"):
+                start = time.perf_counter()
+                detections = detect(frame, detector, gate)
+                if scheduler is not None:
+                    scheduler.observe(time.perf_counter() - start)
+        with profiler.stage("conformidade"):
+            if tracker is not None:
+                # Sem detecção neste frame o rastreador só interpola as caixas
+                analysis = analyze_tracked(detections, detector.names, bim_data, tracker, frame.shape, camera_id)
+            else:
+                analysis = analyze_detections(detections, detector.names, bim_data, frame.shape, camera_id)
+        if gate is not None:
+            gate.set_projection(analysis["projection"], frame.shape)
+        if scheduler is not None and analysis["alerts"]:
+            scheduler.alert()
+        state["analysis"] = analysis
+        if session is not None:
+            session.frame()
+        return analysis
+
+    pipeline = FramePipeline(source, infer, render)
+    try:
+        if not pipeline.run():
+            exit(1)
+    finally:
+        writer.close()
+        evidence.close()
+
+    cv2.destroyAllWindows()
+    print(f"\nPrograma finalizado. Total de frames: {counters['detection_count']}, Alertas: {counters['alert_count']}")
+    print("\nConformidade:")
+    for line in stats.report():
+        print(f"  - {line}")
+    print(evidence.report())
+    if gate is not None:
+        print(gate.report())
+    if scheduler is not None:
+        print(scheduler.report())
+    print("\nLatência por estágio:")
+    for line in pipeline.report() + profiler.report():
+        print(f"  - {line}")
 
-cap.release()
-cv2.destroyAllWindows()
-print(f"\nPrograma finalizado. Total de frames: {detection_count}, Alertas: {alert_count}")
+def run_multi_source(sources, model, bim_data, max_batch=8, max_wait=0.02, motion_gate=True, tracking=True,
+                     view=None, profiler=None, session=None, profile_hud=False, scheduler_factory=None):
+    """
+    Executa a análise de várias fontes com um único modelo e inferência em
+    lote. view: índices dos streams exibidos (None = todos); os demais são
+    analisados e gravados, mas não desenhados. profiler e session como em
+    run_single_source (etapas medidas por câmera); scheduler_factory cria
+    o escalonador de cada stream no servidor de inferência.
+    """
+    from inference_server import BatchInferenceServer
 
+    profiler = profiler or Profiler(enabled=False)
+    server = BatchInferenceServer(model, sources, max_batch=max_batch, max_wait=max_wait,
+                                  gate_factory=MotionGate if motion_gate else None, profiler=profiler,
+                                  scheduler_factory=scheduler_factory)
+    server.start()
+    counters = {stream.stream_id: {"detection_count": 0, "alert_count": 0} for stream in server.streams}
+    last = {}  # stream_id -> (detecções, análise) para reaproveitar frames sem movimento
+    trackers = {stream.stream_id: Tracker() for stream in server.streams} if tracking else {}
+    stats = ComplianceStats()
+    writer = DetectionWriter()
+    evidence = EvidenceStore()
+    viewed = set(counters) if view is None else set(view)
+    shown = set()
+
+    try:
+        running = True
+        while running and not server.done.is_set():
+            for stream in server.streams:
+                item = server.get_result(stream.stream_id, timeout=0.001)
+                if item is None:
+                    continue
+                frame_index, captured_at, frame, detections = item
+                previous = last.get(stream.stream_id)
+                fresh = previous is None or previous[0] is not detections
+                with profiler.stage("conformidade", stream.stream_id):
+                    if tracking:
+                        analysis = analyze_tracked(detections if fresh else None, model.names, bim_data,
+                                                   trackers[stream.stream_id], frame.shape, stream.stream_id)
+                        last[stream.stream_id] = (detections, analysis)
+                        server.set_projection(stream.stream_id, analysis["projection"], frame.shape)
+                    elif not fresh:
+                        analysis = previous[1]
+                    else:
+                        analysis = analyze_detections(detections, model.names, bim_data, frame.shape,
+                                                      stream.stream_id)
+                        last[stream.stream_id] = (detections, analysis)
+                        server.set_projection(stream.stream_id, analysis["projection"], frame.shape)
+                with profiler.stage("gravação", stream.stream_id):
+                    record_frame(writer, evidence, frame, analysis, stream.stream_id)
+                    stats.update(analysis, stream.stream_id)
+                if session is not None:
+                    session.frame()
+                profiler.maybe_dump()
+                if stream.stream_id in server.schedulers and analysis["alerts"]:
+                    server.schedulers[stream.stream_id].alert()
+                stream_counters = counters[stream.stream_id]
+                stream_counters["alert_count"] += analysis["alerts"]
+                frame_number = stream_counters["detection_count"]
+                stream_counters["detection_count"] += 1
+                log_frame(analysis, stream.stream_id, frame_number)
+                # Streams sem janela (fora de view ou janela fechada) não são desenhados
+                window = f"BIM + YOLO Integration - Câmera {stream.stream_id}"
+                if stream.stream_id not in viewed or (window in shown and not window_visible(window)):
+                    continue
+                with profiler.stage("desenho", stream.stream_id):
+                    draw_analysis(frame, analysis, bim_data, frame_number, stream_counters["alert_count"])
+                    if profile_hud:
+                        draw_profile(frame, profiler, stream.stream_id)
+                with profiler.stage("imshow", stream.stream_id):
+                    cv2.imshow(window, frame)
+                    keep_running = handle_key(frame, evidence)
+                shown.add(window)
+                if not keep_running:
+                    running = False
+                    break
+            else:
+                cv2.waitKey(1)
+    finally:
+        server.stop()
+        writer.close()
+        evidence.close()
+        cv2.destroyAllWindows()
 
+    print("\nPrograma finalizado.")
+    print(evidence.report())
+    print("Conformidade:")
+    for line in stats.report():
+        print(f"  - {line}")
+    for stream_id, stream_counters in counters.items():
+        print(f"  - Câmera {stream_id}: {stream_counters['detection_count']} frames, "
+              f"{stream_counters['alert_count']} alertas")
+    for line in server.report() + profiler.report():
+        print(f"  - {line}")
 
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Integração BIM + YOLO")
+    parser.add_argument("sources", nargs="*", default=["0"],
+                        help="Índices de câmera, URLs RTSP ou arquivos de vídeo (padrão: 0)")
+    parser.add_argument("--model", help="Pesos YOLO ou nome registrado, ex.: construcao@2 (padrão: detector.json)")
+    parser.add_argument("--batch", type=int, default=8, help="Tamanho máximo do lote com várias fontes")
+    parser.add_argument("--no-motion-gate", action="store_true",
+                        help="Roda o detector em todos os frames (sem o gate de movimento)")
+    parser.add_argument("--no-track", action="store_true",
+                        help="Conformidade recalculada por frame, sem rastreamento dos elementos")
+    parser.add_argument("--view", type=int, nargs="+",
+                        help="Com várias fontes, índices dos streams exibidos (padrão: todos)")
+    parser.add_argument("--log-sample", type=int, default=30,
+                        help="Grava 1 a cada N frames sem alerta no log de eventos (alertas sempre)")
+    parser.add_argument("--profile-hud", action="store_true",
+                        help="Mostra no frame os tempos p50/p95 de cada etapa")
+    parser.add_argument("--profile", choices=["cprofile", "sample"],
+                        help="Roda o cProfile (só a thread de inferência com uma fonte) ou o profiler por "
+                             "amostragem (todas as threads)")
+    parser.add_argument("--profile-frames", type=int, default=300, help="Frames medidos pelo --profile")
+    parser.add_argument("--profile-output", help="Arquivo de saída do --profile")
+    parser.add_argument("--budget-ms", type=float,
+                        help="Orçamento de latência por frame de cada câmera: sob carga reduz a entrada do "
+                             "detector, o lote e os frames inferidos (e volta quando sobra tempo)")
+    args = parser.parse_args()
+
+    from inference_server import parse_source
+
+    model = load_model(args.model)
+    bim_data = load_bim_data()
+
+    print("Pressione 'q' para sair, 's' para salvar screenshot")
+
+    # Frames vão para o log de eventos (JSON lines) em segundo plano; no terminal só alertas
+    events = EventLog(sample_every=args.log_sample)
+    # Tempos por etapa sempre medidos (resumo no log de eventos a cada minuto e no fim)
+    profiler = Profiler()
+    session = ProfileSession(args.profile, args.profile_frames, args.profile_output) if args.profile else None
+    # Um escalonador (orçamento, níveis e histerese) por stream
+    scheduler_factory = None
+    if args.budget_ms:
+        scheduler_factory = partial(LatencyScheduler, args.budget_ms,
+                                    detector_levels(load_config(model=args.model), args.batch))
+    options = dict(motion_gate=not args.no_motion_gate, tracking=not args.no_track,
+                   profiler=profiler, session=session, profile_hud=args.profile_hud)
+    try:
+        if len(args.sources) == 1:
+            scheduler = scheduler_factory(camera_id=0) if scheduler_factory else None
+            run_single_source(parse_source(args.sources[0]), model, bim_data, scheduler=scheduler, **options)
+        else:
+            run_multi_source(args.sources, model, bim_data, max_batch=args.batch, view=args.view,
+                             scheduler_factory=scheduler_factory, **options)
+    finally:
+        if session is not None:
+            session.stop()
+        events.close()
+    if session is not None:
+        print(session.report())
+    print(events.report())
 
+if __name__ == "__main__":
+    main()
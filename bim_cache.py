@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from bim_index import BIMElementIndex, ELEMENT_GROUPS, IFC_TYPES, element_position
+
+CACHE_VERSION = 2
+CACHE_DIR = ".bim_cache"
+
+# Arrays gravados em .npy (carregados com mmap)
+ARRAY_NAMES = ("ids", "names", "types", "classes", "starts", "ends", "bbox_min", "bbox_max",
+               "positions", "has_expected", "prop_index", "prop_table")
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash SHA-256 do arquivo de origem, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompiledBIM:
+    """
+    Modelo BIM compilado em arrays NumPy.
+
+    Cada elemento ocupa uma linha: id, nome, tipo IFC, classe, início/fim
+    do eixo (x, y, z), caixa envolvente, posição esperada (x, y) e o
+    índice da string de propriedades (JSON) na tabela compartilhada.
+    """
+
+    def __init__(self, arrays, project=None, source=None):
+        self.project = project or {}
+        self.source = source
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self, element_class):
+        return int(np.count_nonzero(np.asarray(self.classes) == element_class))
+
+    def properties(self, element):
+        """Propriedades do elemento decodificadas da tabela de strings"""
+        return json.loads(str(self.prop_table[self.prop_index[element]]))
+
+    def build_index(self):
+        """Índice espacial sobre as posições esperadas"""
+        return BIMElementIndex(self.positions, self.classes, [str(i) for i in self.ids])
+
+    def build_world_index(self):
+        """Índice espacial sobre o centro da geometria (unidades do BIM, ex.: metros)"""
+        centers = (np.asarray(self.bbox_min)[:, :2] + np.asarray(self.bbox_max)[:, :2]) / 2
+        return BIMElementIndex(centers, self.classes, [str(i) for i in self.ids])
+
+
+def _pack(records, project=None, source=None):
+    """Converte a lista de registros de elementos em arrays compactos"""
+    prop_strings = {}
+    prop_index = []
+    for record in records:
+        key = json.dumps(record["properties"], sort_keys=True, ensure_ascii=False)
+        prop_index.append(prop_strings.setdefault(key, len(prop_strings)))
+
+    def text_array(values):
+        values = list(values)
+        return np.array(values, dtype=f"U{max([len(v) for v in values] + [1])}")
+
+    arrays = {
+        "ids": text_array(r["id"] for r in records),
+        "names": text_array(r["name"] for r in records),
+        "types": text_array(r["type"] for r in records),
+        "classes": np.array([r["class"] for r in records], dtype=np.int8),
+        "starts": np.array([r["start"] for r in records], dtype=np.float64).reshape(-1, 3),
+        "ends": np.array([r["end"] for r in records], dtype=np.float64).reshape(-1, 3),
+        "bbox_min": np.array([r["bbox_min"] for r in records], dtype=np.float64).reshape(-1, 3),
+        "bbox_max": np.array([r["bbox_max"] for r in records], dtype=np.float64).reshape(-1, 3),
+        "positions": np.array([r["position"] for r in records], dtype=np.float64).reshape(-1, 2),
+        "has_expected": np.array([r["has_expected"] for r in records], dtype=bool),
+        "prop_index": np.array(prop_index, dtype=np.int32),
+        "prop_table": text_array(prop_strings),
+    }
+    return CompiledBIM(arrays, project, source)
+
+
+def _point3(values):
+    values = list(values) + [0.0] * (3 - len(values))
+    return values[:3]
+
+
+def compile_json(json_path):
+    """Compila metrosp.json / metro_sp_bim.json"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        bim_json = json.load(f)
+    if not isinstance(bim_json, dict) or "elements" not in bim_json:
+        raise ValueError(f"Arquivo '{json_path}' não contém um modelo BIM (chave 'elements')")
+
+    records = []
+    for group, element_class in ELEMENT_GROUPS.items():
+        for element in bim_json["elements"].get(group, []):
+            geometry = element.get("geometry", {})
+            start = _point3(geometry.get("start", geometry.get("position", [0, 0, 0])))
+            end = _point3(geometry.get("end", geometry.get("position", start)))
+            bbox_min = np.minimum(start, end)
+            bbox_max = np.maximum(start, end)
+            bbox_max[2] += geometry.get("height", 0)
+            records.append({
+                "id": element.get("id", f"{group}_{len(records)}"),
+                "name": element.get("name", ""),
+                "type": element.get("type", ""),
+                "class": element_class,
+                "start": start,
+                "end": end,
+                "bbox_min": bbox_min,
+                "bbox_max": bbox_max,
+                "position": element_position(element),
+                "has_expected": "expected_position" in element,
+                "properties": element.get("properties", {}),
+            })
+    return _pack(records, bim_json.get("project"), json_path)
+
+
+def compile_ifc(ifc_path):
+    """
+    Compila metro_sp.ifc: eixo, caixa envolvente e centro de cada elemento
+    vêm do ifcopenshell.geom (iterador paralelo); elementos sem geometria
+    usam a origem do ObjectPlacement.
+    """
+    import ifcopenshell
+    from ifc_geometry import extract_geometry, placement_matrix
+
+    bim_model = ifcopenshell.open(ifc_path)
+    geometry = extract_geometry(bim_model, tuple(IFC_TYPES))
+    records = []
+    for ifc_type, element_class in IFC_TYPES.items():
+        for entity in bim_model.by_type(ifc_type):
+            shape = geometry.get(entity.GlobalId)
+            if shape is None:
+                if entity.ObjectPlacement is None:
+                    continue
+                origin = placement_matrix(entity)[:3, 3]
+                shape = {"axis_start": origin, "axis_end": origin, "center": origin,
+                         "bbox_min": origin, "bbox_max": origin}
+            records.append({
+                "id": entity.GlobalId,
+                "name": entity.Name or "",
+                "type": ifc_type,
+                "class": element_class,
+                "start": shape["axis_start"],
+                "end": shape["axis_end"],
+                "bbox_min": shape["bbox_min"],
+                "bbox_max": shape["bbox_max"],
+                "position": shape["center"][:2],
+                "has_expected": False,
+                "properties": {},
+            })
+    projects = bim_model.by_type("IfcProject")
+    project = {"name": projects[0].Name, "description": projects[0].Description} if projects else {}
+    return _pack(records, project, ifc_path)
+
+
+def compile_bim(source_path):
+    """Compila o arquivo de origem conforme a extensão (.ifc ou .json)"""
+    if source_path.lower().endswith(".ifc"):
+        return compile_ifc(source_path)
+    return compile_json(source_path)
+
+
+def _cache_path(source_path, cache_dir):
+    """Entrada do cache: nome da origem (legível) + hash do caminho absoluto (homônimos não colidem)"""
+    digest = hashlib.sha1(os.path.abspath(source_path).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(source_path)}-{digest}")
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_cache(compiled, source_path, cache_dir=CACHE_DIR, source_hash=None):
+    """Grava o modelo compilado no cache (troca atômica do diretório)"""
+    target = _cache_path(source_path, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(source_path)
+    manifest = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(source_path),
+        "sha256": source_hash or file_sha256(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "count": len(compiled),
+        "project": compiled.project,
+    }
+
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=cache_dir)
+    try:
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(compiled, name))
+        with open(os.path.join(tmp_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def load_cache(source_path, cache_dir=CACHE_DIR):
+    """
+    Carrega o modelo compilado com mmap se o cache ainda corresponde à origem.
+    Retorna None quando o cache não existe ou está desatualizado.
+    """
+    target = _cache_path(source_path, cache_dir)
+    manifest = _read_manifest(target)
+    if manifest is None or manifest.get("version") != CACHE_VERSION:
+        return None
+
+    # Tamanho e data iguais dispensam recalcular o hash da origem
+    stat = os.stat(source_path)
+    if (manifest.get("size"), manifest.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+        if manifest.get("sha256") != file_sha256(source_path):
+            return None
+
+    try:
+        arrays = {name: np.load(os.path.join(target, f"{name}.npy"), mmap_mode="r")
+                  for name in ARRAY_NAMES}
+    except (FileNotFoundError, ValueError):
+        return None
+    return CompiledBIM(arrays, manifest.get("project"), source_path)
+
+
+def load_compiled_bim(source_path, cache_dir=CACHE_DIR):
+    """Carrega do cache ou compila a origem e grava o cache"""
+    compiled = load_cache(source_path, cache_dir)
+    if compiled is not None:
+        return compiled
+    source_hash = file_sha256(source_path)
+    compiled = compile_bim(source_path)
+    try:
+        save_cache(compiled, source_path, cache_dir, source_hash)
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar o cache BIM: {e}")
+        return compiled
+    return load_cache(source_path, cache_dir) or compiled
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    for path in sys.argv[1:] or ["metrosp.json"]:
+        start = time.perf_counter()
+        compiled = compile_bim(path)
+        manifest = save_cache(compiled, path)
+        print(f"{path}: {manifest['count']} elementos compilados em "
+              f"{(time.perf_counter() - start) * 1000:.1f}ms -> {_cache_path(path, CACHE_DIR)}")
@@ -2,29 +2,52 @@ import cv2
 import numpy as np
 import json
 import os
-from ultralytics import YOLO
 import pickle
-from datetime import datetime
+
+from bim_cache import load_compiled_bim
+from bim_index import BIMElementIndex
+from compliance import ComplianceEngine
+from detector import DetectionAdapter, load_detector
+from ontology import default_ontology
+from overlay import Overlay, draw_bar_background, fill_bar
+from persistence import DetectionWriter
+from sample_store import SampleStore
+from stream_stats import StreamStats
 
 class BIMComplianceTrainer:
-    def __init__(self):
-        self.model = YOLO("yolov8n.pt")
-        self.training_data = []
+    def __init__(self, model=None, source=0):
+        # Permite compartilhar um modelo já carregado (ex.: servidor de inferência)
+        self.model = model if model is not None else load_detector()
+        self.detector = DetectionAdapter(self.model)
+        self.overlay = Overlay()
+        self.source = source
+        # Amostras de treinamento em disco (training_samples/), separadas do arquivo BIM
+        self.samples = SampleStore()
+        self.ontology = default_ontology()
         self.bim_data = None
+        self.bim_index = None
+        self.engine = None
         self.load_bim_data()
         
     def load_bim_data(self):
         """Carrega dados BIM do arquivo JSON"""
         try:
-            with open("metrosp.json", 'r', encoding='utf-8') as f:
-                self.bim_data = json.load(f)
+            # Modelo compilado (cache com mmap), sem reler o JSON
+            self.bim_data = load_compiled_bim("metrosp.json")
+            self.bim_index = self.bim_data.build_index()
+            self.engine = ComplianceEngine(self.bim_index, max_deviation=self.ontology.max_deviation_px,
+                                         class_weights=self.ontology.weights)
             print("Dados BIM carregados com sucesso!")
         except FileNotFoundError:
             print("Arquivo BIM não encontrado. Criando dados padrão...")
             self.create_default_bim()
+        except ValueError as e:  # inclui json.JSONDecodeError
+            # Arquivo inválido não é sobrescrito: os dados padrão ficam só na memória
+            print(f"Arquivo BIM inválido ({e}). Usando dados padrão sem alterar metrosp.json")
+            self.create_default_bim(save=False)
     
-    def create_default_bim(self):
-        """Cria dados BIM padrão se não existir"""
+    def create_default_bim(self, save=True):
+        """Cria dados BIM padrão se não existir (save=False: só na memória)"""
         self.bim_data = {
             "project": {
                 "name": "Projeto Metro SP",
@@ -57,6 +80,12 @@ class BIMComplianceTrainer:
             }
         }
         
+        self.bim_index = BIMElementIndex.from_json(self.bim_data)
+        self.engine = ComplianceEngine(self.bim_index, max_deviation=self.ontology.max_deviation_px,
+                                         class_weights=self.ontology.weights)
+        
+        if not save:
+            return
         # Salva o arquivo
         with open("metrosp.json", 'w', encoding='utf-8') as f:
             json.dump(self.bim_data, f, indent=2)
@@ -67,60 +96,10 @@ class BIMComplianceTrainer:
         if not detections:
             return 0.0
         
-        total_deviation = 0
-        total_elements = 0
-        matched_elements = 0
-        
-        for det in detections:
-            class_name = det['class'].lower()
-            detected_pos = det['position']
-            confidence = det['confidence']
-            
-            # Procura elemento correspondente no BIM
-            element_found = False
-            
-            # Verifica paredes
-            for wall in self.bim_data['elements']['walls']:
-                if 'wall' in class_name or 'parede' in class_name or 'person' in class_name:
-                    expected_pos = wall['expected_position']
-                    deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                    total_deviation += deviation
-                    total_elements += 1
-                    matched_elements += 1
-                    element_found = True
-                    break
-            
-            # Verifica vigas
-            if not element_found:
-                for beam in self.bim_data['elements']['beams']:
-                    if 'beam' in class_name or 'viga' in class_name or 'chair' in class_name:
-                        expected_pos = beam['expected_position']
-                        deviation = np.linalg.norm(np.array(expected_pos) - np.array(detected_pos))
-                        total_deviation += deviation
-                        total_elements += 1
-                        matched_elements += 1
-                        element_found = True
-                        break
-            
-            # Se não encontrou correspondência, conta como elemento extra
-            if not element_found:
-                total_elements += 1
-        
-        if total_elements == 0:
-            return 0.0
-        
-        # Calcula porcentagem de conformidade
-        avg_deviation = total_deviation / total_elements if total_deviation > 0 else 0
-        max_acceptable_deviation = 150  # pixels
-        
-        # Fatores de conformidade
-        position_compliance = max(0, 100 - (avg_deviation / max_acceptable_deviation) * 100)
-        detection_compliance = (matched_elements / total_elements) * 100
-        
-        # Conformidade final (média ponderada)
-        final_compliance = (position_compliance * 0.7) + (detection_compliance * 0.3)
-        
-        return max(0, min(100, final_compliance))
+        # Associação um-para-um vetorizada de todas as detecções do frame
+        positions = np.array([det['position'] for det in detections], dtype=np.float64)
+        classes = self.ontology.classify_names([det['class'] for det in detections])
+        return self.engine.evaluate(positions, classes)["score"]
     
     def collect_training_data(self):
         """Coleta dados de treinamento da câmera"""
@@ -129,12 +108,13 @@ class BIMComplianceTrainer:
         print("Pressione 'q' para sair")
         print("Pressione 's' para salvar dados")
         
-        cap = cv2.VideoCapture(0)
+        cap = cv2.VideoCapture(self.source)
         if not cap.isOpened():
             print("Erro: Não foi possível abrir a câmera!")
             return
         
         sample_count = 0
+        writer = DetectionWriter()
         
         while True:
             ret, frame = cap.read()
@@ -142,38 +122,33 @@ class BIMComplianceTrainer:
                 break
             
             # Detecta objetos
-            results = self.model.predict(frame, conf=0.5, verbose=False)
+            frame_detections = self.detector.predict([frame])[0]
             
             detections = []
-            for result in results:
-                for box in result.boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    cls = int(box.cls[0])
-                    class_name = self.model.names[cls]
-                    confidence = float(box.conf[0])
-                    position = ((x1 + x2) / 2, (y1 + y2) / 2)
-                    
-                    detections.append({
-                        'class': class_name,
-                        'confidence': confidence,
-                        'position': position
-                    })
-                    
-                    # Desenha caixa
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{class_name} {confidence:.2f}", 
-                               (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+            for (x1, y1, x2, y2), confidence, cls in zip(frame_detections["box"].astype(int).tolist(),
+                                                         frame_detections["conf"].tolist(),
+                                                         frame_detections["cls"].tolist()):
+                class_name = self.model.names[cls]
+                position = ((x1 + x2) / 2, (y1 + y2) / 2)
+                
+                detections.append({
+                    'class': class_name,
+                    'confidence': confidence,
+                    'position': position
+                })
+                
+                # Desenha caixa
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                self.overlay.text(frame, f"{class_name} {confidence:.2f}", (x1, y1 - 10), 0.5, (0, 255, 0), 2)
             
             # Calcula conformidade atual
             current_compliance = self.calculate_compliance_percentage(detections)
+            writer.log_frame(detections, current_compliance)
             
             # Mostra informações na tela
-            cv2.putText(frame, f"Amostras: {sample_count}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(frame, f"Conformidade: {current_compliance:.1f}%", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(frame, "Pressione 'c' para capturar", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            self.overlay.text(frame, f"Amostras: {sample_count}", (10, 30), 0.7, (255, 255, 255), 2)
+            self.overlay.text(frame, f"Conformidade: {current_compliance:.1f}%", (10, 60), 0.7, (255, 255, 255), 2)
+            self.overlay.text(frame, "Pressione 'c' para capturar", (10, 90), 0.5, (255, 255, 255), 1)
             
             cv2.imshow("Coleta de Dados", frame)
             
@@ -181,13 +156,8 @@ class BIMComplianceTrainer:
             if key == ord('q'):
                 break
             elif key == ord('c'):
-                # Captura dados
-                self.training_data.append({
-                    'compliance': current_compliance,
-                    'timestamp': datetime.now().isoformat(),
-                    'detections': detections,
-                    'detection_count': len(detections)
-                })
+                # Captura dados (gravados em blocos conforme são capturados)
+                self.samples.append(current_compliance, detections)
                 
                 sample_count += 1
                 print(f"Amostra {sample_count} capturada - Conformidade: {current_compliance:.1f}%")
@@ -201,50 +171,50 @@ class BIMComplianceTrainer:
                     print("Nenhuma amostra coletada ainda!")
         
         cap.release()
+        writer.close()
+        self.samples.close()
         cv2.destroyAllWindows()
     
     def save_training_data(self):
-        """Salva dados de treinamento"""
-        with open("metrosp.json", 'w', encoding='utf-8') as f:
-            json.dump(self.training_data, f, indent=2, ensure_ascii=False)
-        print("Dados de treinamento salvos em: metrosp.json")
-        
-        # Calcula estatísticas
-        if self.training_data:
-            compliances = [sample['compliance'] for sample in self.training_data]
-            avg_compliance = np.mean(compliances)
-            min_compliance = np.min(compliances)
-            max_compliance = np.max(compliances)
-            
+        """Grava as amostras pendentes (só as novas) e mostra as estatísticas"""
+        self.samples.flush()
+        print(f"Dados de treinamento salvos em: {self.samples.directory}/")
+        self.print_training_summary()
+    
+    def print_training_summary(self):
+        """Estatísticas das amostras gravadas (leitura com mmap, bloco a bloco)"""
+        summary = self.samples.summary()
+        if summary["count"]:
             print(f"\nEstatísticas dos dados coletados:")
-            print(f"  - Média de conformidade: {avg_compliance:.1f}%")
-            print(f"  - Mínima: {min_compliance:.1f}%")
-            print(f"  - Máxima: {max_compliance:.1f}%")
-            print(f"  - Total de amostras: {len(self.training_data)}")
+            print(f"  - Média de conformidade: {summary['mean']:.1f}%")
+            print(f"  - Mínima: {summary['min']:.1f}%")
+            print(f"  - Máxima: {summary['max']:.1f}%")
+            print(f"  - Total de amostras: {summary['count']} ({summary['detections']} detecções, "
+                  f"{summary['chunks']} blocos)")
     
     def load_training_data(self):
         """Carrega dados de treinamento existentes"""
-        try:
-            with open("metrosp.json", 'r', encoding='utf-8') as f:
-                self.training_data = json.load(f)   
-            print(f"Dados de treinamento carregados: {len(self.training_data)} amostras")
-            return True
-        except FileNotFoundError:
+        if not len(self.samples):
             print("Nenhum dado de treinamento encontrado")
             return False
+        print(f"Dados de treinamento carregados: {len(self.samples)} amostras")
+        self.print_training_summary()
+        return True
     
     def test_real_time_prediction(self):
         """Testa predição de conformidade em tempo real"""
         print("=== TESTE DE CONFORMIDADE EM TEMPO REAL ===")
         print("Pressione 'q' para sair")
         
-        cap = cv2.VideoCapture(0)
+        cap = cv2.VideoCapture(self.source)
         if not cap.isOpened():
             print("Erro: Não foi possível abrir a câmera!")
             return
         
         frame_count = 0
-        compliance_history = []
+        # Média móvel dos últimos 30 frames e acumuladores exatos da sessão
+        compliance_stats = StreamStats(frame_windows=(30,), time_windows=())
+        writer = DetectionWriter()
         
         while True:
             ret, frame = cap.read()
@@ -252,38 +222,31 @@ class BIMComplianceTrainer:
                 break
             
             # Detecta objetos
-            results = self.model.predict(frame, conf=0.5, verbose=False)
+            frame_detections = self.detector.predict([frame])[0]
             
             detections = []
-            for result in results:
-                for box in result.boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    cls = int(box.cls[0])
-                    class_name = self.model.names[cls]
-                    confidence = float(box.conf[0])
-                    position = ((x1 + x2) / 2, (y1 + y2) / 2)
-                    
-                    detections.append({
-                        'class': class_name,
-                        'confidence': confidence,
-                        'position': position
-                    })
-                    
-                    # Desenha caixa
-                    color = (0, 255, 0) if confidence > 0.7 else (0, 255, 255)
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(frame, f"{class_name} {confidence:.2f}", 
-                               (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            for (x1, y1, x2, y2), confidence, cls in zip(frame_detections["box"].astype(int).tolist(),
+                                                         frame_detections["conf"].tolist(),
+                                                         frame_detections["cls"].tolist()):
+                class_name = self.model.names[cls]
+                position = ((x1 + x2) / 2, (y1 + y2) / 2)
+                
+                detections.append({
+                    'class': class_name,
+                    'confidence': confidence,
+                    'position': position
+                })
+                
+                # Desenha caixa
+                color = (0, 255, 0) if confidence > 0.7 else (0, 255, 255)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                self.overlay.text(frame, f"{class_name} {confidence:.2f}", (x1, y1 - 10), 0.5, color, 2)
             
             # Calcula conformidade
             compliance = self.calculate_compliance_percentage(detections)
-            compliance_history.append(compliance)
-            
-            # Mantém apenas os últimos 30 frames para média móvel
-            if len(compliance_history) > 30:
-                compliance_history.pop(0)
-            
-            avg_compliance = np.mean(compliance_history) if compliance_history else 0
+            writer.log_frame(detections, compliance)
+            compliance_stats.add(compliance)
+            avg_compliance = compliance_stats.windows["30f"].mean
             
             # Determina cor baseada na conformidade
             if compliance >= 80:
@@ -300,32 +263,18 @@ class BIMComplianceTrainer:
                 status = "CRÍTICO"
             
             # Desenha informações na tela
-            cv2.putText(frame, f"Conformidade BIM: {compliance:.1f}%", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-            cv2.putText(frame, f"Status: {status}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-            cv2.putText(frame, f"Média (30f): {avg_compliance:.1f}%", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            cv2.putText(frame, f"Detecções: {len(detections)}", (10, 110), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            self.overlay.text(frame, f"Conformidade BIM: {compliance:.1f}%", (10, 30), 0.7, color, 2)
+            self.overlay.text(frame, f"Status: {status}", (10, 60), 0.7, color, 2)
+            self.overlay.text(frame, f"Média (30f): {avg_compliance:.1f}%", (10, 90), 0.5, (255, 255, 255), 1)
+            self.overlay.text(frame, f"Detecções: {len(detections)}", (10, 110), 0.5, (255, 255, 255), 1)
             
-            # Barra de progresso visual
+            # Barra de progresso visual (fundo e borda pré-renderizados)
             bar_width = 300
             bar_height = 20
             bar_x, bar_y = 10, 140
-            
-            # Fundo da barra
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), 
-                         (100, 100, 100), -1)
-            
-            # Preenchimento da barra
-            fill_width = int((compliance / 100) * bar_width)
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + fill_width, bar_y + bar_height), 
-                         color, -1)
-            
-            # Borda da barra
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), 
-                         (255, 255, 255), 2)
+            self.overlay.layer(frame, "barra", lambda canvas: draw_bar_background(
+                canvas, bar_x, bar_y, bar_width, bar_height, border=2))
+            fill_bar(frame, bar_x, bar_y, bar_width, bar_height, compliance / 100, color, border=2)
             
             cv2.imshow("Conformidade BIM em Tempo Real", frame)
             
@@ -336,18 +285,24 @@ class BIMComplianceTrainer:
             frame_count += 1
         
         cap.release()
+        writer.close()
         cv2.destroyAllWindows()
         
-        # Mostra estatísticas finais
-        if compliance_history:
+        # Mostra estatísticas finais (sessão inteira, não só os últimos 30 frames)
+        session = compliance_stats.session
+        if session.count:
             print(f"\nEstatísticas da sessão:")
             print(f"  - Frames processados: {frame_count}")
-            print(f"  - Conformidade média: {np.mean(compliance_history):.1f}%")
-            print(f"  - Conformidade mínima: {np.min(compliance_history):.1f}%")
-            print(f"  - Conformidade máxima: {np.max(compliance_history):.1f}%")
+            print(f"  - Conformidade média: {session.mean:.1f}%")
+            print(f"  - Conformidade mínima: {session.min:.1f}%")
+            print(f"  - Conformidade máxima: {session.max:.1f}%")
 
 def main():
-    trainer = BIMComplianceTrainer()
+    import sys
+    from inference_server import parse_source
+
+    source = parse_source(sys.argv[1]) if len(sys.argv) > 1 else 0
+    trainer = BIMComplianceTrainer(source=source)
     
     print("=== SISTEMA DE CONFORMIDADE BIM ===")
     print("1. Coletar dados de treinamento")
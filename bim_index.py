@@ -0,0 +1,81 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy é opcional: sem ele usamos busca vetorizada por força bruta
+    cKDTree = None
+
+# Classes de elementos BIM indexadas (posição = id inteiro da classe)
+ELEMENT_CLASSES = ("wall", "beam", "column")
+ELEMENT_GROUPS = {"walls": 0, "beams": 1, "columns": 2}
+IFC_TYPES = {"IfcWall": 0, "IfcBeam": 1, "IfcColumn": 2}
+
+
+def element_position(element):
+    """Posição esperada do elemento: expected_position ou centro da geometria"""
+    if "expected_position" in element:
+        return element["expected_position"][:2]
+    geometry = element["geometry"]
+    if "start" in geometry and "end" in geometry:
+        return [(geometry["start"][0] + geometry["end"][0]) / 2,
+                (geometry["start"][1] + geometry["end"][1]) / 2]
+    return geometry["position"][:2]
+
+
+class BIMElementIndex:
+    """
+    Índice espacial dos elementos BIM, construído uma vez no carregamento.
+
+    Guarda a posição esperada e a classe de cada elemento em arrays NumPy e mantém uma KD-tree por classe, consultada
+    pelo ComplianceEngine para achar os candidatos da mesma classe de todas
+    as detecções de um frame de uma vez.
+    """
+
+    def __init__(self, positions, classes, ids=None):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.classes = np.asarray(classes, dtype=np.int8)
+        count = len(self.positions)
+        self.ids = list(ids) if ids is not None else [f"element_{i}" for i in range(count)]
+
+        # Índices globais e árvore de cada classe
+        self.class_members = {}
+        self.trees = {}
+        for element_class in range(len(ELEMENT_CLASSES)):
+            members = np.flatnonzero(self.classes == element_class)
+            if len(members) == 0:
+                continue
+            self.class_members[element_class] = members
+            if cKDTree is not None:
+                self.trees[element_class] = cKDTree(self.positions[members])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def has_class(self, element_class):
+        return element_class in self.class_members
+
+    def count(self, element_class):
+        members = self.class_members.get(element_class)
+        return 0 if members is None else len(members)
+
+    @classmethod
+    def from_json(cls, bim_json):
+        """Constrói o índice a partir do JSON BIM (metrosp.json / metro_sp_bim.json)"""
+        positions, classes, ids = [], [], []
+        for group, element_class in ELEMENT_GROUPS.items():
+            for element in bim_json.get("elements", {}).get(group, []):
+                positions.append(element_position(element))
+                classes.append(element_class)
+                ids.append(element.get("id", f"{group}_{len(ids)}"))
+        return cls(positions, classes, ids)
+
+    @classmethod
+    def from_simulated(cls, bim_data):
+        """Constrói o índice a partir dos dados simulados (listas de pontos 'Geometry')"""
+        positions, classes, ids = [], [], []
+        for group, element_class in ELEMENT_GROUPS.items():
+            for i, element in enumerate(bim_data.get(group, [])):
+                positions.append(np.asarray(element["Geometry"], dtype=np.float64).mean(axis=0))
+                classes.append(element_class)
+                ids.append(f"{group}_{i + 1}")
+        return cls(positions, classes, ids)
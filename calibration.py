@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+CALIBRATION_FILE = "camera_calibration.json"
+
+
+class CameraCalibration:
+    """
+    Calibração de uma câmera em relação às coordenadas do BIM (metros).
+
+    Aceita dois modelos no arquivo de calibração:
+    - "homography": homografia 3x3 do piso (x, y do BIM) para pixels;
+    - "camera_matrix" + "dist_coeffs" + "rvec" + "tvec": intrinsecos e
+      extrínsecos completos (projeção 3D com cv2.projectPoints).
+
+    Em ambos os casos existe uma homografia do piso (z = 0), usada para
+    levar pontos da imagem de volta para metros.
+    """
+
+    def __init__(self, camera_id, params):
+        self.camera_id = camera_id
+        self.params = params
+        # Tolerâncias em metros (unidades do BIM)
+        self.tolerance = params.get("tolerance", 0.3)
+        self.max_deviation = params.get("max_deviation", 1.0)
+        self.gate = params.get("gate", 2.0)
+
+        self.camera_matrix = None
+        self.dist_coeffs = None
+        if "camera_matrix" in params:
+            self.camera_matrix = np.asarray(params["camera_matrix"], dtype=np.float64).reshape(3, 3)
+            self.dist_coeffs = np.asarray(params.get("dist_coeffs", [0, 0, 0, 0, 0]), dtype=np.float64)
+            self.rvec = np.asarray(params["rvec"], dtype=np.float64).reshape(3, 1)
+            self.tvec = np.asarray(params["tvec"], dtype=np.float64).reshape(3, 1)
+            rotation, _ = cv2.Rodrigues(self.rvec)
+            # H = K [r1 r2 t] leva o piso (z = 0) para a imagem
+            self.homography = self.camera_matrix @ np.column_stack((rotation[:, 0], rotation[:, 1], self.tvec[:, 0]))
+        elif "homography" in params:
+            self.homography = np.asarray(params["homography"], dtype=np.float64).reshape(3, 3)
+        else:
+            raise ValueError(f"Calibração da câmera {camera_id} sem 'homography' nem 'camera_matrix'")
+        self.inverse_homography = np.linalg.inv(self.homography)
+        self.fingerprint = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def has_intrinsics(self):
+        return self.camera_matrix is not None
+
+    def project(self, points):
+        """Projeta pontos do BIM (N x 3 ou N x 2, em metros) para pixels (N x 2)"""
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) == 0:
+            return np.empty((0, 2))
+        if self.has_intrinsics:
+            points3d = points if points.shape[1] == 3 else np.column_stack((points, np.zeros(len(points))))
+            image_points, _ = cv2.projectPoints(points3d.reshape(-1, 1, 3), self.rvec, self.tvec,
+                                                self.camera_matrix, self.dist_coeffs)
+            return image_points.reshape(-1, 2)
+        return cv2.perspectiveTransform(points[:, :2].reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+
+    def in_front(self, points):
+        """Máscara dos pontos do BIM à frente da câmera (z > 0 no referencial dela); sem intrínsecos, todos"""
+        points = np.asarray(points, dtype=np.float64)
+        if not self.has_intrinsics:
+            return np.ones(len(points), dtype=bool)
+        points3d = points if points.shape[1] == 3 else np.column_stack((points, np.zeros(len(points))))
+        rotation, _ = cv2.Rodrigues(self.rvec)
+        return points3d @ rotation[2] + self.tvec[2, 0] > 0
+
+    def image_to_world(self, points):
+        """Leva pontos da imagem (pixels) para o piso do BIM (metros)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if len(points) == 0:
+            return np.empty((0, 2))
+        if self.has_intrinsics:
+            points = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix)
+        return cv2.perspectiveTransform(points, self.inverse_homography).reshape(-1, 2)
+
+
+class ProjectionTable:
+    """
+    Geometria do BIM projetada na imagem de uma câmera.
+
+    Calculada uma vez por pose da câmera (fingerprint da calibração) e
+    reutilizada em todos os frames: centro, extremidades do eixo e caixa
+    na imagem de cada elemento. Com intrínsecos, pontos atrás da câmera não
+    têm projeção válida: in_front marca os elementos com o centro à frente
+    dela, a caixa usa só os cantos à frente e visible() ignora os demais.
+    """
+
+    def __init__(self, compiled, calibration):
+        self.fingerprint = calibration.fingerprint
+        count = len(compiled)
+        bbox_min = np.asarray(compiled.bbox_min)
+        bbox_max = np.asarray(compiled.bbox_max)
+        center = (bbox_min + bbox_max) / 2
+
+        # Os 8 cantos da caixa de cada elemento projetados de uma vez
+        corners = np.stack([np.column_stack((xs[:, 0], ys[:, 1], zs[:, 2]))
+                            for xs in (bbox_min, bbox_max)
+                            for ys in (bbox_min, bbox_max)
+                            for zs in (bbox_min, bbox_max)], axis=1)
+        projected = calibration.project(corners.reshape(-1, 3)).reshape(count, 8, 2)
+        corner_in_front = calibration.in_front(corners.reshape(-1, 3)).reshape(count, 8, 1)
+
+        self.in_front = calibration.in_front(center)
+        self.centers = calibration.project(center)
+        self.starts = calibration.project(np.asarray(compiled.starts))
+        self.ends = calibration.project(np.asarray(compiled.ends))
+        # Elemento sem nenhum canto à frente fica com caixa vazia (inf, -inf)
+        self.boxes = np.column_stack((np.where(corner_in_front, projected, np.inf).min(axis=1),
+                                      np.where(corner_in_front, projected, -np.inf).max(axis=1)))
+
+    def visible(self, frame_shape):
+        """Máscara dos elementos à frente da câmera cuja caixa projetada cai dentro do frame"""
+        height, width = frame_shape[:2]
+        return (self.in_front & (self.boxes[:, 2] >= 0) & (self.boxes[:, 0] < width) &
+                (self.boxes[:, 3] >= 0) & (self.boxes[:, 1] < height))
+
+
+class CalibrationFile:
+    """Lê camera_calibration.json e recarrega quando o arquivo muda"""
+
+    def __init__(self, path=CALIBRATION_FILE, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.mtime = None
+        self.last_check = 0.0
+        self.cameras = {}
+        self.reload()
+
+    def reload(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.cameras = {str(camera_id): CameraCalibration(str(camera_id), params)
+                        for camera_id, params in data.get("cameras", {}).items()}
+
+    def get(self, camera_id):
+        """Calibração atual da câmera (None se não calibrada)"""
+        now = time.monotonic()
+        if now - self.last_check >= self.check_interval:
+            self.last_check = now
+            try:
+                if os.stat(self.path).st_mtime_ns != self.mtime:
+                    self.reload()
+                    print(f"Calibração recarregada: {self.path}")
+            except (OSError, ValueError) as e:
+                print(f"Erro ao recarregar calibração: {e}")
+        return self.cameras.get(str(camera_id))
+
+
+class ProjectionCache:
+    """Mantém a tabela de projeção de cada câmera e só recalcula quando a calibração muda"""
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.tables = {}
+
+    def get(self, calibration):
+        table = self.tables.get(calibration.camera_id)
+        if table is None or table.fingerprint != calibration.fingerprint:
+            table = ProjectionTable(self.compiled, calibration)
+            self.tables[calibration.camera_id] = table
+        return table
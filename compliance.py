@@ -0,0 +1,160 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy é opcional: sem ele a associação é gulosa por distância
+    linear_sum_assignment = None
+
+
+def distance_matrix(points, positions):
+    """Matriz de distâncias detecções x elementos calculada em uma operação NumPy"""
+    diff = points[:, None, :] - positions[None, :, :]
+    return np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+
+
+def greedy_assignment(costs):
+    """Associação um-para-um gulosa: pares mais próximos primeiro"""
+    finite = np.flatnonzero(np.isfinite(costs.ravel()))
+    order = finite[np.argsort(costs.ravel()[finite], kind="stable")]
+    rows, cols = np.unravel_index(order, costs.shape)
+    used_rows = np.zeros(costs.shape[0], dtype=bool)
+    used_cols = np.zeros(costs.shape[1], dtype=bool)
+    pairs_rows, pairs_cols = [], []
+    for row, col in zip(rows, cols):
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        pairs_rows.append(row)
+        pairs_cols.append(col)
+        if len(pairs_rows) == min(costs.shape):
+            break
+    return np.array(pairs_rows, dtype=np.int64), np.array(pairs_cols, dtype=np.int64)
+
+
+def optimal_assignment(costs):
+    """Associação um-para-um de custo mínimo (húngaro), ignorando pares bloqueados"""
+    finite = np.isfinite(costs)
+    if not finite.any():
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    # Pares fora do gate recebem custo proibitivo e são descartados depois
+    blocked_cost = costs[finite].max() * 2 + 1e6
+    rows, cols = linear_sum_assignment(np.where(finite, costs, blocked_cost))
+    keep = finite[rows, cols]
+    return rows[keep], cols[keep]
+
+
+class ComplianceEngine:
+    """
+    Motor de conformidade vetorizado entre detecções e elementos BIM.
+
+    Monta a matriz de distâncias de todas as detecções contra os elementos
+    candidatos de cada classe, resolve uma associação um-para-um (húngaro
+    ou gulosa por distância) limitada por um gate e devolve elementos
+    associados, ausentes e detecções extras com a pontuação ponderada
+    (0.7 posição + 0.3 detecção). class_weights (um peso por classe BIM e,
+    na última posição, o das detecções sem classe) pondera cada detecção.
+    """
+
+    def __init__(self, index, gate=300, max_deviation=150, method="hungarian",
+                 position_weight=0.7, detection_weight=0.3, class_weights=None):
+        self.index = index
+        self.gate = gate
+        self.max_deviation = max_deviation
+        self.class_weights = None if class_weights is None else np.asarray(class_weights, dtype=np.float64)
+        if method == "hungarian" and linear_sum_assignment is None:
+            method = "greedy"
+        self.method = method
+        self.position_weight = position_weight
+        self.detection_weight = detection_weight
+
+    def _candidates(self, element_class, points):
+        """Elementos da classe que podem estar dentro do gate de alguma detecção"""
+        members = self.index.class_members[element_class]
+        tree = self.index.trees.get(element_class)
+        if tree is None or not np.isfinite(self.gate):
+            return members
+        nearby = tree.query_ball_point(points, self.gate)
+        local = np.unique(np.concatenate([np.asarray(n, dtype=np.int64) for n in nearby]))
+        return members[local]
+
+    def assign(self, points, classes, available=None):
+        """
+        Associa detecções a elementos (um-para-um, por classe).
+        Retorna (element_idx, distances) por detecção; -1 indica extra.
+        available: máscara opcional dos elementos que ainda podem ser associados.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        classes = np.asarray(classes, dtype=np.int64)
+        element_idx = np.full(len(points), -1, dtype=np.int64)
+        distances = np.full(len(points), np.inf)
+
+        for element_class in self.index.class_members:
+            rows = np.flatnonzero(classes == element_class)
+            if len(rows) == 0:
+                continue
+            candidates = self._candidates(element_class, points[rows])
+            if available is not None:
+                candidates = candidates[available[candidates]]
+            if len(candidates) == 0:
+                continue
+
+            costs = distance_matrix(points[rows], self.index.positions[candidates])
+            costs[costs > self.gate] = np.inf
+            if self.method == "hungarian":
+                pair_rows, pair_cols = optimal_assignment(costs)
+            else:
+                pair_rows, pair_cols = greedy_assignment(costs)
+
+            element_idx[rows[pair_rows]] = candidates[pair_cols]
+            distances[rows[pair_rows]] = costs[pair_rows, pair_cols]
+
+        return element_idx, distances
+
+    def weights(self, classes):
+        """Peso de cada detecção pela classe BIM (None sem class_weights)"""
+        if self.class_weights is None:
+            return None
+        return self.class_weights[np.asarray(classes, dtype=np.int64)]
+
+    def score(self, distances, matched, total, weights=None):
+        """Pontuação ponderada: 0.7 conformidade de posição + 0.3 de detecção"""
+        if total == 0:
+            return 0.0
+        if weights is None:
+            total_deviation = float(distances[matched].sum())
+            matched_weight = int(matched.sum())
+        else:
+            total_deviation = float(np.dot(distances[matched], weights[matched]))
+            matched_weight = float(weights[matched].sum())
+            total = float(weights.sum())
+            if total <= 0:
+                return 0.0
+        avg_deviation = total_deviation / total
+        position_compliance = max(0, 100 - (avg_deviation / self.max_deviation) * 100)
+        detection_compliance = (matched_weight / total) * 100
+        final_compliance = (position_compliance * self.position_weight +
+                            detection_compliance * self.detection_weight)
+        return max(0, min(100, final_compliance))
+
+    def evaluate(self, points, classes, visible=None):
+        """
+        Avalia um frame completo.
+
+        visible: máscara opcional dos elementos que a câmera deveria ver
+        (os demais não contam como ausentes).
+        """
+        element_idx, distances = self.assign(points, classes)
+        matched = element_idx >= 0
+
+        expected = np.ones(len(self.index), dtype=bool) if visible is None else np.asarray(visible, dtype=bool)
+        found = np.zeros(len(self.index), dtype=bool)
+        found[element_idx[matched]] = True
+
+        return {
+            "score": self.score(distances, matched, len(element_idx), self.weights(classes)),
+            "element_idx": element_idx,
+            "distances": distances,
+            "matched": np.flatnonzero(matched),
+            "missing": np.flatnonzero(expected & ~found),
+            "extra": np.flatnonzero(~matched),
+        }
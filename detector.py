@@ -0,0 +1,496 @@
+import json
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+from bim_cache import file_sha256
+
+DETECTOR_CONFIG = "detector.json"
+EXPORT_DIR = ".detector_cache"
+MODEL_REGISTRY = os.path.join("models", "registry.json")
+BACKENDS = ("pytorch", "onnx", "openvino")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Valores usados quando detector.json não existe ou não define a chave
+DEFAULT_CONFIG = {
+    "model": "yolov8n.pt",
+    "backend": "pytorch",
+    "imgsz": 640,
+    "int8": False,
+    "dynamic": True,
+    "calibration_dir": "evidence",
+    "calibration_size": 300,
+    "registry": MODEL_REGISTRY,
+    "levels": None,  # níveis do escalonador por latência (scheduler.py); None = derivados de imgsz
+}
+
+
+def load_config(path=DETECTOR_CONFIG, **overrides):
+    """
+    Configuração do detector: padrão < detector.json < modelo registrado <
+    argumentos (None é ignorado). Se "model" é um nome do registro
+    ("construcao" ou "construcao@2"), os pesos, o tamanho de entrada e o
+    backend escolhidos no treino substituem os do detector.json.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    config.update(overrides)
+    entry = resolve_model(config["model"], config["registry"])
+    if entry is not None:
+        config.update(model=entry["weights"], imgsz=entry["imgsz"], backend=entry["backend"], int8=entry["int8"],
+                      registered=f"{entry['name']}@{entry['version']}", weights_sha256=entry.get("weights_sha256"))
+        config.update({key: value for key, value in overrides.items() if key != "model"})
+    if config["backend"] not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {config['backend']} (use {', '.join(BACKENDS)})")
+    return config
+
+
+# --- REGISTRO DE MODELOS (models/registry.json: nome -> versões) ---
+
+def read_registry(path=MODEL_REGISTRY):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_model(spec, path=MODEL_REGISTRY):
+    """Versão registrada de "nome" (a mais recente) ou "nome@versão"; None se não é um nome do registro"""
+    name, _, version = str(spec).partition("@")
+    versions = read_registry(path).get(name)
+    if not versions:
+        return None
+    if not version:
+        entry = versions[-1]
+    else:
+        entry = next((entry for entry in versions if str(entry["version"]) == version.lstrip("v")), None)
+        if entry is None:
+            raise ValueError(f"Modelo {name} sem a versão {version} "
+                             f"(registradas: {', '.join(str(entry['version']) for entry in versions)})")
+    # Pesos gravados relativos ao diretório do registro
+    return dict(entry, weights=os.path.join(os.path.dirname(path), entry["weights"]))
+
+
+def register_model(name, weights, path=MODEL_REGISTRY, **info):
+    """
+    Copia os pesos para models/<nome>/v<versão>/ e acrescenta a versão ao
+    registro (as anteriores continuam carregáveis por nome@versão).
+    """
+    registry = read_registry(path)
+    versions = registry.setdefault(name, [])
+    version = versions[-1]["version"] + 1 if versions else 1
+    root = os.path.dirname(path)
+    relative = os.path.join(name, f"v{version}", f"{name}.pt")
+    os.makedirs(os.path.join(root, os.path.dirname(relative)), exist_ok=True)
+    shutil.copy(weights, os.path.join(root, relative))
+    entry = {"name": name, "version": version, "weights": relative,
+             "weights_sha256": file_sha256(os.path.join(root, relative)), **info}
+    versions.append(entry)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=root or ".")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return entry
+
+
+def calibration_images(directory, limit=300):
+    """Frames capturados (evidências, dados de treino) usados na calibração INT8"""
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    paths.sort()
+    if len(paths) > limit:
+        # Amostra espaçada ao longo de todo o período capturado
+        paths = [paths[i] for i in np.linspace(0, len(paths) - 1, limit).astype(int)]
+    return paths
+
+
+def letterbox(frame, imgsz):
+    """Redimensiona mantendo a proporção e completa com cinza (mesma entrada do YOLO)"""
+    height, width = frame.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return canvas
+
+
+def quantize_onnx(onnx_path, output_path, images, imgsz):
+    """Quantização INT8 estática (QDQ) com onnxruntime; dinâmica se não houver imagens"""
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+
+    if not images:
+        print("Aviso: sem frames de calibração, usando quantização INT8 dinâmica")
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+        return output_path
+
+    input_name = InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(images)
+
+        def get_next(self):
+            for path in self.paths:
+                frame = cv2.imread(path)
+                if frame is None:
+                    continue
+                image = letterbox(frame, imgsz)[:, :, ::-1].transpose(2, 0, 1)
+                return {input_name: np.ascontiguousarray(image[None], dtype=np.float32) / 255.0}
+            return None
+
+    quantize_static(onnx_path, output_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    return output_path
+
+
+def write_calibration_dataset(images, names, directory):
+    """Dataset YOLO mínimo (só imagens) para a calibração INT8 do OpenVINO"""
+    image_dir = os.path.join(directory, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    for i, path in enumerate(images):
+        shutil.copy(path, os.path.join(image_dir, f"{i:05d}{os.path.splitext(path)[1].lower()}"))
+    yaml_path = os.path.join(directory, "calibration.yaml")
+    with open(yaml_path, 'w', encoding='utf-8') as f:
+        f.write(f"path: {os.path.abspath(directory)}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in sorted(names.items()):
+            f.write(f"  {class_id}: {json.dumps(name)}\n")
+    return yaml_path
+
+
+def _artifact_key(config, weights_hash):
+    from ultralytics import __version__
+
+    return {
+        "weights_sha256": weights_hash,
+        "backend": config["backend"],
+        "imgsz": config["imgsz"],
+        "int8": bool(config["int8"]),
+        "dynamic": bool(config["dynamic"]),
+        "ultralytics": __version__,
+    }
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp_path = os.path.join(path, ".manifest.json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, "manifest.json"))
+
+
+def _export_target(weights, key, export_dir):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    suffix = "-int8" if key["int8"] else ""
+    return os.path.join(export_dir, f"{stem}-{key['backend']}{suffix}-{key['imgsz']}")
+
+
+def _cached_artifact(config, weights, export_dir):
+    """
+    Artefato em cache de pesos locais sem carregar o modelo nem ler os pesos:
+    vale se o tamanho e a data do arquivo não mudaram desde a exportação ou
+    se o SHA-256 do registro é o do cache. None = conferir pelo hash.
+    """
+    key = _artifact_key(config, None)
+    target = _export_target(weights, key, export_dir)
+    manifest = _read_manifest(target)
+    if manifest is None:
+        return None
+    cached_key = dict(manifest.get("key", {}))
+    cached_hash = cached_key.pop("weights_sha256", None)
+    key.pop("weights_sha256")
+    if cached_key != key:
+        return None
+    stat = os.stat(weights)
+    unchanged = (manifest.get("size"), manifest.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+    if not unchanged and (cached_hash is None or config.get("weights_sha256") != cached_hash):
+        return None
+    return os.path.join(target, manifest["artifact"])
+
+
+def export_model(config, export_dir=EXPORT_DIR):
+    """
+    Exporta os pesos para ONNX/OpenVINO uma única vez e devolve o caminho
+    do artefato. O cache é invalidado quando mudam os pesos (SHA-256), o
+    backend, o tamanho de entrada, a quantização ou a versão do ultralytics;
+    com pesos locais ele é conferido antes de carregar o modelo, e o hash só
+    é recalculado quando o tamanho ou a data do arquivo mudam.
+    """
+    if os.path.exists(config["model"]):
+        cached = _cached_artifact(config, config["model"], export_dir)
+        if cached is not None:
+            return cached
+
+    from ultralytics import YOLO
+
+    model = YOLO(config["model"])  # baixa os pesos oficiais se necessário
+    weights = model.ckpt_path or config["model"]
+    key = _artifact_key(config, file_sha256(weights))
+    stat = os.stat(weights)
+
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    target = _export_target(weights, key, export_dir)
+    manifest = _read_manifest(target)
+    if manifest is not None and manifest.get("key") == key:
+        # Mesmo conteúdo com outra data: atualiza para a próxima partida não recalcular o hash
+        if (manifest.get("size"), manifest.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+            _write_manifest(target, dict(manifest, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+        return os.path.join(target, manifest["artifact"])
+
+    print(f"Exportando {weights} para {key['backend']}{' INT8' if key['int8'] else ''} (imgsz={key['imgsz']})...")
+    os.makedirs(export_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=export_dir)
+    try:
+        # O ultralytics grava o artefato ao lado dos pesos: exporta a partir de uma cópia
+        local_weights = os.path.join(tmp_dir, os.path.basename(weights))
+        shutil.copy(weights, local_weights)
+        images = calibration_images(config["calibration_dir"], config["calibration_size"]) if key["int8"] else []
+
+        if key["backend"] == "onnx":
+            artifact = YOLO(local_weights).export(format="onnx", imgsz=key["imgsz"], dynamic=key["dynamic"])
+            if key["int8"]:
+                artifact = quantize_onnx(artifact, os.path.join(tmp_dir, f"{stem}_int8.onnx"), images, key["imgsz"])
+        else:
+            data = write_calibration_dataset(images, model.names, os.path.join(tmp_dir, "calibration")) if images else None
+            if key["int8"] and data is None:
+                print("Aviso: sem frames de calibração, o ultralytics usará o dataset padrão")
+            artifact = YOLO(local_weights).export(format="openvino", imgsz=key["imgsz"], dynamic=key["dynamic"],
+                                                  int8=key["int8"], data=data)
+        shutil.rmtree(os.path.join(tmp_dir, "calibration"), ignore_errors=True)
+
+        _write_manifest(tmp_dir, {"key": key, "artifact": os.path.relpath(artifact, tmp_dir),
+                                  "calibration_images": len(images), "size": stat.st_size,
+                                  "mtime_ns": stat.st_mtime_ns})
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return os.path.join(target, _read_manifest(target)["artifact"])
+
+
+def load_detector(config_path=DETECTOR_CONFIG, **overrides):
+    """
+    Carrega o detector conforme a configuração. Todos os backends devolvem
+    um objeto YOLO do ultralytics: predict, names e os resultados são os
+    mesmos em bim.py, yolo.py, no treinador e no servidor de inferência.
+    Se a exportação falhar (ex.: onnxruntime/openvino ausente), usa PyTorch.
+    """
+    from ultralytics import YOLO
+
+    config = load_config(config_path, **overrides)
+    detector = None
+    if config["backend"] != "pytorch":
+        try:
+            detector = YOLO(export_model(config), task="detect")
+        except Exception as e:
+            print(f"Aviso: backend {config['backend']} indisponível ({e}), usando PyTorch")
+    if detector is None:
+        detector = YOLO(config["model"])
+    # predict() usa o tamanho de entrada exportado sem que cada chamada precise informá-lo
+    detector.overrides["imgsz"] = config["imgsz"]
+    return detector
+
+
+# --- ADAPTADOR DE DETECÇÃO (sem cópias no laço quente) ---
+
+# Uma linha por detecção, em pixels do frame original
+DETECTION_DTYPE = np.dtype([("box", np.float32, (4,)), ("conf", np.float32), ("cls", np.int32)])
+
+
+def empty_detections():
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def detections_from_data(data, scale=1.0, pad=(0, 0), frame_shape=None):
+    """Converte a matriz N x 6 (x1, y1, x2, y2, conf, cls) em DETECTION_DTYPE, desfazendo o letterbox"""
+    data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+    detections = np.empty(len(data), dtype=DETECTION_DTYPE)
+    boxes = detections["box"]
+    boxes[:] = data[:, :4]
+    if scale != 1.0 or pad != (0, 0):
+        boxes -= (pad[0], pad[1], pad[0], pad[1])
+        boxes /= scale
+    if frame_shape is not None:
+        np.clip(boxes[:, 0::2], 0, frame_shape[1], out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, frame_shape[0], out=boxes[:, 1::2])
+    detections["conf"] = data[:, 4]
+    detections["cls"] = data[:, 5]
+    return detections
+
+
+def result_to_detections(result):
+    """Resultado do ultralytics -> DETECTION_DTYPE com uma única transferência do tensor"""
+    if result.boxes is None:
+        return empty_detections()
+    return detections_from_data(result.boxes.data.cpu().numpy())
+
+
+class LetterboxBuffer:
+    """
+    Buffers de entrada pré-alocados e reutilizados a cada lote.
+
+    Cada frame é redimensionado direto para dentro de uma tela uint8 fixa
+    (cv2.resize com dst) e a tela é convertida, canal a canal, para um
+    tensor float32 BCHW também fixo. A borda cinza só é repintada quando
+    a geometria do frame muda. Mesma geometria do LetterBox do ultralytics
+    (auto=True: borda mínima, múltipla do stride).
+    """
+
+    def __init__(self, imgsz=640, stride=32, rect=True):
+        self.imgsz = imgsz
+        self.stride = stride
+        self.rect = rect
+        self.buffers = {}  # (altura, largura) -> (tela uint8, tensor float32, geometria por posição)
+
+    def geometry(self, frame_shape, rect):
+        """(altura, largura) da entrada, escala e (esquerda, topo) da imagem dentro dela"""
+        height, width = frame_shape[:2]
+        scale = min(self.imgsz / height, self.imgsz / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        pad_w, pad_h = self.imgsz - new_w, self.imgsz - new_h
+        if rect:
+            pad_w, pad_h = pad_w % self.stride, pad_h % self.stride
+        left, top = int(round(pad_w / 2 - 0.1)), int(round(pad_h / 2 - 0.1))
+        return (new_h + pad_h, new_w + pad_w), scale, (new_w, new_h), (left, top)
+
+    def _buffer(self, shape, batch_size):
+        import torch
+
+        buffer = self.buffers.get(shape)
+        if buffer is None or len(buffer[0]) < batch_size:
+            canvas = np.full((batch_size,) + shape + (3,), 114, dtype=np.uint8)
+            tensor = torch.empty((batch_size, 3) + shape, dtype=torch.float32)
+            buffer = (canvas, tensor, [None] * batch_size)
+            self.buffers[shape] = buffer
+        return buffer
+
+    def fill(self, frames):
+        """Preenche o buffer com os frames; retorna (tensor do lote, [(escala, (esquerda, topo))])"""
+        import torch
+
+        # Frames de tamanhos diferentes no mesmo lote usam a entrada quadrada
+        rect = self.rect and len({frame.shape for frame in frames}) == 1
+        shape = self.geometry(frames[0].shape, rect)[0]
+        canvas, tensor, slots = self._buffer(shape, len(frames))
+
+        letterbox = []
+        for i, frame in enumerate(frames):
+            _, scale, (new_w, new_h), (left, top) = self.geometry(frame.shape, rect)
+            if slots[i] != (new_w, new_h, left, top):
+                canvas[i].fill(114)
+                slots[i] = (new_w, new_h, left, top)
+            target = canvas[i, top:top + new_h, left:left + new_w]
+            if (new_h, new_w) == frame.shape[:2]:
+                target[...] = frame
+            else:
+                cv2.resize(frame, (new_w, new_h), dst=target, interpolation=cv2.INTER_LINEAR)
+            letterbox.append((scale, (left, top)))
+
+        # BGR uint8 (NHWC) -> RGB float32 (NCHW) em [0, 1], sem alocar
+        count = len(frames)
+        source = torch.from_numpy(canvas[:count])
+        batch = tensor[:count]
+        for channel in range(3):
+            batch[:, channel].copy_(source[..., 2 - channel])
+        batch.mul_(1 / 255)
+        return batch, letterbox
+
+
+class DetectionAdapter:
+    """
+    Detector com entrada pré-alocada e saída em arrays NumPy.
+
+    predict(frames) devolve, para cada frame, um array DETECTION_DTYPE
+    (caixa em pixels do frame, confiança, classe). O pré-processamento usa
+    o LetterboxBuffer e, depois da primeira chamada (que prepara o
+    predictor do ultralytics), o lote vai direto para o backend + NMS, sem
+    criar objetos Results nem converter caixa por caixa.
+    """
+
+    def __init__(self, model, conf=0.5, iou=0.7, max_det=300):
+        self.model = model
+        self.names = model.names
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        imgsz = model.overrides.get("imgsz", 640)
+        self.buffer = LetterboxBuffer(imgsz if isinstance(imgsz, int) else max(imgsz),
+                                      rect=not isinstance(model.model, str))  # só o PyTorch aceita entrada retangular
+        self.nms = None
+
+    def set_imgsz(self, imgsz):
+        """Troca o tamanho de entrada (escalonador); o buffer de cada geometria fica em cache"""
+        self.buffer.imgsz = imgsz
+
+    def _setup(self, batch):
+        """Primeira chamada pelo predict do ultralytics: cria o predictor (backend, dispositivo)"""
+        self.model.predict(batch, conf=self.conf, iou=self.iou, max_det=self.max_det, verbose=False)
+        try:
+            from ultralytics.utils.nms import non_max_suppression
+        except ImportError:
+            from ultralytics.utils.ops import non_max_suppression
+        self.nms = non_max_suppression
+
+    def predict(self, frames):
+        """Detecções (DETECTION_DTYPE) de cada frame da lista"""
+        import torch
+
+        if not frames:
+            return []
+        batch, letterbox = self.buffer.fill(frames)
+        if self.nms is None:
+            self._setup(batch)
+        predictor = self.model.predictor
+        with torch.inference_mode():
+            preds = predictor.model(batch.to(predictor.device) if predictor.device.type != "cpu" else batch)
+            outputs = self.nms(preds, self.conf, self.iou, max_det=self.max_det)
+        return [detections_from_data(output.cpu().numpy(), scale, pad, frame.shape)
+                for output, (scale, pad), frame in zip(outputs, letterbox, frames)]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Exporta o detector e mede a latência na CPU")
+    parser.add_argument("--config", default=DETECTOR_CONFIG, help="Arquivo de configuração")
+    parser.add_argument("--model", help="Pesos YOLO (.pt) ou nome registrado (nome@versão)")
+    parser.add_argument("--backend", choices=BACKENDS, help="Runtime de inferência")
+    parser.add_argument("--imgsz", type=int, help="Tamanho de entrada")
+    parser.add_argument("--int8", action="store_true", default=None, help="Quantização INT8")
+    parser.add_argument("--runs", type=int, default=50, help="Inferências para medir a latência")
+    args = parser.parse_args()
+
+    config = load_config(args.config, model=args.model, backend=args.backend, imgsz=args.imgsz, int8=args.int8)
+    detector = load_detector(args.config, model=args.model, backend=args.backend, imgsz=args.imgsz, int8=args.int8)
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    detector.predict(frame, verbose=False)  # aquecimento
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        detector.predict(frame, verbose=False)
+    elapsed = (time.perf_counter() - start) / args.runs
+    print(f"{config.get('registered', config['model'])} {config['backend']}{' INT8' if config['int8'] else ''} "
+          f"(imgsz={config['imgsz']}): {elapsed * 1000:.1f}ms por frame "
+          f"({1 / elapsed:.1f} FPS)")
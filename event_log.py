@@ -0,0 +1,148 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+EVENT_LOG = "events.jsonl"
+LOGGER_NAME = "bim.events"
+
+logger = logging.getLogger(LOGGER_NAME)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por evento: horário, nível, nome do evento e campos"""
+
+    def format(self, record):
+        event = {"ts": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        event.update(getattr(record, "fields", {}))
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Formato curto para o terminal: hora, evento e campos chave=valor"""
+
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items()
+                          if not isinstance(value, (list, dict)))
+        return f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname} " \
+               f"{record.getMessage()} {fields}".rstrip()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Política de amostragem: eventos WARNING ou acima (alertas, erros) sempre
+    passam; eventos INFO passam 1 a cada sample_every, contados por evento e
+    câmera. O EventLog ativo a aplica em log_event/log_frame antes de montar
+    os campos e o LogRecord: os eventos descartados não custam nada além do
+    contador.
+    """
+
+    def __init__(self, sample_every=30):
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.counters = {}
+
+    def sample(self, event, level=logging.INFO, camera_id=None):
+        if level >= logging.WARNING:
+            return True
+        key = (event, camera_id)
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        return count % self.sample_every == 0
+
+    def filter(self, record):
+        return self.sample(record.msg, record.levelno, getattr(record, "fields", {}).get("camera_id"))
+
+
+# Amostragem do EventLog ativo (None = sem amostragem)
+_sampling = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler com fila limitada: se a escrita atrasar, descarta e conta em vez de bloquear"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventLog:
+    """
+    Log estruturado de eventos sem bloquear o loop principal: os registros
+    vão para uma fila e uma thread de fundo (QueueListener) grava em JSON
+    lines com rotação por tamanho e, opcionalmente, no terminal a partir de
+    console_level.
+    """
+
+    def __init__(self, path=EVENT_LOG, max_bytes=50 * 1024 * 1024, backups=5, sample_every=30,
+                 console_level=logging.WARNING, max_queue=10000):
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding="utf-8", delay=True)
+        file_handler.setFormatter(JsonFormatter())
+        handlers = [file_handler]
+        if console_level is not None:
+            console = logging.StreamHandler(sys.stderr)
+            console.setLevel(console_level)
+            console.setFormatter(ConsoleFormatter())
+            handlers.append(console)
+
+        global _sampling
+        self.path = path
+        self.handler = DroppingQueueHandler(queue.Queue(max_queue))
+        self.sampling = _sampling = SamplingFilter(sample_every)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        logger.addHandler(self.handler)
+
+    def close(self):
+        """Esvazia a fila e fecha os arquivos"""
+        global _sampling
+        if _sampling is self.sampling:
+            _sampling = None
+        logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def report(self):
+        return (f"Log de eventos: {self.path}"
+                + (f" ({self.handler.dropped} eventos descartados por fila cheia)" if self.handler.dropped else ""))
+
+
+def should_log(event, level=logging.INFO, camera_id=None):
+    """Nível habilitado e evento escolhido pela amostragem (decidido antes de montar o evento)"""
+    return logger.isEnabledFor(level) and (_sampling is None or _sampling.sample(event, level, camera_id))
+
+
+def record_event(event, level=logging.INFO, **fields):
+    """Grava um evento já aprovado por should_log (sem contar de novo na amostragem)"""
+    logger.log(level, event, extra={"fields": fields})
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Registra um evento (os campos viram chaves do JSON)"""
+    if should_log(event, level, fields.get("camera_id")):
+        record_event(event, level, **fields)
+
+
+def log_frame(analysis, camera_id=0, frame_number=None):
+    """Evento de um frame analisado: WARNING com alertas (sempre gravado), INFO caso contrário (amostrado)"""
+    event, level = ("alerta", logging.WARNING) if analysis["alerts"] else ("frame", logging.INFO)
+    if not should_log(event, level, camera_id):
+        return
+    detections = [{"class": info["class"], "confidence": round(float(info["confidence"]), 3),
+                   "analysis": info["analysis"], "alert": bool(info["alert"])}
+                  for info in analysis["detections"]]
+    record_event(event, level, camera_id=camera_id, frame=frame_number,
+                 compliance=round(float(analysis["compliance"]), 1), status=analysis["status"],
+                 alerts=analysis["alerts"], detections=detections)
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from persistence import DB_FILE, connect, epoch_ms
+
+EVIDENCE_DIR = "evidence"
+
+
+def dhash(frame, size=8):
+    """Hash perceptual (diferença de gradiente) de 64 bits do frame"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class EvidenceStore:
+    """
+    Armazenamento de evidências de alertas.
+
+    Para cada frame com alerta grava, em uma thread de trabalho, o frame
+    reduzido (JPEG/WebP) e o recorte em resolução total de cada caixa com
+    desvio. Os arquivos são endereçados pelo SHA-256 do conteúdo, frames
+    quase idênticos aos anteriores da mesma câmera são ignorados (hash
+    perceptual) e o espaço total é limitado a max_bytes, apagando as
+    evidências referenciadas há mais tempo (um conteúdo gravado de novo
+    volta ao fim da fila). Cada frame salvo é registrado na tabela frames.
+    """
+
+    def __init__(self, root=EVIDENCE_DIR, db_path=DB_FILE, max_bytes=2 * 1024 ** 3, max_width=640,
+                 image_format="jpg", quality=80, phash_threshold=6, queue_size=32):
+        self.root = root
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_width = max_width
+        self.extension = "." + image_format.lower().lstrip(".")
+        if self.extension == ".webp":
+            self.encode_params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        else:
+            self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.phash_threshold = phash_threshold
+        self.last_hash = {}
+        self.saved = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self.files, self.total_bytes = self._scan()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _scan(self):
+        """Arquivos existentes (caminho -> tamanho) do mais antigo para o mais novo"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        return OrderedDict((path, size) for _, path, size in entries), sum(size for _, _, size in entries)
+
+    def submit(self, frame, boxes, camera_id=0, timestamp=None):
+        """Enfileira um frame com alerta (não bloqueia; descarta se a fila estiver cheia)"""
+        try:
+            self.queue.put_nowait((frame.copy(), list(boxes), camera_id, epoch_ms(timestamp)))
+        except queue.Full:
+            self.dropped += 1
+
+    def save_now(self, frame, camera_id=0, timestamp=None):
+        """Salva um frame imediatamente (captura manual), em resolução total e sem deduplicação"""
+        with self.lock:
+            path = self._write(frame)
+            conn = connect(self.db_path)
+            try:
+                self._register(conn, epoch_ms(timestamp), camera_id, path)
+                self._enforce_limit(conn)
+            finally:
+                conn.close()
+        return path
+
+    def _downscale(self, frame):
+        height, width = frame.shape[:2]
+        if width <= self.max_width:
+            return frame
+        scale = self.max_width / width
+        return cv2.resize(frame, (self.max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    def _write(self, image):
+        """Codifica e grava com nome = SHA-256 do conteúdo; retorna o caminho"""
+        ok, encoded = cv2.imencode(self.extension, image, self.encode_params)
+        if not ok:
+            raise ValueError(f"Falha ao codificar evidência em {self.extension}")
+        data = encoded.tobytes()
+        digest = hashlib.sha256(data).hexdigest()
+        directory = os.path.join(self.root, digest[:2])
+        path = os.path.join(directory, digest + self.extension)
+        if path in self.files:
+            # Conteúdo já gravado: passa a ser o mais recente na fila de remoção (mtime para o _scan)
+            self.files.move_to_end(path)
+            os.utime(path)
+            return path
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self.files[path] = len(data)
+        self.total_bytes += len(data)
+        return path
+
+    def _enforce_limit(self, conn):
+        """Apaga as evidências referenciadas há mais tempo até respeitar max_bytes"""
+        removed = []
+        while self.total_bytes > self.max_bytes and self.files:
+            path, size = self.files.popitem(last=False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            removed.append((path,))
+        if removed and conn is not None:
+            with conn:
+                conn.executemany("DELETE FROM frames WHERE path = ?", removed)
+
+    def _register(self, conn, ts, camera_id, path):
+        own_connection = conn is None
+        if own_connection:
+            conn = connect(self.db_path)
+        try:
+            with conn:
+                conn.execute("INSERT INTO frames (ts, camera_id, sha256, path) VALUES (?, ?, ?, ?)",
+                             (ts, camera_id, os.path.splitext(os.path.basename(path))[0], path))
+        finally:
+            if own_connection:
+                conn.close()
+
+    def _save(self, conn, frame, boxes, camera_id, ts):
+        frame_hash = dhash(frame)
+        previous = self.last_hash.get(camera_id)
+        if previous is not None and hamming(frame_hash, previous) <= self.phash_threshold:
+            self.duplicates += 1
+            return
+        self.last_hash[camera_id] = frame_hash
+
+        with self.lock:
+            path = self._write(self._downscale(frame))
+            height, width = frame.shape[:2]
+            for x1, y1, x2, y2 in boxes:
+                x1, y1 = max(0, int(x1)), max(0, int(y1))
+                x2, y2 = min(width, int(x2)), min(height, int(y2))
+                if x2 > x1 and y2 > y1:
+                    crop_path = self._write(frame[y1:y2, x1:x2])
+                    self._register(conn, ts, camera_id, crop_path)
+            self._register(conn, ts, camera_id, path)
+            self._enforce_limit(conn)
+        self.saved += 1
+
+    def _worker(self):
+        conn = None
+        try:
+            conn = connect(self.db_path)
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                try:
+                    self._save(conn, *item)
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    print(f"Erro ao salvar evidência: {e}")
+        except sqlite3.Error as e:
+            print(f"Erro ao abrir o banco de evidências: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        """Processa o que está na fila e encerra a thread (sem travar se ela já terminou)"""
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+
+    def report(self):
+        return (f"Evidências: {self.saved} salvas, {self.duplicates} duplicadas ignoradas, "
+                f"{self.dropped} descartadas, {self.total_bytes / 1024 ** 2:.1f} MB em disco")
@@ -0,0 +1,100 @@
+import multiprocessing
+
+import numpy as np
+import ifcopenshell
+import ifcopenshell.geom
+import ifcopenshell.util.placement
+
+# Tipos IFC processados e eixo local usado como eixo do elemento
+GEOMETRY_TYPES = ("IfcWall", "IfcBeam", "IfcColumn")
+AXIS_BY_TYPE = {"IfcWall": 0, "IfcBeam": 0, "IfcColumn": 2}  # X local; pilares usam Z
+
+
+def create_settings():
+    """Configuração do ifcopenshell.geom com coordenadas de mundo"""
+    settings = ifcopenshell.geom.settings()
+    if hasattr(settings, "USE_WORLD_COORDS"):
+        settings.set(settings.USE_WORLD_COORDS, True)
+    else:  # ifcopenshell >= 0.8
+        settings.set("use-world-coords", True)
+    return settings
+
+
+def placement_matrix(entity):
+    """Matriz 4x4 de posicionamento no mundo (ObjectPlacement)"""
+    if entity.ObjectPlacement is None:
+        return np.eye(4)
+    return np.asarray(ifcopenshell.util.placement.get_local_placement(entity.ObjectPlacement), dtype=np.float64)
+
+
+def element_geometry(ifc_type, matrix, verts):
+    """
+    Calcula caixa envolvente, centróide e extremidades do eixo do elemento
+    a partir dos vértices já em coordenadas de mundo.
+    """
+    bbox_min = verts.min(axis=0)
+    bbox_max = verts.max(axis=0)
+    center = (bbox_min + bbox_max) / 2
+
+    # Eixo: direção local do posicionamento, limitado pela extensão dos vértices
+    direction = matrix[:3, AXIS_BY_TYPE.get(ifc_type, 0)]
+    norm = np.linalg.norm(direction)
+    direction = direction / norm if norm > 0 else np.array([1.0, 0.0, 0.0])
+    projection = (verts - center) @ direction
+    axis_start = center + direction * projection.min()
+    axis_end = center + direction * projection.max()
+
+    return {
+        "bbox_min": bbox_min,
+        "bbox_max": bbox_max,
+        "center": center,
+        "axis_start": axis_start,
+        "axis_end": axis_end,
+    }
+
+
+def extract_geometry(bim_model, types=GEOMETRY_TYPES, num_threads=None):
+    """
+    Extrai a geometria de paredes, vigas e pilares com o iterador
+    multi-thread do ifcopenshell.geom (a triangulação roda em C++ em
+    paralelo em todos os núcleos).
+
+    Retorna um dicionário GlobalId -> registro de geometria.
+    """
+    entities = [entity for ifc_type in types for entity in bim_model.by_type(ifc_type)]
+    if not entities:
+        return {}
+
+    num_threads = num_threads or multiprocessing.cpu_count()
+    iterator = ifcopenshell.geom.iterator(create_settings(), bim_model, num_threads, include=entities)
+
+    geometry = {}
+    if not iterator.initialize():
+        return geometry
+
+    while True:
+        shape = iterator.get()
+        verts = np.asarray(shape.geometry.verts, dtype=np.float64).reshape(-1, 3)
+        if len(verts):
+            entity = bim_model.by_id(shape.id)
+            ifc_type = entity.is_a()
+            record = element_geometry(ifc_type, placement_matrix(entity), verts)
+            record.update({"type": ifc_type, "name": entity.Name or ""})
+            geometry[entity.GlobalId] = record
+        if not iterator.next():
+            break
+
+    return geometry
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "metro_sp.ifc"
+    start = time.perf_counter()
+    geometry = extract_geometry(ifcopenshell.open(path))
+    print(f"{len(geometry)} elementos processados em {time.perf_counter() - start:.2f}s")
+    for guid, record in list(geometry.items())[:10]:
+        print(f"  - {record['type']} {record['name']}: eixo "
+              f"{np.round(record['axis_start'], 3).tolist()} -> {np.round(record['axis_end'], 3).tolist()}")
@@ -0,0 +1,336 @@
+import argparse
+import threading
+import time
+from functools import partial
+
+import cv2
+
+from detector import DetectionAdapter
+from motion_gate import offset_detections
+from pipeline import DropOldestQueue, StageStats
+
+
+def parse_source(spec):
+    """Converte '0' em índice de dispositivo; URLs RTSP e arquivos ficam como texto"""
+    if isinstance(spec, int):
+        return spec
+    return int(spec) if spec.isdigit() else spec
+
+
+def is_live_source(source):
+    """Câmeras e streams descartam frames antigos; arquivos de vídeo não"""
+    return isinstance(source, int) or "://" in source
+
+
+class FrameSlots:
+    """
+    Um slot por stream com o frame mais recente ainda não processado.
+
+    As threads de captura preenchem os slots e o agrupador de lotes
+    esvazia todos os slots prontos de uma vez.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.dropped = {}
+        self.cond = threading.Condition()
+
+    def put(self, stream_id, item, wait=False, stop_event=None):
+        """Guarda o frame; fontes ao vivo sobrescrevem, arquivos esperam o slot esvaziar"""
+        with self.cond:
+            if wait:
+                while stream_id in self.slots and not (stop_event and stop_event.is_set()):
+                    self.cond.wait(0.1)
+            elif stream_id in self.slots:
+                self.dropped[stream_id] = self.dropped.get(stream_id, 0) + 1
+            self.slots[stream_id] = item
+            self.cond.notify_all()
+
+    def take_batch(self, max_batch, max_wait, timeout=0.1):
+        """
+        Espera o primeiro frame e, a partir dele, até max_wait segundos
+        para completar o lote. Retorna lista de (stream_id, item).
+        """
+        with self.cond:
+            if not self.slots:
+                self.cond.wait(timeout)
+                if not self.slots:
+                    return []
+            deadline = time.perf_counter() + max_wait
+            while len(self.slots) < max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            # Processa primeiro os frames mais antigos
+            ready = sorted(self.slots.items(), key=lambda entry: entry[1][1])[:max_batch]
+            for stream_id, _ in ready:
+                del self.slots[stream_id]
+            self.cond.notify_all()
+            return ready
+
+
+class CameraStream:
+    """Thread de captura de uma fonte (câmera, RTSP ou arquivo de vídeo)"""
+
+    def __init__(self, stream_id, source, slots, stop_event, profiler=None):
+        self.stream_id = stream_id
+        self.source = parse_source(source)
+        self.live = is_live_source(self.source)
+        self.slots = slots
+        self.stop_event = stop_event
+        self.profiler = profiler
+        self.frames_read = 0
+        self.finished = threading.Event()
+        self.cap = cv2.VideoCapture(self.source)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            if self.profiler is not None:
+                self.profiler.add("captura", time.perf_counter() - start, self.stream_id)
+            self.slots.put(self.stream_id, (self.frames_read, time.time(), frame),
+                           wait=not self.live, stop_event=self.stop_event)
+            self.frames_read += 1
+        self.cap.release()
+        self.finished.set()
+
+
+class BatchInferenceServer:
+    """
+    Servidor de inferência em lote para várias câmeras.
+
+    Um único modelo YOLO atende N fontes: os frames prontos são agrupados
+    em lotes de tamanho dinâmico (até max_batch, esperando no máximo
+    max_wait segundos), processados com uma chamada do DetectionAdapter e
+    as detecções (array DETECTION_DTYPE) são devolvidas por stream (fila
+    própria e/ou callback). Com gate_factory (ex.: MotionGate) cada stream
+    só vai para o lote quando a cena muda; nos outros frames o mesmo array
+    de detecções anterior é devolvido. Com profiler (profiling.Profiler),
+    o tempo de leitura de cada câmera entra nos histogramas de etapa. Com
+    scheduler_factory (ex.: partial de scheduler.LatencyScheduler, chamado
+    com camera_id) cada stream tem o próprio orçamento: tamanho de entrada,
+    confiança e stride vêm do nível do stream, o lote é limitado pelo menor
+    nível e cada frame informa ao seu escalonador a própria idade ao fim da
+    inferência (espera na fila + lote + modelo). Streams em níveis com
+    entrada ou confiança diferentes são inferidos em sublotes separados.
+    """
+
+    def __init__(self, model, sources, max_batch=8, max_wait=0.02, conf=0.5, on_result=None, gate_factory=None,
+                 profiler=None, scheduler_factory=None):
+        self.model = model
+        self.detector = DetectionAdapter(model, conf=conf)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.conf = conf
+        self.on_result = on_result
+        self.stop_event = threading.Event()
+        self.slots = FrameSlots()
+        self.profiler = profiler
+        self.streams = [CameraStream(i, source, self.slots, self.stop_event, profiler)
+                        for i, source in enumerate(sources)]
+        self.outputs = {stream.stream_id: DropOldestQueue(2) for stream in self.streams}
+        self.batch_stats = StageStats("Lote", unit="lotes")
+        self.batch_sizes = []
+        self.frames_processed = {stream.stream_id: 0 for stream in self.streams}
+        self.gates = {stream.stream_id: gate_factory() for stream in self.streams} if gate_factory else {}
+        self.schedulers = ({stream.stream_id: scheduler_factory(camera_id=stream.stream_id)
+                            for stream in self.streams} if scheduler_factory else {})
+        self.last_detections = {}
+        self.stride_counters = {stream.stream_id: 0 for stream in self.streams}
+        self.thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self.done = threading.Event()
+
+    def start(self):
+        """Inicia as capturas abertas com sucesso e o laço de inferência"""
+        for stream in self.streams:
+            if stream.is_opened():
+                stream.start()
+            else:
+                print(f"Erro: Não foi possível abrir a fonte {stream.source}")
+                stream.finished.set()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+
+    def _all_finished(self):
+        return all(stream.finished.is_set() for stream in self.streams)
+
+    def _batch_loop(self):
+        while not self.stop_event.is_set():
+            levels = {stream_id: scheduler.level for stream_id, scheduler in self.schedulers.items()}
+            max_batch = min((level.batch for level in levels.values()), default=self.max_batch)
+            batch = self.slots.take_batch(max_batch, self.max_wait)
+            if not batch:
+                if self._all_finished():
+                    break
+                continue
+
+            # Streams sem movimento (ou fora do stride do nível atual) reaproveitam as detecções anteriores
+            infer, reuse = [], []
+            for stream_id, item in batch:
+                gate = self.gates.get(stream_id)
+                known = stream_id in self.last_detections
+                level = levels.get(stream_id)
+                if level is not None and known and self._strided(stream_id, level.stride):
+                    reuse.append((stream_id, item))
+                elif gate is None or gate.should_infer(item[2]) or not known:
+                    infer.append((stream_id, item))
+                else:
+                    reuse.append((stream_id, item))
+
+            # Um sublote por combinação de entrada e confiança dos níveis dos streams
+            groups = {}
+            for entry in infer:
+                level = levels.get(entry[0])
+                groups.setdefault((level.imgsz, level.conf) if level is not None else None, []).append(entry)
+            results = []
+            for key, group in groups.items():
+                detections = self._predict(group, key)
+                if detections is not None:
+                    results.extend(zip(group, detections))
+
+            # Distribui os resultados de volta para cada stream
+            for (stream_id, (frame_index, captured_at, frame)), frame_detections in (
+                    results + [(entry, self.last_detections[entry[0]]) for entry in reuse]):
+                self.frames_processed[stream_id] += 1
+                self.outputs[stream_id].put((frame_index, captured_at, frame, frame_detections))
+                if self.on_result:
+                    self.on_result(stream_id, frame_index, frame, frame_detections)
+        self.done.set()
+
+    def _predict(self, group, key):
+        """Detecções de um sublote (None se a inferência falhar); key = (imgsz, conf) ou None"""
+        crops = [self._crop(stream_id, item[2]) for stream_id, item in group]
+        if key is not None:
+            self.detector.set_imgsz(key[0])
+            self.detector.conf = key[1]
+        start = time.perf_counter()
+        try:
+            detections = self.detector.predict([crop for crop, _ in crops])
+        except Exception as e:
+            print(f"Erro na detecção YOLO: {e}")
+            return None
+        self.batch_stats.add(time.perf_counter() - start)
+        self.batch_sizes.append(len(group))
+        now = time.time()
+        detections = [offset_detections(frame_detections, offset)
+                      for frame_detections, (_, offset) in zip(detections, crops)]
+        for (stream_id, item), frame_detections in zip(group, detections):
+            self.last_detections[stream_id] = frame_detections
+            if stream_id in self.schedulers:
+                self.schedulers[stream_id].observe(now - item[1])
+        return detections
+
+    def _strided(self, stream_id, stride):
+        """True nos frames do stream que o stride do nível atual pula"""
+        count = self.stride_counters[stream_id]
+        self.stride_counters[stream_id] = count + 1
+        return count % stride != 0
+
+    def _crop(self, stream_id, frame):
+        gate = self.gates.get(stream_id)
+        return gate.crop(frame) if gate is not None else (frame, (0, 0))
+
+    def set_projection(self, stream_id, projection, frame_shape):
+        """Atualiza a ROI do gate do stream com a projeção do BIM (câmera calibrada)"""
+        gate = self.gates.get(stream_id)
+        if gate is not None:
+            gate.set_projection(projection, frame_shape)
+
+    def get_result(self, stream_id, timeout=None):
+        """Retorna (frame_index, captured_at, frame, detections) do stream ou None"""
+        return self.outputs[stream_id].get(timeout)
+
+    def report(self):
+        """Retorna linhas com vazão por stream e tamanho médio dos lotes"""
+        lines = [self.batch_stats.summary()]
+        if self.batch_sizes:
+            lines.append(f"Tamanho médio do lote: {sum(self.batch_sizes) / len(self.batch_sizes):.1f}")
+        for stream in self.streams:
+            lines.append(f"Stream {stream.stream_id} ({stream.source}): "
+                         f"{stream.frames_read} lidos, "
+                         f"{self.frames_processed[stream.stream_id]} processados, "
+                         f"{self.slots.dropped.get(stream.stream_id, 0)} descartados")
+            if stream.stream_id in self.gates:
+                lines.append(f"  {self.gates[stream.stream_id].report()}")
+            if stream.stream_id in self.schedulers:
+                lines.append(f"  {self.schedulers[stream.stream_id].report()}")
+        return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de inferência YOLO em lote para várias câmeras")
+    parser.add_argument("sources", nargs="+", help="Índices de câmera, URLs RTSP ou arquivos de vídeo")
+    parser.add_argument("--model", help="Pesos YOLO ou nome registrado, ex.: construcao@2 (padrão: detector.json)")
+    parser.add_argument("--batch", type=int, default=8, help="Tamanho máximo do lote")
+    parser.add_argument("--max-wait", type=float, default=20, help="Espera máxima para formar o lote (ms)")
+    parser.add_argument("--conf", type=float, default=0.5, help="Confiança mínima")
+    parser.add_argument("--show", action="store_true", help="Mostra uma janela por stream")
+    parser.add_argument("--budget-ms", type=float,
+                        help="Orçamento de latência por frame de cada stream: reduz entrada, lote e frames "
+                             "inferidos sob carga")
+    args = parser.parse_args()
+
+    from bim import load_model
+    model = load_model(args.model)
+    scheduler_factory = None
+    if args.budget_ms:
+        from detector import load_config
+        from scheduler import LatencyScheduler, detector_levels
+
+        scheduler_factory = partial(LatencyScheduler, args.budget_ms,
+                                    detector_levels(load_config(model=args.model), args.batch, args.conf))
+
+    server = BatchInferenceServer(model, args.sources, max_batch=args.batch, max_wait=args.max_wait / 1000,
+                                  conf=args.conf, scheduler_factory=scheduler_factory)
+    server.start()
+    print(f"Servidor iniciado com {len(server.streams)} fontes. Pressione Ctrl+C (ou 'q' na janela) para sair.")
+
+    start = time.perf_counter()
+    try:
+        while not server.done.is_set():
+            if not args.show:
+                time.sleep(0.1)
+                continue
+            for stream in server.streams:
+                item = server.get_result(stream.stream_id, timeout=0.001)
+                if item is not None:
+                    frame = item[2]
+                    for (x1, y1, x2, y2), conf, cls in zip(item[3]["box"].astype(int).tolist(),
+                                                           item[3]["conf"].tolist(), item[3]["cls"].tolist()):
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                        cv2.putText(frame, f"{model.names[cls]} {conf:.2f}", (x1, y1 - 10),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                    cv2.imshow(f"Stream {stream.stream_id}", frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if args.show:
+            cv2.destroyAllWindows()
+
+    elapsed = time.perf_counter() - start
+    total = sum(server.frames_processed.values())
+    print(f"\nFrames processados: {total} em {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} fps)")
+    for line in server.report():
+        print(f"  - {line}")
+
+
+if __name__ == "__main__":
+    main()
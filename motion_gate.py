@@ -0,0 +1,121 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Decide, frame a frame, se a cena mudou o bastante para rodar o detector.
+
+    Compara uma cópia reduzida em tons de cinza com um modelo de fundo
+    (média móvel) e só considera a região de interesse: as caixas dos
+    elementos BIM projetados na imagem, quando a câmera é calibrada. Com a
+    cena parada o detector roda apenas a cada static_interval frames; nos
+    demais o chamador reaproveita as detecções anteriores. A ROI pode ser
+    atualizada de outra thread (set_projection).
+    """
+
+    def __init__(self, width=160, threshold=25, min_changed=0.002, static_interval=30,
+                 learning_rate=0.05, roi_margin=20):
+        self.width = width
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.static_interval = static_interval
+        self.learning_rate = learning_rate
+        self.roi_margin = roi_margin
+        self.background = None
+        self.small_shape = None
+        self.roi = None            # máscara na resolução reduzida (None = frame inteiro)
+        self.region = None         # (x1, y1, x2, y2) da ROI no frame original
+        self.roi_fingerprint = None
+        self.since_inference = 0
+        self.inferred = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        small_size = (self.width, max(1, int(height * self.width / width)))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, small_size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def set_projection(self, projection, frame_shape):
+        """ROI a partir das caixas projetadas do BIM (recalculada só quando a calibração muda)"""
+        if projection is None or projection.fingerprint == self.roi_fingerprint:
+            return
+        with self.lock:
+            self._build_roi(projection, frame_shape)
+
+    def _build_roi(self, projection, frame_shape):
+        self.roi_fingerprint = projection.fingerprint
+        height, width = frame_shape[:2]
+        visible = projection.visible(frame_shape)
+        if not visible.any():
+            self.roi, self.region = None, None
+            return
+
+        boxes = projection.boxes[visible] + (-self.roi_margin, -self.roi_margin, self.roi_margin, self.roi_margin)
+        boxes = np.clip(boxes, 0, (width, height, width, height)).astype(int)
+        self.region = (int(boxes[:, 0].min()), int(boxes[:, 1].min()),
+                       int(boxes[:, 2].max()), int(boxes[:, 3].max()))
+
+        scale = self.width / width
+        mask = np.zeros((max(1, int(height * scale)), self.width), dtype=np.uint8)
+        for x1, y1, x2, y2 in (boxes * scale).astype(int):
+            mask[y1:y2 + 1, x1:x2 + 1] = 255
+        self.roi = mask
+        self.background = None
+
+    def changed_fraction(self, frame):
+        """Fração da ROI que mudou em relação ao fundo (e atualiza o fundo)"""
+        small = self._small_gray(frame)
+        if self.background is None or small.shape != self.small_shape:
+            self.small_shape = small.shape
+            self.background = small.astype(np.float32)
+            if self.roi is not None and self.roi.shape != small.shape:
+                self.roi = cv2.resize(self.roi, (small.shape[1], small.shape[0]), interpolation=cv2.INTER_NEAREST)
+            return 1.0
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        _, changed = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        if self.roi is not None:
+            changed = cv2.bitwise_and(changed, self.roi)
+            area = cv2.countNonZero(self.roi)
+        else:
+            area = changed.size
+        cv2.accumulateWeighted(small, self.background, self.learning_rate)
+        return cv2.countNonZero(changed) / max(area, 1)
+
+    def should_infer(self, frame):
+        """True quando o detector deve rodar neste frame"""
+        with self.lock:
+            moved = self.changed_fraction(frame) >= self.min_changed
+        if moved or self.since_inference + 1 >= self.static_interval:
+            self.since_inference = 0
+            self.inferred += 1
+            return True
+        self.since_inference += 1
+        self.skipped += 1
+        return False
+
+    def crop(self, frame):
+        """Recorte da ROI (view, sem cópia) e o deslocamento (x, y) para voltar ao frame"""
+        region = self.region
+        if region is None:
+            return frame, (0, 0)
+        x1, y1, x2, y2 = region
+        return frame[y1:y2, x1:x2], (x1, y1)
+
+    def report(self):
+        total = self.inferred + self.skipped
+        return (f"Gate de movimento: {self.inferred} frames inferidos, {self.skipped} reaproveitados "
+                f"({100 * self.skipped / total if total else 0:.0f}% economizados)")
+
+
+def offset_detections(detections, offset):
+    """Leva caixas detectadas no recorte da ROI de volta para o frame (no lugar)"""
+    if offset != (0, 0) and len(detections):
+        detections["box"] += (offset[0], offset[1], offset[0], offset[1])
+    return detections
@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+
+from bim_index import ELEMENT_CLASSES, IFC_TYPES
+
+ONTOLOGY_FILE = "ontology.json"
+
+# Valores usados quando ontology.json não existe ou não define o tipo. Os aliases são os
+# nomes exatos (sem diferenciar maiúsculas) ou ids das classes do detector de cada tipo
+# ("person" e "chair" fazem o modelo COCO padrão servir de demonstração); classes fora
+# dos aliases ficam sem tipo BIM. tolerance_m null = tolerância da câmera.
+DEFAULT_ONTOLOGY = {
+    "types": {
+        "IfcWall": {"aliases": ["wall", "parede", "person"], "tolerance_px": 50, "tolerance_m": None, "weight": 1.0},
+        "IfcBeam": {"aliases": ["beam", "viga", "chair"], "tolerance_px": 50, "tolerance_m": None, "weight": 1.0},
+        "IfcColumn": {"aliases": ["column", "pilar"], "tolerance_px": 50, "tolerance_m": None, "weight": 1.0},
+    },
+    "other_weight": 1.0,
+    "max_deviation_px": 150,
+}
+
+
+def normalize_class(class_name):
+    """Nome de classe comparável: sem espaços nas pontas e em minúsculas"""
+    return str(class_name).strip().lower()
+
+
+class Ontology:
+    """
+    Mapeamento compilado das classes do detector para os tipos IFC do BIM.
+
+    A configuração (aliases, tolerância e peso por tipo) é resolvida uma
+    vez em um dicionário explícito nome normalizado (ou id) da classe do
+    detector -> classe BIM, sem correspondência parcial: "armchair" não é
+    "chair". Para cada conjunto de nomes do detector (model.names) monta-se um
+    array id da classe -> classe BIM, e tolerâncias e pesos ficam em arrays
+    indexados pela classe BIM. Classificar um frame inteiro é um único
+    gather (lookup[cls]); a última posição das tabelas vale para as
+    detecções sem classe BIM (-1).
+    """
+
+    def __init__(self, config=DEFAULT_ONTOLOGY):
+        count = len(ELEMENT_CLASSES)
+        self.classes = {}  # nome normalizado ou id (int) da classe do detector -> classe BIM
+        self.tolerance_px = np.full(count + 1, np.nan)
+        self.tolerance_m = np.full(count + 1, np.nan)
+        self.weights = np.ones(count + 1)
+        for ifc_type, spec in config["types"].items():
+            element_class = IFC_TYPES.get(ifc_type)
+            if element_class is None:
+                raise ValueError(f"Tipo IFC sem classe BIM: {ifc_type} (use {', '.join(IFC_TYPES)})")
+            for alias in spec.get("aliases", ()):
+                alias = alias if isinstance(alias, int) else normalize_class(alias)
+                if self.classes.get(alias, element_class) != element_class:
+                    raise ValueError(f"Classe do detector {alias!r} em mais de um tipo IFC")
+                self.classes[alias] = element_class
+            self.tolerance_px[element_class] = spec.get("tolerance_px", 50)
+            if spec.get("tolerance_m") is not None:
+                self.tolerance_m[element_class] = spec["tolerance_m"]
+            self.weights[element_class] = spec.get("weight", 1.0)
+        self.weights[-1] = config.get("other_weight", 1.0)
+        self.max_deviation_px = config.get("max_deviation_px", 150)
+        self.lookups = {}
+
+    def classify_name(self, class_name):
+        """Classe BIM do nome de classe do detector (comparação exata após normalizar) ou -1"""
+        return self.classes.get(normalize_class(class_name), -1)
+
+    def lookup(self, names):
+        """Array id da classe do detector -> classe BIM, compilado uma vez por dicionário de nomes"""
+        cached = self.lookups.get(id(names))
+        if cached is not None and cached[0] is names:
+            return cached[1]
+        items = names.items() if isinstance(names, dict) else enumerate(names)
+        items = list(items)
+        table = np.full(max((class_id for class_id, _ in items), default=-1) + 1, -1, dtype=np.int64)
+        for class_id, class_name in items:
+            # O id explícito tem precedência sobre o nome
+            table[class_id] = self.classes.get(class_id, self.classify_name(class_name))
+        self.lookups[id(names)] = (names, table)
+        return table
+
+    def classify(self, class_ids, names):
+        """Classes BIM de um array de ids do detector"""
+        return self.lookup(names)[np.asarray(class_ids, dtype=np.int64)]
+
+    def classify_names(self, class_names):
+        return np.fromiter((self.classify_name(name) for name in class_names), dtype=np.int64,
+                           count=len(class_names))
+
+    def tolerances(self, classes, calibration=None):
+        """Tolerância de cada detecção: pixels, ou metros com calibração (tipo sem valor = da câmera)"""
+        if calibration is None:
+            table = np.where(np.isnan(self.tolerance_px), 50, self.tolerance_px)
+        else:
+            table = np.where(np.isnan(self.tolerance_m), calibration.tolerance, self.tolerance_m)
+        return table[np.asarray(classes, dtype=np.int64)]
+
+
+def load_ontology(path=ONTOLOGY_FILE):
+    """Ontologia: padrão < ontology.json (os tipos do arquivo substituem os padrões campo a campo)"""
+    config = json.loads(json.dumps(DEFAULT_ONTOLOGY))
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            custom = json.load(f)
+        for ifc_type, spec in custom.pop("types", {}).items():
+            config["types"].setdefault(ifc_type, {}).update(spec)
+        config.update(custom)
+    return Ontology(config)
+
+
+_default = None
+
+
+def default_ontology():
+    """Ontologia do ontology.json, carregada na primeira chamada e compartilhada"""
+    global _default
+    if _default is None:
+        _default = load_ontology()
+    return _default
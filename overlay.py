@@ -0,0 +1,140 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+class Sprite:
+    """
+    Camada pré-renderizada com canal alfa, recortada ao retângulo desenhado:
+    alfa complementar (255 - alfa) e cor pré-multiplicada. blend() compõe a
+    camada no frame com duas operações vetorizadas do OpenCV (ou uma cópia,
+    quando o retângulo é todo opaco).
+    """
+
+    def __init__(self, inverse, premultiplied, offset=(0, 0)):
+        self.inverse = inverse
+        self.premultiplied = premultiplied
+        self.offset = offset  # canto superior esquerdo relativo ao ponto de ancoragem
+        self.opaque = not inverse.any()  # retângulo sólido: basta copiar
+
+    def blend(self, frame, anchor=(0, 0)):
+        x, y = anchor[0] + self.offset[0], anchor[1] + self.offset[1]
+        height, width = self.inverse.shape[:2]
+        # Parte do sprite que cai dentro do frame
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + width, frame.shape[1]), min(y + height, frame.shape[0])
+        if x2 <= x1 or y2 <= y1:
+            return
+        region = (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+        roi = frame[y1:y2, x1:x2]
+        if self.opaque:
+            roi[:] = self.premultiplied[region]
+        else:
+            roi[:] = cv2.add(cv2.multiply(roi, self.inverse[region], scale=1 / 255), self.premultiplied[region])
+
+
+def crop_sprite(alpha, premultiplied, offset=(0, 0)):
+    """Sprite recortado aos pixels com alfa > 0"""
+    rows, cols = np.flatnonzero(alpha.any(axis=1)), np.flatnonzero(alpha.any(axis=0))
+    if not len(rows):
+        return Sprite(np.zeros((0, 0, 3), np.uint8), np.zeros((0, 0, 3), np.uint8))
+    y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    inverse = np.repeat(255 - alpha[y1:y2, x1:x2, None], 3, axis=2)
+    return Sprite(inverse, premultiplied[y1:y2, x1:x2].copy(), (offset[0] + int(x1), offset[1] + int(y1)))
+
+
+def render_layer(shape, draw):
+    """
+    Executa draw(canvas) uma vez e devolve os Sprites do que foi desenhado,
+    um por faixa de linhas ocupadas (o espaço vazio entre elementos do HUD
+    não entra na composição). O alfa vem de desenhar sobre fundo preto e
+    sobre fundo branco: a diferença entre as duas telas é a transparência de
+    cada pixel (inclusive nas bordas suavizadas do texto) e a tela preta já
+    é a cor pré-multiplicada.
+    """
+    black = np.zeros(shape[:2] + (3,), dtype=np.uint8)
+    white = np.full_like(black, 255)
+    draw(black)
+    draw(white)
+    alpha = (255 - (white - black).max(axis=2)).astype(np.uint8)
+    rows = alpha.any(axis=1)
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], rows, [False])).astype(np.int8)))
+    return [crop_sprite(alpha[y1:y2], black[y1:y2], (0, int(y1))) for y1, y2 in edges.reshape(-1, 2)]
+
+
+def render_text(text, scale, color, thickness=1):
+    """Sprite de um texto; a âncora é a mesma origem (canto inferior esquerdo) do cv2.putText"""
+    (width, height), baseline = cv2.getTextSize(text, FONT, scale, thickness)
+    pad = thickness + 1
+    alpha = np.zeros((height + baseline + 2 * pad, width + 2 * pad), dtype=np.uint8)
+    cv2.putText(alpha, text, (pad, height + pad), FONT, scale, 255, thickness)
+    premultiplied = cv2.multiply(cv2.merge([alpha] * 3), np.full(alpha.shape + (3,), color, dtype=np.uint8),
+                                 scale=1 / 255)
+    return crop_sprite(alpha, premultiplied, (-pad, -height - pad))
+
+
+class Overlay:
+    """
+    Renderizador de HUD com cache.
+
+    Camadas estáticas (título, rótulos fixos, fundo e borda da barra) são
+    desenhadas uma vez por chave e tamanho de frame; textos dinâmicos viram
+    sprites guardados em um cache LRU e só são renderizados de novo quando
+    o texto muda. A cada frame resta apenas a composição alfa das regiões
+    cobertas, sem chamadas a cv2.putText.
+    """
+
+    def __init__(self, max_texts=1024):
+        self.max_texts = max_texts
+        self.texts = OrderedDict()
+        self.layers = {}
+
+    def text(self, frame, text, org, scale, color, thickness=1):
+        """Equivalente a cv2.putText(frame, text, org, FONT, scale, color, thickness)"""
+        key = (text, scale, tuple(color), thickness)
+        sprite = self.texts.get(key)
+        if sprite is None:
+            sprite = self.texts[key] = render_text(text, scale, color, thickness)
+            if len(self.texts) > self.max_texts:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(key)
+        sprite.blend(frame, org)
+
+    def layer(self, frame, key, draw):
+        """Aplica a camada estática key (desenhada por draw(canvas) só na primeira vez)"""
+        cache_key = (key, frame.shape[:2])
+        sprites = self.layers.get(cache_key)
+        if sprites is None:
+            sprites = self.layers[cache_key] = render_layer(frame.shape, draw)
+        for sprite in sprites:
+            sprite.blend(frame)
+
+
+def draw_bar_background(canvas, x, y, width, height, border=1):
+    """Fundo e borda de uma barra de progresso (parte estática do HUD)"""
+    cv2.rectangle(canvas, (x, y), (x + width, y + height), (100, 100, 100), -1)
+    cv2.rectangle(canvas, (x, y), (x + width, y + height), (255, 255, 255), border)
+
+
+def fill_bar(frame, x, y, width, height, fraction, color, border=1):
+    """
+    Preenchimento da barra só no interior da borda: o resultado é o mesmo de
+    desenhar fundo, preenchimento e borda nessa ordem, mas fundo e borda
+    podem vir juntos de uma única camada estática.
+    """
+    fill_width = int(fraction * width)
+    right = min(fill_width, width - border)
+    if fill_width > 0 and right >= border:
+        cv2.rectangle(frame, (x + border, y + border), (x + right, y + height - border), color, -1)
+
+
+def window_visible(name):
+    """False quando a janela foi fechada pelo usuário (não vale a pena desenhar)"""
+    try:
+        return cv2.getWindowProperty(name, cv2.WND_PROP_VISIBLE) >= 1
+    except cv2.error:
+        return False
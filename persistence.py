@@ -0,0 +1,302 @@
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+
+DB_FILE = "construction_monitor.db"
+SCHEMA_VERSION = 2
+
+# Tabelas particionadas por mês: detections_202509, compliance_202509, ...
+# Os nomes base (detections, compliance) são views UNION ALL das partições.
+PARTITION_COLUMNS = {
+    "detections": """
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                camera_id INTEGER NOT NULL DEFAULT 0,
+                class_name TEXT,
+                confidence REAL,
+                position_x REAL,
+                position_y REAL,
+                deviation REAL,
+                alert_level INTEGER NOT NULL DEFAULT 0,
+                frame_id INTEGER REFERENCES frames(id)""",
+    "compliance": """
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                camera_id INTEGER NOT NULL DEFAULT 0,
+                compliance_percentage REAL,
+                total_detections INTEGER,
+                total_alerts INTEGER""",
+}
+PARTITION_INDEXES = {
+    "detections": [
+        "CREATE INDEX IF NOT EXISTS {table}_camera_ts ON {table} (camera_id, ts)",
+        "CREATE INDEX IF NOT EXISTS {table}_class ON {table} (class_name)",
+        "CREATE INDEX IF NOT EXISTS {table}_alerts ON {table} (camera_id, ts) WHERE alert_level > 0",
+    ],
+    "compliance": [
+        "CREATE INDEX IF NOT EXISTS {table}_camera_ts ON {table} (camera_id, ts)",
+    ],
+}
+INSERT_COLUMNS = {
+    "detections": ("ts", "camera_id", "class_name", "confidence", "position_x", "position_y",
+                   "deviation", "alert_level", "frame_id"),
+    "compliance": ("ts", "camera_id", "compliance_percentage", "total_detections", "total_alerts"),
+}
+
+# Conteúdo dos frames fica fora das linhas de detecção (referenciado por frame_id)
+FRAMES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                camera_id INTEGER NOT NULL DEFAULT 0,
+                sha256 TEXT,
+                path TEXT,
+                data BLOB
+            );
+CREATE INDEX IF NOT EXISTS frames_camera_ts ON frames (camera_id, ts);
+"""
+
+
+def epoch_ms(value=None):
+    """Converte datetime/texto ISO (ou agora) para milissegundos desde a época"""
+    if value is None:
+        return int(time.time() * 1000)
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
+
+
+def partition_suffix(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000).strftime("%Y%m")
+
+
+def list_partitions(conn, base):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                        (f"{base}_[0-9][0-9][0-9][0-9][0-9][0-9]",)).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def refresh_view(conn, base):
+    """Recria a view base como UNION ALL de todas as partições"""
+    partitions = list_partitions(conn, base)
+    conn.execute(f"DROP VIEW IF EXISTS {base}")
+    if partitions:
+        columns = ", ".join(("id",) + INSERT_COLUMNS[base])
+        union = " UNION ALL ".join(f"SELECT {columns} FROM {table}" for table in partitions)
+        conn.execute(f"CREATE VIEW {base} AS {union}")
+
+
+def ensure_partition(conn, base, suffix):
+    """Cria a partição (tabela + índices) se ainda não existir"""
+    table = f"{base}_{suffix}"
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not exists:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({PARTITION_COLUMNS[base]}\n            )")
+        for statement in PARTITION_INDEXES[base]:
+            conn.execute(statement.format(table=table))
+        refresh_view(conn, base)
+    return table
+
+
+def insert_rows(conn, base, rows):
+    """Insere linhas (ts na primeira coluna) agrupadas por partição com executemany"""
+    by_partition = {}
+    for row in rows:
+        by_partition.setdefault(partition_suffix(row[0]), []).append(row)
+    columns = INSERT_COLUMNS[base]
+    placeholders = ", ".join("?" for _ in columns)
+    for suffix, partition_rows in by_partition.items():
+        table = ensure_partition(conn, base, suffix)
+        conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", partition_rows)
+
+
+def _decode_real(value):
+    """Colunas da v1 gravaram float32 empacotado (4 bytes) em vez de REAL"""
+    if isinstance(value, bytes):
+        if len(value) == 4:
+            return struct.unpack("<f", value)[0]
+        if len(value) == 8:
+            return struct.unpack("<d", value)[0]
+        return None
+    return value
+
+
+def migrate_v1(conn):
+    """
+    Migra o esquema v1 (detections/compliance sem tipos, timestamp em texto
+    e frame_data na linha) para as partições v2.
+    """
+    migrated = 0
+    conn.execute("ALTER TABLE detections RENAME TO detections_v1")
+    conn.execute("ALTER TABLE compliance RENAME TO compliance_v1")
+
+    detection_rows = []
+    for timestamp, class_name, confidence, x, y, deviation, alert_level, frame_data in conn.execute(
+            "SELECT timestamp, class_name, confidence, position_x, position_y, deviation, "
+            "alert_level, frame_data FROM detections_v1 ORDER BY id"):
+        ts = epoch_ms(timestamp)
+        frame_id = None
+        if frame_data is not None:
+            frame_id = conn.execute("INSERT INTO frames (ts, camera_id, data) VALUES (?, 0, ?)",
+                                    (ts, frame_data)).lastrowid
+        detection_rows.append((ts, 0, class_name, _decode_real(confidence), _decode_real(x), _decode_real(y),
+                               _decode_real(deviation), int(alert_level or 0), frame_id))
+    insert_rows(conn, "detections", detection_rows)
+    migrated += len(detection_rows)
+
+    compliance_rows = [(epoch_ms(timestamp), 0, _decode_real(percentage), total_detections, total_alerts)
+                       for timestamp, percentage, total_detections, total_alerts in conn.execute(
+                           "SELECT timestamp, compliance_percentage, total_detections, total_alerts "
+                           "FROM compliance_v1 ORDER BY id")]
+    insert_rows(conn, "compliance", compliance_rows)
+    migrated += len(compliance_rows)
+
+    conn.execute("DROP TABLE detections_v1")
+    conn.execute("DROP TABLE compliance_v1")
+    return migrated
+
+
+def ensure_schema(conn):
+    """Cria o esquema v2 e migra bancos v1 existentes (uma transação)"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    migrated = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in FRAMES_SCHEMA.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+        legacy = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detections'").fetchone()
+        if legacy:
+            migrated = migrate_v1(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if migrated is not None:
+        conn.execute("VACUUM")
+        print(f"Banco de dados migrado para o esquema v{SCHEMA_VERSION}: {migrated} linhas")
+
+
+def connect(db_path=DB_FILE):
+    """Abre o banco em modo WAL (leitores não bloqueiam o gravador)"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(conn)
+    return conn
+
+
+def query_alerts(conn, camera_id, since_ms, until_ms=None):
+    """
+    Alertas de uma câmera em um intervalo, consultando só as partições do
+    período e usando o índice parcial (camera_id, ts) WHERE alert_level > 0.
+    """
+    until_ms = until_ms if until_ms is not None else epoch_ms()
+    first, last = partition_suffix(since_ms), partition_suffix(until_ms)
+    tables = [table for table in list_partitions(conn, "detections")
+              if first <= table.rsplit("_", 1)[1] <= last]
+    rows = []
+    for table in tables:
+        rows.extend(conn.execute(
+            f"SELECT ts, camera_id, class_name, confidence, position_x, position_y, deviation, alert_level "
+            f"FROM {table} WHERE camera_id = ? AND ts >= ? AND ts < ? AND alert_level > 0 ORDER BY ts",
+            (camera_id, since_ms, until_ms)).fetchall())
+    return rows
+
+
+class DetectionWriter:
+    """
+    Gravador assíncrono de detecções e conformidade no construction_monitor.db.
+
+    log_frame só acrescenta linhas em buffers na memória; uma thread em
+    segundo plano grava tudo com executemany em uma única transação a
+    cada flush_interval segundos. Se o banco não acompanhar, as linhas
+    mais antigas de cada buffer são descartadas (max_buffer) em vez de
+    travar a inferência.
+    """
+
+    def __init__(self, db_path=DB_FILE, flush_interval=1.0, max_buffer=100000):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.detection_rows = []
+        self.compliance_rows = []
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def log_frame(self, detections, compliance, alerts=None, timestamp=None, camera_id=0, frame_id=None):
+        """Enfileira as detecções e a conformidade de um frame (não bloqueia)"""
+        ts = epoch_ms(timestamp)
+        rows = []
+        for det in detections:
+            x, y = det["position"]
+            rows.append((ts, camera_id, det["class"], float(det["confidence"]), float(x), float(y),
+                         det.get("deviation"), 1 if det.get("alert") else 0, frame_id))
+        if alerts is None:
+            alerts = sum(1 for det in detections if det.get("alert"))
+
+        with self.lock:
+            self.detection_rows.extend(rows)
+            self.compliance_rows.append((ts, camera_id, float(compliance), len(detections), alerts))
+            # Banco atrasado: cada buffer guarda só as max_buffer linhas mais recentes
+            for buffer in (self.detection_rows, self.compliance_rows):
+                overflow = len(buffer) - self.max_buffer
+                if overflow > 0:
+                    del buffer[:overflow]
+                    self.dropped_rows += overflow
+
+    def flush(self, conn):
+        """Grava os buffers pendentes em uma transação"""
+        with self.lock:
+            detection_rows, self.detection_rows = self.detection_rows, []
+            compliance_rows, self.compliance_rows = self.compliance_rows, []
+        if not detection_rows and not compliance_rows:
+            return
+        with conn:
+            insert_rows(conn, "detections", detection_rows)
+            insert_rows(conn, "compliance", compliance_rows)
+        self.written_rows += len(detection_rows) + len(compliance_rows)
+
+    def _flush_loop(self):
+        conn = connect(self.db_path)
+        try:
+            while not self.stop_event.wait(self.flush_interval):
+                try:
+                    self.flush(conn)
+                except sqlite3.Error as e:
+                    print(f"Erro ao gravar no banco de dados: {e}")
+            self.flush(conn)
+        finally:
+            conn.close()
+
+    def close(self):
+        """Grava o que falta e encerra a thread"""
+        self.stop_event.set()
+        self.thread.join()
+        if self.dropped_rows:
+            print(f"Aviso: {self.dropped_rows} linhas de detecção e conformidade descartadas "
+                  f"(banco de dados lento)")
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Migra (se necessário) e mostra um resumo do banco
+    conn = connect(sys.argv[1] if len(sys.argv) > 1 else DB_FILE)
+    for base in PARTITION_COLUMNS:
+        partitions = list_partitions(conn, base)
+        total = conn.execute(f"SELECT COUNT(*) FROM {base}").fetchone()[0] if partitions else 0
+        print(f"{base}: {total} linhas em {len(partitions)} partições")
+    conn.close()
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from profiling import LatencyHistogram
+
+
+class DropOldestQueue:
+    """Fila limitada que descarta o item mais antigo quando está cheia"""
+
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        """Insere um item, descartando o mais antigo se necessário"""
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Retorna o próximo item ou None se o tempo esgotar"""
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+
+class StageStats:
+    """Acumula latência de um estágio do pipeline (histograma com p50/p95/p99)"""
+
+    def __init__(self, name, unit="frames"):
+        self.name = name
+        self.unit = unit
+        self.histogram = LatencyHistogram()
+
+    def add(self, elapsed):
+        self.histogram.add(elapsed)
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    @property
+    def max_time(self):
+        return self.histogram.max
+
+    @property
+    def last_time(self):
+        return self.histogram.last
+
+    @property
+    def mean_ms(self):
+        return self.histogram.mean * 1000
+
+    def percentile_ms(self, q):
+        return self.histogram.percentile(q) * 1000
+
+    def summary(self):
+        return self.histogram.summary(self.name, self.unit)
+
+
+class FramePipeline:
+    """
+    Pipeline em estágios: captura -> inferência -> renderização.
+
+    A captura roda em uma thread e mantém apenas o frame mais recente,
+    a inferência roda em outra thread e a renderização fica na thread
+    principal (exigência do cv2.imshow). Os estágios são ligados por
+    filas limitadas que descartam o item mais antigo.
+    """
+
+    def __init__(self, source, infer_fn, render_fn, capture_queue_size=1, render_queue_size=2):
+        self.source = source
+        self.infer_fn = infer_fn
+        self.render_fn = render_fn
+        self.capture_queue = DropOldestQueue(capture_queue_size)
+        self.render_queue = DropOldestQueue(render_queue_size)
+        self.stop_event = threading.Event()
+        self.capture_done = threading.Event()
+        self.inference_done = threading.Event()
+        self.stats = {
+            "capture": StageStats("Captura"),
+            "inference": StageStats("Inferência"),
+            "render": StageStats("Renderização"),
+        }
+        self.frames_captured = 0
+        self.error = None
+        self.threads = []
+
+    def _capture_loop(self, cap):
+        """Lê frames da câmera na taxa do sensor"""
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                self.error = "Erro ao ler frame da câmera"
+                break
+            self.stats["capture"].add(time.perf_counter() - start)
+            self.capture_queue.put((self.frames_captured, time.time(), frame))
+            self.frames_captured += 1
+        self.capture_done.set()
+
+    def _inference_loop(self):
+        """Executa a inferência no frame mais recente disponível"""
+        while not self.stop_event.is_set():
+            item = self.capture_queue.get(timeout=0.1)
+            if item is None:
+                if self.capture_done.is_set():
+                    break
+                continue
+            frame_index, captured_at, frame = item
+            start = time.perf_counter()
+            try:
+                result = self.infer_fn(frame)
+            except Exception as e:
+                print(f"Erro na detecção YOLO: {e}")
+                continue
+            self.stats["inference"].add(time.perf_counter() - start)
+            self.render_queue.put((frame_index, captured_at, frame, result))
+        self.inference_done.set()
+
+    @property
+    def dropped_frames(self):
+        return self.capture_queue.dropped + self.render_queue.dropped
+
+    def run(self):
+        """Executa o pipeline até render_fn retornar False ou a captura falhar"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            print("Erro: Não foi possível abrir a câmera!")
+            return False
+
+        self.threads = [
+            threading.Thread(target=self._capture_loop, args=(cap,), daemon=True),
+            threading.Thread(target=self._inference_loop, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+        try:
+            while not self.stop_event.is_set():
+                item = self.render_queue.get(timeout=0.1)
+                if item is None:
+                    if self.inference_done.is_set():
+                        break
+                    continue
+                frame_index, captured_at, frame, result = item
+                start = time.perf_counter()
+                keep_running = self.render_fn(frame, result)
+                self.stats["render"].add(time.perf_counter() - start)
+                if keep_running is False:
+                    break
+        finally:
+            self.stop_event.set()
+            for thread in self.threads:
+                thread.join(timeout=2)
+            cap.release()
+
+        if self.error:
+            print(self.error)
+        return True
+
+    def report(self):
+        """Retorna linhas com latência por estágio e frames descartados"""
+        lines = [stats.summary() for stats in self.stats.values()]
+        lines.append(f"Frames capturados: {self.frames_captured} | "
+                     f"Descartados: {self.dropped_frames} "
+                     f"(captura: {self.capture_queue.dropped}, render: {self.render_queue.dropped})")
+        return lines
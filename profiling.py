@@ -0,0 +1,285 @@
+import cProfile
+import io
+import math
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from event_log import log_event
+
+
+class LatencyHistogram:
+    """
+    Histograma de latências em escala logarítmica (1 µs a 100 s, ~2% de
+    resolução): add() é O(1) e os percentis saem da soma acumulada dos
+    bins, sem guardar as amostras.
+    """
+
+    MIN_SECONDS = 1e-6
+    BINS_PER_DECADE = 120
+    DECADES = 8
+
+    def __init__(self):
+        self.counts = np.zeros(self.BINS_PER_DECADE * self.DECADES + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        index = int(math.log10(max(seconds, self.MIN_SECONDS) / self.MIN_SECONDS) * self.BINS_PER_DECADE)
+        with self.lock:
+            self.counts[min(index, len(self.counts) - 1)] += 1
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Percentil q (0-100) em segundos (centro geométrico do bin)"""
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), max(q / 100 * self.count, 1)))
+        return min(self.MIN_SECONDS * 10 ** ((index + 0.5) / self.BINS_PER_DECADE), self.max)
+
+    def summary(self, name, unit="frames"):
+        return (f"{name}: {self.count} {unit}, média {self.mean * 1000:.1f}ms, "
+                f"p50 {self.percentile(50) * 1000:.1f}ms, p95 {self.percentile(95) * 1000:.1f}ms, "
+                f"p99 {self.percentile(99) * 1000:.1f}ms, máx {self.max * 1000:.1f}ms")
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Profiler:
+    """
+    Tempos por estágio (e por câmera) com histogramas p50/p95/p99.
+
+        with profiler.stage("detecção", camera_id):
+            ...
+
+    Cada medição custa duas leituras de perf_counter e um incremento no
+    histograma; com enabled=False os timers são nulos. dump_every > 0 grava
+    um resumo no log de eventos a cada dump_every segundos (maybe_dump).
+    """
+
+    def __init__(self, enabled=True, dump_every=60.0):
+        self.enabled = enabled
+        self.dump_every = dump_every
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.last_dump = time.monotonic()
+
+    def histogram(self, name, camera_id=None):
+        key = (name, camera_id)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def stage(self, name, camera_id=None):
+        """Context manager que mede o bloco no estágio name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self.histogram(name, camera_id))
+
+    def add(self, name, seconds, camera_id=None):
+        if self.enabled:
+            self.histogram(name, camera_id).add(seconds)
+
+    def _label(self, name, camera_id):
+        return name if camera_id is None else f"{name} [câm {camera_id}]"
+
+    def report(self):
+        """Linhas com média, p50, p95, p99 e máximo de cada estágio"""
+        return [histogram.summary(self._label(name, camera_id))
+                for (name, camera_id), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0]))
+                if histogram.count]
+
+    def hud_lines(self, camera_id=None):
+        """Linhas curtas (p50/p95 do estágio) para desenhar no frame"""
+        return [f"{name}: {histogram.percentile(50) * 1000:.1f}/{histogram.percentile(95) * 1000:.1f}ms"
+                for (name, stage_camera), histogram in list(self.histograms.items())
+                if stage_camera == camera_id and histogram.count]
+
+    def maybe_dump(self):
+        """Grava o resumo dos estágios no log de eventos se passou dump_every segundos"""
+        if not self.enabled or self.dump_every <= 0 or time.monotonic() - self.last_dump < self.dump_every:
+            return
+        self.last_dump = time.monotonic()
+        log_event("perfil", stages={
+            self._label(name, camera_id): {"n": histogram.count,
+                                           "p50_ms": round(histogram.percentile(50) * 1000, 2),
+                                           "p95_ms": round(histogram.percentile(95) * 1000, 2),
+                                           "p99_ms": round(histogram.percentile(99) * 1000, 2)}
+            for (name, camera_id), histogram in list(self.histograms.items()) if histogram.count})
+
+
+class SamplingProfiler:
+    """
+    Profiler por amostragem: uma thread de fundo lê a pilha de todas as
+    threads a cada interval segundos (sys._current_frames). Custo quase
+    nulo no código medido; a saída são pilhas no formato "collapsed"
+    (aceito por flamegraph.pl e speedscope) mais as funções mais vistas.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def _loop(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit=15):
+        """Funções no topo da pilha com mais amostras (tempo próprio)"""
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        total = sum(own.values()) or 1
+        return [f"{100 * count / total:5.1f}% {name}" for name, count in own.most_common(limit)]
+
+
+class ProfileSession:
+    """
+    Perfil de N frames, ligado por opção de linha de comando.
+
+    mode="cprofile": cProfile de uma única thread, a que chama frame()
+    (determinístico, com sobrecarga; no bim.py com uma fonte é a thread de
+    inferência, sem captura e desenho); mode="sample": SamplingProfiler de
+    todas as threads, para o pipeline inteiro. frame() é chamado ao fim de
+    cada frame: no primeiro o perfil começa, depois de frames chamadas ele
+    para e grava output (cProfile: .prof do pstats + resumo .txt;
+    amostragem: pilhas collapsed). O cProfile é ligado e desligado na mesma
+    thread: stop() vindo de outra thread, com a dona ainda viva, pede a
+    parada, feita no próximo frame() dela, e espera a gravação por até
+    timeout segundos; sem ela o perfil fica pendente (report() informa).
+    """
+
+    def __init__(self, mode="cprofile", frames=300, output=None):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"Modo de perfil desconhecido: {mode}")
+        self.mode = mode
+        self.frames = frames
+        self.output = output or ("profile.prof" if mode == "cprofile" else "profile_stacks.txt")
+        self.counted = 0
+        self.profiler = None
+        self.owner = None
+        self.stop_requested = False
+        self.finished = False
+        self.written = threading.Event()
+
+    def frame(self):
+        if self.finished:
+            return
+        if self.profiler is None:
+            if self.mode == "cprofile":
+                self.profiler = cProfile.Profile()
+                self.owner = threading.current_thread()
+                self.profiler.enable()
+            else:
+                self.profiler = SamplingProfiler()
+                self.profiler.start()
+            return
+        self.counted += 1
+        if self.counted >= self.frames or self.stop_requested:
+            self.stop()
+
+    def stop(self, timeout=2.0):
+        """Encerra o perfil (também chamado no fim do programa) e grava a saída; True se gravado"""
+        if self.finished or self.profiler is None:
+            return self.written.is_set()
+        if self.owner not in (None, threading.current_thread()) and self.owner.is_alive():
+            self.stop_requested = True
+            return self.written.wait(timeout)
+        self.finished = True
+        if self.mode == "cprofile":
+            self.profiler.disable()
+            self.profiler.dump_stats(self.output)
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(40)
+            with open(self.output.rsplit(".", 1)[0] + ".txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+        else:
+            self.profiler.stop()
+            self.profiler.write(self.output)
+        self.written.set()
+        log_event("perfil_gravado", mode=self.mode, frames=self.counted, output=self.output)
+        return True
+
+    def report(self):
+        if self.profiler is None:
+            return "Perfil: nenhum frame medido"
+        if not self.written.is_set():
+            return (f"Perfil ({self.mode}, {self.counted} frames) pendente: {self.output} ainda não foi gravado "
+                    f"(a thread perfilada não voltou a chamar frame())")
+        lines = [f"Perfil ({self.mode}, {self.counted} frames) gravado em {self.output}"]
+        if self.mode == "sample":
+            lines += [f"  {line}" for line in self.profiler.top(10)]
+        return "\n".join(lines)
@@ -0,0 +1,152 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+SAMPLE_DIR = "training_samples"
+
+# Uma linha por amostra; as detecções da amostra são detection_count linhas a partir de first_detection
+SAMPLE_DTYPE = np.dtype([("timestamp", "f8"), ("compliance", "f4"),
+                         ("first_detection", "i8"), ("detection_count", "i4")])
+SAMPLE_DETECTION_DTYPE = np.dtype([("sample", "i8"), ("cls", "i4"), ("conf", "f4"), ("x", "f4"), ("y", "f4")])
+
+
+class SampleStore:
+    """
+    Armazenamento colunar, só de acréscimo, das amostras de treinamento.
+
+    As amostras capturadas ficam num buffer pequeno e vão para o disco em
+    blocos (chunk_size amostras ou flush_interval segundos, o que vier
+    primeiro): cada bloco é um diretório com samples.npy e detections.npy,
+    gravado uma única vez com troca atômica e nunca reescrito. Os nomes de
+    classe ficam em classes.json (código = posição na lista). A leitura usa
+    mmap bloco a bloco, então a memória não cresce com a duração da coleta
+    e salvar custa O(amostras novas).
+    """
+
+    def __init__(self, directory=SAMPLE_DIR, chunk_size=256, flush_interval=30.0):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.classes = self._read_classes()
+        self.codes = {name: code for code, name in enumerate(self.classes)}
+        self.chunks = self._scan_chunks()
+        self.stored_samples = 0
+        self.stored_detections = 0
+        for chunk in self.chunks:
+            samples, detections = self._load_chunk(chunk)
+            self.stored_samples += len(samples)
+            self.stored_detections += len(detections)
+        self.pending_samples = []
+        self.pending_detections = []
+        self.last_flush = time.monotonic()
+
+    def _read_classes(self):
+        try:
+            with open(os.path.join(self.directory, "classes.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _write_classes(self):
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.classes, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, "classes.json"))
+
+    def _scan_chunks(self):
+        chunks = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".tmp_"):
+                # Bloco interrompido no meio da gravação
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+            elif name.startswith("chunk_") and os.path.isdir(path):
+                chunks.append(path)
+        return chunks
+
+    @staticmethod
+    def _load_chunk(chunk):
+        return (np.load(os.path.join(chunk, "samples.npy"), mmap_mode="r"),
+                np.load(os.path.join(chunk, "detections.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return self.stored_samples + len(self.pending_samples)
+
+    def class_code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.classes)
+            self.classes.append(name)
+        return code
+
+    def append(self, compliance, detections, timestamp=None):
+        """
+        Acrescenta uma amostra. detections: dicionários com 'class',
+        'confidence' e 'position' (x, y), como os montados pelo trainer.
+        """
+        sample = len(self)
+        first = self.stored_detections + len(self.pending_detections)
+        for info in detections:
+            x, y = info["position"]
+            self.pending_detections.append((sample, self.class_code(info["class"]), info["confidence"], x, y))
+        self.pending_samples.append((time.time() if timestamp is None else timestamp, compliance,
+                                     first, len(detections)))
+        if (len(self.pending_samples) >= self.chunk_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Grava as amostras pendentes como um novo bloco"""
+        self.last_flush = time.monotonic()
+        if not self.pending_samples:
+            return
+        samples = np.array(self.pending_samples, dtype=SAMPLE_DTYPE)
+        detections = np.array(self.pending_detections, dtype=SAMPLE_DETECTION_DTYPE)
+        # classes.json antes do bloco: todo código gravado já tem nome
+        self._write_classes()
+
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=self.directory)
+        np.save(os.path.join(tmp_dir, "samples.npy"), samples)
+        np.save(os.path.join(tmp_dir, "detections.npy"), detections)
+        target = os.path.join(self.directory, f"chunk_{self.stored_samples:010d}")
+        os.replace(tmp_dir, target)
+
+        self.chunks.append(target)
+        self.stored_samples += len(samples)
+        self.stored_detections += len(detections)
+        self.pending_samples = []
+        self.pending_detections = []
+
+    def close(self):
+        self.flush()
+
+    def iter_chunks(self):
+        """(amostras, detecções) de cada bloco gravado, com mmap (somente leitura)"""
+        for chunk in self.chunks:
+            yield self._load_chunk(chunk)
+
+    def summary(self):
+        """Estatísticas de conformidade de todas as amostras, lidas bloco a bloco"""
+        self.flush()
+        count, total, low, high, detections = 0, 0.0, math.inf, -math.inf, 0
+        for samples, chunk_detections in self.iter_chunks():
+            if not len(samples):
+                continue
+            compliance = samples["compliance"]
+            count += len(samples)
+            total += float(compliance.sum(dtype=np.float64))
+            low = min(low, float(compliance.min()))
+            high = max(high, float(compliance.max()))
+            detections += len(chunk_detections)
+        return {"count": count, "mean": total / count if count else 0.0,
+                "min": low if count else 0.0, "max": high if count else 0.0,
+                "detections": detections, "chunks": len(self.chunks)}
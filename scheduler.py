@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from event_log import log_event
+
+# Configuração do detector em um nível do escalonador (stride = infere 1 a cada N frames do stream)
+Level = namedtuple("Level", ("imgsz", "stride", "batch", "conf"))
+
+
+def default_levels(imgsz=640, batch=8, conf=0.5):
+    """
+    Níveis do melhor para o mais leve: entrada reduzida para 80%, 65% e 50%
+    (múltiplos de 32), pulando frames e com lotes menores nos dois últimos.
+    """
+    small_batch = max(1, batch // 2)
+    return [Level(max(160, int(imgsz * scale) // 32 * 32), stride, level_batch, conf)
+            for scale, stride, level_batch in ((1.0, 1, batch), (0.8, 1, batch), (0.65, 2, small_batch),
+                                               (0.5, 3, small_batch))]
+
+
+def parse_levels(levels, imgsz=640, batch=8, conf=0.5):
+    """Níveis do detector.json ("levels": lista de {imgsz, stride, batch, conf}); faltantes usam os padrões"""
+    if not levels:
+        return default_levels(imgsz, batch, conf)
+    return [Level(level.get("imgsz", imgsz), level.get("stride", 1), level.get("batch", batch),
+                  level.get("conf", conf)) for level in levels]
+
+
+def detector_levels(config, batch=8, conf=0.5):
+    """Níveis para a configuração do detector; artefatos exportados com forma fixa mantêm o imgsz exportado"""
+    levels = parse_levels(config.get("levels"), config["imgsz"], batch, conf)
+    if config["backend"] != "pytorch" and not config["dynamic"]:
+        levels = [level._replace(imgsz=config["imgsz"]) for level in levels]
+    return levels
+
+
+class LatencyScheduler:
+    """
+    Controlador da configuração do detector a partir da latência medida.
+
+    observe() recebe a latência de cada inferência; com a janela cheia, o
+    p95 acima do orçamento desce um nível (entrada menor, mais frames
+    pulados, lote menor) e abaixo de recover_below do orçamento sobe um.
+    A histerese vem da faixa entre os dois limiares, da janela esvaziada a
+    cada troca e de min_dwell segundos mínimos em cada nível. alert()
+    volta a entrada para a resolução do primeiro nível por alert_hold
+    segundos; se com o reforço o p95 passa do orçamento, ele é cancelado e
+    bloqueado por alert_hold segundos, então alertas contínuos não impedem
+    a degradação sob carga. Um escalonador por stream (camera_id nos
+    eventos). Toda troca vai para o log de eventos como WARNING, então
+    nunca é descartada pela amostragem.
+    """
+
+    def __init__(self, budget_ms, levels=None, window=30, recover_below=0.6, min_dwell=3.0, alert_hold=10.0,
+                 camera_id=None):
+        self.levels = list(levels or default_levels())
+        self.budget = budget_ms / 1000
+        self.recover_below = recover_below
+        self.min_dwell = min_dwell
+        self.alert_hold = alert_hold
+        self.camera_id = camera_id
+        self.samples = deque(maxlen=window)
+        self.index = 0
+        self.changed_at = time.monotonic()
+        self.boost_until = 0.0
+        self.boost_blocked_until = 0.0
+        self.boosted = False
+        self.changes = 0
+        self.frames = [0] * len(self.levels)
+        self.lock = threading.Lock()
+
+    @property
+    def level(self):
+        """Nível em uso (com o reforço de resolução, se houver alerta ativo)"""
+        with self.lock:
+            if self.boosted and time.monotonic() >= self.boost_until:
+                self.boosted = False
+                self.samples.clear()
+                self._log("reforço encerrado")
+            level = self.levels[self.index]
+            if self.boosted:
+                level = level._replace(imgsz=self.levels[0].imgsz)
+            return level
+
+    def observe(self, seconds):
+        """Latência de uma inferência (segundos); pode trocar de nível"""
+        with self.lock:
+            self.frames[self.index] += 1
+            self.samples.append(seconds)
+            if len(self.samples) < self.samples.maxlen:
+                return
+            now = time.monotonic()
+            p95 = float(np.percentile(self.samples, 95))
+            if self.boosted:
+                if p95 > self.budget:
+                    # O reforço não cabe no orçamento: a carga tem prioridade sobre o alerta
+                    self.boosted = False
+                    self.boost_blocked_until = now + self.alert_hold
+                    self.samples.clear()
+                    self._log("reforço cancelado", p95_ms=round(p95 * 1000, 1))
+                return
+            if now - self.changed_at < self.min_dwell:
+                return
+            if p95 > self.budget and self.index < len(self.levels) - 1:
+                self._move(1, p95, "acima do orçamento")
+            elif p95 < self.budget * self.recover_below and self.index > 0:
+                self._move(-1, p95, "folga no orçamento")
+
+    def _move(self, step, p95, reason):
+        self.index += step
+        self.samples.clear()
+        self.changed_at = time.monotonic()
+        self.changes += 1
+        self._log(reason, p95_ms=round(p95 * 1000, 1))
+
+    def _log(self, reason, **fields):
+        level = self.levels[self.index]
+        log_event("escalonamento", logging.WARNING, camera_id=self.camera_id, reason=reason, level_index=self.index,
+                  imgsz=self.levels[0].imgsz if self.boosted else level.imgsz, stride=level.stride,
+                  batch=level.batch, conf=level.conf, budget_ms=round(self.budget * 1000, 1), **fields)
+
+    def alert(self):
+        """Alerta ativo: resolução máxima pelos próximos alert_hold segundos"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.boost_blocked_until:
+                return
+            self.boost_until = now + self.alert_hold
+            if not self.boosted and self.levels[self.index].imgsz != self.levels[0].imgsz:
+                self.boosted = True
+                self.samples.clear()
+                self._log("alerta ativo")
+
+    def report(self):
+        total = sum(self.frames) or 1
+        usage = ", ".join(f"{level.imgsz}px/{level.stride}x {100 * frames / total:.0f}%"
+                          for level, frames in zip(self.levels, self.frames))
+        return (f"Escalonador ({self.budget * 1000:.0f}ms): {self.changes} trocas de nível, "
+                f"nível atual {self.index} | uso: {usage}")
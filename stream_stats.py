@@ -0,0 +1,251 @@
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from bim_index import ELEMENT_CLASSES
+from ontology import default_ontology
+
+
+class RunningStats:
+    """Acumuladores exatos de uma sessão inteira: contagem, soma, mínimo e máximo"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class _Extremes:
+    """Mínimo e máximo de uma janela deslizante com filas monotônicas (O(1) amortizado)"""
+
+    def __init__(self):
+        self.lows = deque()
+        self.highs = deque()
+
+    def push(self, key, value):
+        while self.lows and self.lows[-1][1] >= value:
+            self.lows.pop()
+        self.lows.append((key, value))
+        while self.highs and self.highs[-1][1] <= value:
+            self.highs.pop()
+        self.highs.append((key, value))
+
+    def expire(self, oldest_key):
+        """Descarta entradas com chave anterior a oldest_key"""
+        while self.lows and self.lows[0][0] < oldest_key:
+            self.lows.popleft()
+        while self.highs and self.highs[0][0] < oldest_key:
+            self.highs.popleft()
+
+    @property
+    def min(self):
+        return self.lows[0][1] if self.lows else 0.0
+
+    @property
+    def max(self):
+        return self.highs[0][1] if self.highs else 0.0
+
+
+class FrameWindow:
+    """Janela dos últimos size valores em um buffer circular NumPy"""
+
+    def __init__(self, size):
+        self.size = size
+        self.label = f"{size}f"
+        self.values = np.zeros(size)
+        self.added = 0
+        self.total = 0.0
+        self.extremes = _Extremes()
+
+    def add(self, value, timestamp=None):
+        slot = self.added % self.size
+        if self.added >= self.size:
+            self.total -= self.values[slot]
+        self.values[slot] = value
+        self.total += value
+        self.added += 1
+        self.extremes.push(self.added, value)
+        self.extremes.expire(self.added - self.size + 1)
+        if slot == self.size - 1:
+            # Soma recalculada a cada volta do buffer: sem erro acumulado de ponto flutuante
+            self.total = math.fsum(self.values)
+
+    def __len__(self):
+        return min(self.added, self.size)
+
+    @property
+    def mean(self):
+        return self.total / len(self) if len(self) else 0.0
+
+    @property
+    def min(self):
+        return self.extremes.min
+
+    @property
+    def max(self):
+        return self.extremes.max
+
+    def percentile(self, q):
+        return float(np.percentile(self.values[:len(self)], q)) if len(self) else 0.0
+
+
+class TimeWindow:
+    """Janela dos valores dos últimos seconds segundos"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.label = f"{seconds / 3600:g}h" if seconds >= 3600 else (
+            f"{seconds / 60:g}min" if seconds >= 60 else f"{seconds:g}s")
+        self.items = deque()
+        self.total = 0.0
+        self.extremes = _Extremes()
+        self.sequence = 0
+
+    def add(self, value, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self.items.append((timestamp, value))
+        self.total += value
+        self.sequence += 1
+        self.extremes.push((timestamp, self.sequence), value)
+        self._expire(timestamp)
+        if self.sequence % 4096 == 0:
+            self.total = math.fsum(value for _, value in self.items)
+
+    def _expire(self, now):
+        oldest = now - self.seconds
+        while self.items and self.items[0][0] <= oldest:
+            self.total -= self.items.popleft()[1]
+        self.extremes.expire((oldest, math.inf))
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def mean(self):
+        return self.total / len(self.items) if self.items else 0.0
+
+    @property
+    def min(self):
+        return self.extremes.min
+
+    @property
+    def max(self):
+        return self.extremes.max
+
+    def percentile(self, q):
+        if not self.items:
+            return 0.0
+        return float(np.percentile(np.fromiter((value for _, value in self.items), dtype=np.float64,
+                                               count=len(self.items)), q))
+
+
+class StreamStats:
+    """
+    Estatísticas de uma série (ex.: conformidade por frame): janelas
+    deslizantes por quantidade de frames e por tempo, com média, mínimo,
+    máximo e percentis, mais os acumuladores exatos da sessão inteira e
+    um histograma (0-100, passo de 0,5) para percentis da sessão.
+    Cada add() custa O(1) amortizado, independente do tamanho das janelas.
+    """
+
+    def __init__(self, frame_windows=(30,), time_windows=(60, 3600), bins=200, value_range=(0.0, 100.0)):
+        self.windows = {}
+        for window in [FrameWindow(size) for size in frame_windows] + [TimeWindow(s) for s in time_windows]:
+            self.windows[window.label] = window
+        self.session = RunningStats()
+        self.value_range = value_range
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def add(self, value, timestamp=None):
+        value = float(value)
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        for window in self.windows.values():
+            window.add(value, timestamp)
+        self.session.add(value)
+        low, high = self.value_range
+        bin_index = int((value - low) / (high - low) * len(self.histogram))
+        self.histogram[min(max(bin_index, 0), len(self.histogram) - 1)] += 1
+
+    def session_percentile(self, q):
+        """Percentil aproximado (resolução do histograma) de toda a sessão"""
+        if not self.session.count:
+            return 0.0
+        target = q / 100 * self.session.count
+        bin_index = int(np.searchsorted(np.cumsum(self.histogram), max(target, 1)))
+        low, high = self.value_range
+        return low + (bin_index + 0.5) * (high - low) / len(self.histogram)
+
+    def summary(self):
+        lines = [f"Sessão: {self.session.count} frames, média {self.session.mean:.1f}%, "
+                 f"mín {self.session.min if self.session.count else 0:.1f}%, "
+                 f"máx {self.session.max if self.session.count else 0:.1f}%, "
+                 f"p50 {self.session_percentile(50):.1f}%, p95 {self.session_percentile(95):.1f}%"]
+        for label, window in self.windows.items():
+            if len(window):
+                lines.append(f"Últimos {label}: média {window.mean:.1f}%, mín {window.min:.1f}%, "
+                             f"máx {window.max:.1f}%, p50 {window.percentile(50):.1f}%")
+        return lines
+
+
+class ComplianceStats:
+    """
+    Estatísticas de conformidade de todas as câmeras: série geral, uma
+    série por câmera e, por classe de elemento BIM, detecções, alertas e
+    desvio médio. Custo constante por frame (e por detecção).
+    """
+
+    def __init__(self, frame_windows=(30,), time_windows=(60, 3600)):
+        self.frame_windows = frame_windows
+        self.time_windows = time_windows
+        self.overall = StreamStats(frame_windows, time_windows)
+        self.cameras = {}
+        self.classes = {}
+
+    def camera(self, camera_id):
+        stats = self.cameras.get(camera_id)
+        if stats is None:
+            stats = self.cameras[camera_id] = StreamStats(self.frame_windows, self.time_windows)
+        return stats
+
+    def update(self, analysis, camera_id=0, timestamp=None):
+        """Acrescenta a análise de um frame (dicionário de bim.analyze_*)"""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self.overall.add(analysis["compliance"], timestamp)
+        self.camera(camera_id).add(analysis["compliance"], timestamp)
+        for info in analysis["detections"]:
+            element_class = default_ontology().classify_name(info["class"])
+            name = ELEMENT_CLASSES[element_class] if element_class >= 0 else "outros"
+            stats = self.classes.get(name)
+            if stats is None:
+                stats = self.classes[name] = {"detections": 0, "alerts": 0, "deviation": RunningStats()}
+            stats["detections"] += 1
+            if info.get("alert"):
+                stats["alerts"] += 1
+            if info.get("deviation") is not None:
+                stats["deviation"].add(info["deviation"])
+
+    def report(self):
+        lines = self.overall.summary()
+        if len(self.cameras) > 1:
+            for camera_id, stats in sorted(self.cameras.items()):
+                lines.append(f"Câmera {camera_id}: {stats.summary()[0]}")
+        for name, stats in sorted(self.classes.items()):
+            deviation = stats["deviation"]
+            lines.append(f"Classe {name}: {stats['detections']} detecções, {stats['alerts']} alertas"
+                         + (f", desvio médio {deviation.mean:.2f}" if deviation.count else ""))
+        return lines
@@ -0,0 +1,222 @@
+import numpy as np
+
+from compliance import greedy_assignment, linear_sum_assignment, optimal_assignment
+
+# Filtro de Kalman de velocidade constante do SORT: estado [cx, cy, área, proporção, vx, vy, v_área]
+_F = np.eye(7)
+_F[0, 4] = _F[1, 5] = _F[2, 6] = 1.0
+_Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+_R = np.diag([1.0, 1.0, 10.0, 10.0])
+_P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU de todas as caixas (x1, y1, x2, y2) de A contra todas de B"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)[None, :, :]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+def boxes_to_state(boxes):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    width = boxes[:, 2] - boxes[:, 0]
+    height = np.maximum(boxes[:, 3] - boxes[:, 1], 1e-6)
+    return np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                            width * height, width / height))
+
+
+def state_to_boxes(state):
+    area = np.maximum(state[:, 2], 0)
+    width = np.sqrt(area * np.maximum(state[:, 3], 0))
+    height = np.divide(area, width, out=np.zeros_like(area), where=width > 0)
+    return np.column_stack((state[:, 0] - width / 2, state[:, 1] - height / 2,
+                            state[:, 0] + width / 2, state[:, 1] + height / 2))
+
+
+class Tracker:
+    """
+    Rastreador multiobjeto no estilo SORT (IoU + Kalman), guardado em arrays.
+
+    predict() avança todos os tracks de uma vez (também nos frames em que o
+    detector não rodou, interpolando as caixas); update(detections) associa
+    as detecções do frame aos tracks previstos pelo IoU, na mesma classe,
+    com a associação um-para-um do motor de conformidade. Cada track guarda
+    também o elemento BIM associado e o desvio acumulado
+    (update_track_compliance).
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=5, min_hits=3):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.next_id = 1
+        self.x = np.empty((0, 7))
+        self.P = np.empty((0, 7, 7))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.cls = np.empty(0, dtype=np.int64)
+        self.conf = np.empty(0, dtype=np.float64)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.missed = np.empty(0, dtype=np.int64)
+        self.updated = np.empty(0, dtype=bool)
+        self.element = np.empty(0, dtype=np.int64)
+        self.deviation = np.empty(0, dtype=np.float64)
+        self.retry = np.empty(0, dtype=np.int64)
+        self.tried_at = np.empty((0, 2), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def boxes(self):
+        return state_to_boxes(self.x)
+
+    @property
+    def confirmed(self):
+        return self.hits >= self.min_hits
+
+    def predict(self):
+        """Avança o filtro de Kalman de todos os tracks (um passo)"""
+        if not len(self):
+            return
+        shrinking = self.x[:, 2] + self.x[:, 6] <= 0
+        self.x[shrinking, 6] = 0.0
+        self.x = self.x @ _F.T
+        self.P = np.einsum("ij,njk,lk->nil", _F, self.P, _F) + _Q
+        self.updated[:] = False
+
+    def update(self, detections):
+        """
+        Associa as detecções (DETECTION_DTYPE) aos tracks, cria tracks para
+        as novas e remove os perdidos. Retorna o índice do track de cada detecção.
+        """
+        boxes = np.asarray(detections["box"], dtype=np.float64).reshape(-1, 4)
+        classes = np.asarray(detections["cls"], dtype=np.int64)
+        det_rows = np.empty(0, dtype=np.int64)
+        track_cols = np.empty(0, dtype=np.int64)
+
+        if len(self) and len(boxes):
+            iou = iou_matrix(boxes, self.boxes)
+            costs = 1.0 - iou
+            costs[(iou < self.iou_threshold) | (classes[:, None] != self.cls[None, :])] = np.inf
+            if linear_sum_assignment is not None:
+                det_rows, track_cols = optimal_assignment(costs)
+            else:
+                det_rows, track_cols = greedy_assignment(costs)
+
+        if len(track_cols):
+            self._correct(track_cols, boxes_to_state(boxes[det_rows]))
+            self.conf[track_cols] = detections["conf"][det_rows]
+            self.hits[track_cols] += 1
+            self.missed[track_cols] = 0
+            self.updated[track_cols] = True
+        unmatched_tracks = np.ones(len(self), dtype=bool)
+        unmatched_tracks[track_cols] = False
+        self.missed[unmatched_tracks] += 1
+
+        track_of = np.full(len(boxes), -1, dtype=np.int64)
+        track_of[det_rows] = track_cols
+        new = np.flatnonzero(track_of < 0)
+        if len(new):
+            track_of[new] = np.arange(len(self), len(self) + len(new))
+            self._create(boxes[new], classes[new], detections["conf"][new])
+
+        alive = self.missed <= self.max_missed
+        if not alive.all():
+            remap = np.cumsum(alive) - 1
+            track_of = np.where(alive[track_of], remap[track_of], -1)
+            self._keep(alive)
+        return track_of
+
+    def _correct(self, rows, measurements):
+        P = self.P[rows]
+        S = P[:, :4, :4] + _R
+        K = P[:, :, :4] @ np.linalg.inv(S)
+        residual = measurements - self.x[rows, :4]
+        self.x[rows] += np.einsum("nij,nj->ni", K, residual)
+        self.P[rows] = P - K @ P[:, :4, :]
+
+    def _create(self, boxes, classes, confidences):
+        count = len(boxes)
+        state = np.zeros((count, 7))
+        state[:, :4] = boxes_to_state(boxes)
+        self.x = np.concatenate((self.x, state))
+        self.P = np.concatenate((self.P, np.repeat(_P0[None], count, axis=0)))
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + count)))
+        self.next_id += count
+        self.cls = np.concatenate((self.cls, classes))
+        self.conf = np.concatenate((self.conf, confidences))
+        self.hits = np.concatenate((self.hits, np.ones(count, dtype=np.int64)))
+        self.missed = np.concatenate((self.missed, np.zeros(count, dtype=np.int64)))
+        self.updated = np.concatenate((self.updated, np.ones(count, dtype=bool)))
+        self.element = np.concatenate((self.element, np.full(count, -1, dtype=np.int64)))
+        self.deviation = np.concatenate((self.deviation, np.full(count, np.nan)))
+        self.retry = np.concatenate((self.retry, np.zeros(count, dtype=np.int64)))
+        self.tried_at = np.concatenate((self.tried_at, np.full((count, 2), np.nan)))
+
+    def _keep(self, mask):
+        for name in ("x", "P", "ids", "cls", "conf", "hits", "missed", "updated", "element", "deviation", "retry",
+                     "tried_at"):
+            setattr(self, name, getattr(self, name)[mask])
+
+
+def update_track_compliance(engine, tracker, points, classes, visible=None, smoothing=0.3, retry_every=15):
+    """
+    Conformidade por elemento rastreado em vez de por frame.
+
+    Cada track confirmado é associado a um elemento BIM uma única vez (só
+    os tracks novos passam pela associação, contra os elementos ainda
+    livres); a cada atualização o desvio do track é suavizado (média móvel
+    exponencial). Um track que se afasta além do gate libera o elemento.
+    Um track sem elemento na associação só tenta de novo depois de
+    retry_every frames ou ao se mover mais que o gate desde a tentativa.
+    points: posição de cada track (pixels, ou metros com calibração);
+    classes: classe BIM de cada track. Retorna a avaliação do frame.
+    """
+    index = engine.index
+    confirmed = tracker.confirmed
+    unmatched = confirmed & (tracker.element < 0)
+    moved = np.linalg.norm(points - tracker.tried_at, axis=1) > engine.gate  # NaN (sem tentativa) = False
+    due = unmatched & ((tracker.retry <= 0) | moved)
+    tracker.retry[unmatched & ~due] -= 1
+    new = np.flatnonzero(due)
+    if len(new):
+        available = np.ones(len(index), dtype=bool)
+        available[tracker.element[tracker.element >= 0]] = False
+        element_idx, distances = engine.assign(points[new], classes[new], available)
+        tracker.element[new] = element_idx
+        tracker.deviation[new] = np.where(element_idx >= 0, distances, np.nan)
+        failed = new[element_idx < 0]
+        tracker.retry[failed] = retry_every
+        tracker.tried_at[failed] = points[failed]
+
+    held = np.flatnonzero(tracker.updated & (tracker.element >= 0))
+    if len(held):
+        offsets = points[held] - index.positions[tracker.element[held]]
+        current = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+        previous = tracker.deviation[held]
+        tracker.deviation[held] = np.where(np.isnan(previous), current,
+                                           smoothing * current + (1 - smoothing) * previous)
+        lost = held[current > engine.gate]
+        tracker.element[lost] = -1
+        tracker.deviation[lost] = np.nan
+        tracker.retry[lost] = 0
+
+    rows = np.flatnonzero(confirmed)
+    element_idx = tracker.element[rows]
+    matched = element_idx >= 0
+    expected = np.ones(len(index), dtype=bool) if visible is None else np.asarray(visible, dtype=bool)
+    found = np.zeros(len(index), dtype=bool)
+    found[element_idx[matched]] = True
+    return {
+        "score": engine.score(np.nan_to_num(tracker.deviation[rows]), matched, len(rows),
+                              engine.weights(classes[rows])),
+        "rows": rows,
+        "element_idx": element_idx,
+        "distances": tracker.deviation[rows],
+        "missing": np.flatnonzero(expected & ~found),
+    }
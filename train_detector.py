@@ -0,0 +1,198 @@
+import argparse
+import os
+import time
+
+import cv2
+
+from detector import (DetectionAdapter, MODEL_REGISTRY, calibration_images, export_model, load_config,
+                      read_registry, register_model)
+from profiling import LatencyHistogram
+
+# Classes do detector de obra (id = posição); o auto_label grava wall, beam e column como 0, 1 e 2
+DETECTOR_CLASSES = ("wall", "beam", "column", "formwork", "rebar")
+SWEEP_SIZES = (320, 384, 448, 512, 576, 640)
+RUNS_DIR = os.path.join("models", "runs")
+
+
+def read_dataset(data_path):
+    """data.yaml do Ultralytics com "path" resolvido e "names" como lista"""
+    import yaml
+
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    root = data.get("path") or ""
+    if not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.abspath(data_path)), root)
+    data["path"] = os.path.normpath(root)
+    names = data.get("names", [])
+    data["names"] = [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+    return data
+
+
+def restricted_dataset(data_path, output_dir, classes=DETECTOR_CLASSES):
+    """
+    data.yaml de treino com as classes do detector de obra. Os ids do dataset
+    precisam coincidir com a posição do nome em classes (os rótulos não são
+    reescritos); classes sem exemplos, como formwork e rebar em datasets só
+    do BIM, ficam reservadas no modelo.
+    """
+    import yaml
+
+    data = read_dataset(data_path)
+    for class_id, name in enumerate(data["names"]):
+        if class_id >= len(classes) or classes[class_id] != name:
+            raise ValueError(f"Classe {class_id} ({name}) de {data_path} fora da ordem {', '.join(classes)}")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, "data.yaml")
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({"path": data["path"], "train": data["train"], "val": data["val"],
+                        "nc": len(classes), "names": list(classes)}, f, sort_keys=False, allow_unicode=True)
+    return path
+
+
+def fine_tune(data_path, base="yolov8n.pt", imgsz=640, epochs=50, batch=16, freeze=0, output=RUNS_DIR,
+              name="construcao"):
+    """Ajusta um modelo pequeno pré-treinado às classes do dataset; devolve o caminho do best.pt"""
+    from ultralytics import YOLO
+
+    model = YOLO(base)
+    model.train(data=data_path, imgsz=imgsz, epochs=epochs, batch=batch, freeze=freeze or None,
+                project=os.path.abspath(output), name=name, exist_ok=True, plots=False, verbose=False)
+    return str(model.trainer.best)
+
+
+def validation_frames(data_path, limit=50):
+    """Frames da validação usados para medir a latência (mesma distribuição das câmeras)"""
+    data = read_dataset(data_path)
+    frames = [cv2.imread(path) for path in calibration_images(os.path.join(data["path"], data["val"]), limit)]
+    return [frame for frame in frames if frame is not None]
+
+
+def load_variant(weights, imgsz, backend, int8):
+    """Modelo exportado (ou PyTorch) no tamanho de entrada imgsz, com o mesmo cache do detector.py"""
+    from ultralytics import YOLO
+
+    config = load_config(model=weights, imgsz=imgsz, backend=backend, int8=int8)
+    artifact = weights if backend == "pytorch" else export_model(config)
+    model = YOLO(artifact, task="detect")
+    model.overrides["imgsz"] = imgsz
+    return model, artifact
+
+
+def measure_latency(model, frames, runs=100, warmup=5):
+    """Latência por frame do DetectionAdapter (o mesmo caminho do bim.py), em um histograma"""
+    adapter = DetectionAdapter(model)
+    for i in range(warmup):
+        adapter.predict([frames[i % len(frames)]])
+    histogram = LatencyHistogram()
+    for i in range(runs):
+        start = time.perf_counter()
+        adapter.predict([frames[i % len(frames)]])
+        histogram.add(time.perf_counter() - start)
+    return histogram
+
+
+def sweep(weights, data_path, sizes=SWEEP_SIZES, target_ms=50.0, backend="pytorch", int8=False, runs=100):
+    """
+    Mede cada tamanho de entrada, do menor ao maior: latência p95 no
+    DetectionAdapter e, se couber no alvo, mAP na validação (com o artefato
+    exportado, então a perda do INT8 entra na conta). Para no primeiro
+    tamanho acima do alvo, já que os maiores só seriam mais lentos.
+    """
+    frames = validation_frames(data_path)
+    if not frames:
+        raise ValueError(f"Nenhuma imagem de validação em {data_path}")
+    results = []
+    for imgsz in sorted(sizes):
+        model, artifact = load_variant(weights, imgsz, backend, int8)
+        histogram = measure_latency(model, frames, runs)
+        result = {"imgsz": imgsz, "p50_ms": round(histogram.percentile(50) * 1000, 2),
+                  "p95_ms": round(histogram.percentile(95) * 1000, 2)}
+        results.append(result)
+        if result["p95_ms"] > target_ms:
+            print(f"imgsz {imgsz}: p95 {result['p95_ms']:.1f}ms acima do alvo de {target_ms:.0f}ms")
+            break
+        metrics = validate(artifact, data_path, imgsz, backend)
+        result.update(map50=round(float(metrics.box.map50), 4), map50_95=round(float(metrics.box.map), 4))
+        print(f"imgsz {imgsz}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+              f"mAP50 {result['map50']:.3f}, mAP50-95 {result['map50_95']:.3f}")
+    return results
+
+
+def validate(artifact, data_path, imgsz, backend):
+    """Métricas de validação do ultralytics no tamanho de entrada imgsz"""
+    from ultralytics import YOLO
+
+    # Artefatos exportados com forma fixa só aceitam lote 1
+    return YOLO(artifact, task="detect").val(data=data_path, imgsz=imgsz, batch=16 if backend == "pytorch" else 1,
+                                             plots=False, verbose=False)
+
+
+def choose_size(results, target_ms):
+    """Tamanho de melhor mAP50-95 entre os que cabem no alvo; sem nenhum, o mais rápido"""
+    within = [result for result in results if result["p95_ms"] <= target_ms]
+    if not within:
+        return min(results, key=lambda result: result["p95_ms"]), False
+    return max(within, key=lambda result: (result["map50_95"], result["imgsz"])), True
+
+
+def registry_report(path=MODEL_REGISTRY):
+    lines = []
+    for name, versions in sorted(read_registry(path).items()):
+        for entry in versions:
+            lines.append(f"{name}@{entry['version']}: imgsz {entry['imgsz']}, {entry['backend']}"
+                         f"{' INT8' if entry['int8'] else ''}, p95 {entry.get('p95_ms') or 0:.1f}ms, "
+                         f"mAP50-95 {entry.get('map50_95') or 0:.3f}, {entry.get('created', '')}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Treina o detector de obra (wall, beam, column, formwork, rebar), escolhe o tamanho de "
+                    "entrada pela latência alvo e registra uma versão carregável por nome")
+    parser.add_argument("--data", default=os.path.join("dataset", "data.yaml"), help="data.yaml do dataset")
+    parser.add_argument("--name", default="construcao", help="Nome do modelo no registro")
+    parser.add_argument("--base", default="yolov8n.pt", help="Modelo pré-treinado de partida")
+    parser.add_argument("--weights", help="Pula o treino e usa estes pesos já ajustados")
+    parser.add_argument("--epochs", type=int, default=50, help="Épocas de ajuste")
+    parser.add_argument("--batch", type=int, default=16, help="Imagens por lote no treino")
+    parser.add_argument("--train-imgsz", type=int, default=640, help="Tamanho de entrada no treino")
+    parser.add_argument("--freeze", type=int, default=0, help="Congela as N primeiras camadas (datasets pequenos)")
+    parser.add_argument("--target-ms", type=float, default=50.0, help="Latência alvo (p95 por frame, ms)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SWEEP_SIZES), help="Tamanhos testados")
+    parser.add_argument("--backend", choices=("pytorch", "onnx", "openvino"), default="pytorch",
+                        help="Runtime em que a latência é medida (e com que o modelo será carregado)")
+    parser.add_argument("--int8", action="store_true", help="Quantização INT8 (onnx/openvino)")
+    parser.add_argument("--runs", type=int, default=100, help="Inferências medidas por tamanho")
+    parser.add_argument("--registry", default=MODEL_REGISTRY, help="Arquivo do registro de modelos")
+    parser.add_argument("--list", action="store_true", help="Lista os modelos registrados e sai")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(registry_report(args.registry)) or "Nenhum modelo registrado")
+        return
+
+    data_path = restricted_dataset(args.data, os.path.join(RUNS_DIR, args.name))
+    weights = args.weights
+    if weights is None:
+        start = time.perf_counter()
+        weights = fine_tune(data_path, args.base, args.train_imgsz, args.epochs, args.batch, args.freeze,
+                            name=args.name)
+        print(f"Treino concluído em {(time.perf_counter() - start) / 60:.1f} min: {weights}")
+
+    results = sweep(weights, data_path, args.sizes, args.target_ms, args.backend, args.int8, args.runs)
+    chosen, within = choose_size(results, args.target_ms)
+    if not within:
+        print(f"Aviso: nenhum tamanho atinge {args.target_ms:.0f}ms; usando imgsz {chosen['imgsz']}")
+
+    entry = register_model(args.name, weights, args.registry, imgsz=chosen["imgsz"], backend=args.backend,
+                           int8=args.int8, classes=list(DETECTOR_CLASSES), base=args.base,
+                           target_ms=args.target_ms, p50_ms=chosen["p50_ms"], p95_ms=chosen["p95_ms"],
+                           map50=chosen.get("map50"), map50_95=chosen.get("map50_95"), sweep=results,
+                           created=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    print(f"Registrado {entry['name']}@{entry['version']} (imgsz {entry['imgsz']}, p95 {entry['p95_ms']:.1f}ms)")
+    print(f"Uso: python bim.py --model {entry['name']}   ou   \"model\": \"{entry['name']}\" no detector.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
+import sys
+
 import cv2
-from ultralytics import YOLO
 
-# Carrega o modelo YOLO pré-treinado
-model = YOLO("yolo11n.pt")
+from detector import DetectionAdapter, load_detector
+from event_log import EventLog, record_event, should_log
+from inference_server import parse_source
+
+# Carrega o modelo YOLO pré-treinado (modelo e backend do detector.json)
+model = load_detector()
+detector = DetectionAdapter(model, conf=0.5)
 
-# Tenta abrir a câmera
-cap = cv2.VideoCapture(0)
+# Tenta abrir a câmera (ou a fonte passada na linha de comando)
+source = parse_source(sys.argv[1]) if len(sys.argv) > 1 else 0
+cap = cv2.VideoCapture(source)
 
 # Verifica se a câmera foi aberta com sucesso
 if not cap.isOpened():
@@ -19,51 +26,54 @@ if not cap.isOpened():
 print("Câmera aberta com sucesso! Pressione 'q' para sair.")
 print("Processando detecção de objetos em tempo real...")
 
-# Loop infinito para capturar o vídeo
-while True:
-    ret, frame = cap.read()  # Lê o frame da câmera
-    
-    # Verifica se o frame foi capturado corretamente
-    if not ret:
-        print("Erro: Não foi possível capturar o frame!")
-        break
-    
-    # Aplica a detecção YOLO no frame
-    results = model.predict(frame, conf=0.5, verbose=False)
-    
-    # Processa os resultados da detecção
-    for result in results:
-        boxes = result.boxes
-        if boxes is not None:
-            for box in boxes:
-                # Obtém as coordenadas da caixa delimitadora
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                
-                # Obtém a confiança e classe
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
-                class_name = model.names[cls]
-                
-                # Desenha a caixa delimitadora
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                
-                # Adiciona o texto com classe e confiança
-                label = f"{class_name}: {conf:.2f}"
-                cv2.putText(frame, label, (x1, y1 - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                
-                # Imprime informações no console
-                print(f"Detectado: {class_name} - Confiança: {conf:.2f}")
-    
-    # Mostra o frame processado na janela
-    cv2.imshow('Câmera com YOLO', frame)
-    
-    # Espera a tecla 'q' ser pressionada para sair do loop
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+# Detecções vão para o log de eventos (JSON lines, 1 a cada 30 frames) em segundo plano
+events = EventLog(sample_every=30)
+frame_number = 0
 
-# Libera a câmera e fecha a janela
-cap.release()
-cv2.destroyAllWindows()
-print("Programa finalizado.") 
\ No newline at end of file
+# Loop infinito para capturar o vídeo
+try:
+    while True:
+        ret, frame = cap.read()  # Lê o frame da câmera
+        
+        # Verifica se o frame foi capturado corretamente
+        if not ret:
+            print("Erro: Não foi possível capturar o frame!")
+            break
+        
+        # Aplica a detecção YOLO no frame (caixas, confianças e classes em arrays NumPy)
+        detections = detector.predict([frame])[0]
+        
+        # Processa os resultados da detecção
+        for (x1, y1, x2, y2), conf, cls in zip(detections["box"].astype(int).tolist(),
+                                               detections["conf"].tolist(), detections["cls"].tolist()):
+            class_name = model.names[cls]
+            
+            # Desenha a caixa delimitadora
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            
+            # Adiciona o texto com classe e confiança
+            label = f"{class_name}: {conf:.2f}"
+            cv2.putText(frame, label, (x1, y1 - 10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        
+        # Registra as detecções do frame (sem escrever no terminal a cada caixa); a lista só é
+        # montada nos frames escolhidos pela amostragem
+        if should_log("deteccoes"):
+            record_event("deteccoes", frame=frame_number,
+                         detections=[{"class": model.names[cls], "confidence": round(conf, 3)}
+                                     for conf, cls in zip(detections["conf"].tolist(), detections["cls"].tolist())])
+        frame_number += 1
+        
+        # Mostra o frame processado na janela
+        cv2.imshow('Câmera com YOLO', frame)
+        
+        # Espera a tecla 'q' ser pressionada para sair do loop
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+finally:
+    # Libera a câmera, fecha a janela e grava o que falta do log mesmo se o laço falhar
+    cap.release()
+    cv2.destroyAllWindows()
+    events.close()
+print("Programa finalizado.")
+print(events.report()) 
\ No newline at end of file